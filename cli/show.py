@@ -2,10 +2,25 @@
 import sys
 import re
 import os
+import hashlib
+import struct
+import tempfile
+from collections import namedtuple
 import numpy as np
 import matplotlib.pyplot as plt
 from termcolor import colored
 
+# Raw bytes of a 16-channel block decoded per step by the streaming decoder;
+# narrower captures decode the same number of samples per step (see block_bytes)
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# Capture container written by slogic_cli, see pt/src/logic_analyzer.py:
+# header, raw payload at CAPTURE_HEADER_SIZE, then the chunk index
+CAPTURE_MAGIC = b'SLOGICAP'
+CAPTURE_VERSION = 1
+CAPTURE_HEADER = struct.Struct('<8sIIIIdddQQQ')
+CHUNK_DTYPE = np.dtype([('payload_offset', '<u8'), ('stream_offset', '<u8'), ('length', '<u8')])
+
 def parse_filename(filename):
     # e.g. 8ch_400M_wave.bin or 16ch_20M_wave.bin
     m = re.match(r"(\d+)ch_(\d+)([kKmM])_wave\.bin", filename)
@@ -20,58 +35,564 @@ def parse_filename(filename):
         rate *= 1_000
     return ch, rate
 
-def extract_channels(data, num_channels):
+def sample_width(num_channels):
+    # Byte granularity of one packed sample group
+    if num_channels == 16:
+        return 2
+    elif num_channels in (8, 4, 2, 1):
+        return 1
+    raise ValueError("Unsupported channel count: %d" % num_channels)
+
+def num_samples(nbytes, num_channels):
+    return nbytes * 8 // num_channels
+
+def block_bytes(chunk_size, num_channels):
+    # Raw bytes per decode step: the samples of chunk_size bytes of a
+    # 16-channel capture, so the decoded working set does not grow with
+    # denser packing
+    width = sample_width(num_channels)
+    return max(width, chunk_size * num_channels // 16 // width * width)
+
+def read_capture_header(path):
+    # Returns a dict for capture containers, None for legacy raw files
+    with open(path, 'rb') as f:
+        head = f.read(CAPTURE_HEADER.size)
+        if len(head) < CAPTURE_HEADER.size or not head.startswith(CAPTURE_MAGIC):
+            return None
+        (_, version, header_size, num_channels, _, sample_rate, voltage, start_time,
+         payload_size, index_offset, index_count) = CAPTURE_HEADER.unpack(head)
+        if version != CAPTURE_VERSION:
+            raise ValueError("Unsupported capture version: %d" % version)
+        if payload_size == 0:
+            # Not finalized: payload runs to the end of the file
+            payload_size = os.fstat(f.fileno()).st_size - header_size
+        chunks = np.zeros(0, dtype=CHUNK_DTYPE)
+        if index_count:
+            f.seek(index_offset)
+            chunks = np.frombuffer(f.read(index_count * CHUNK_DTYPE.itemsize), dtype=CHUNK_DTYPE)
+    return {
+        'num_channels': num_channels,
+        'sample_rate': sample_rate,
+        'voltage': voltage or None,
+        'start_time': start_time or None,
+        'payload_offset': header_size,
+        'payload_size': payload_size,
+        'chunks': chunks,
+    }
+
+def gap_samples(header):
+    # Sample positions right after each dropped range: no edge or period may
+    # join the samples on both sides. Empty for legacy files (header None).
+    if header is None:
+        return np.zeros(0, dtype=np.int64)
+    chunks = header['chunks']
+    ends = chunks['stream_offset'][:-1] + chunks['length'][:-1]
+    gaps = np.flatnonzero(chunks['stream_offset'][1:] > ends)
+    return np.array([num_samples(int(chunks['payload_offset'][i + 1]), header['num_channels']) for i in gaps],
+                    dtype=np.int64)
+
+def load_capture(path, header=None):
+    # Read-only memory map of the raw payload: slices are views into the
+    # page cache, so only the regions that get decoded are read from disk
+    if header is None:
+        header = read_capture_header(path)
+    if header is None:
+        offset, size = 0, os.path.getsize(path)
+    else:
+        offset, size = header['payload_offset'], header['payload_size']
+    if size <= 0:
+        return np.empty(0, dtype=np.uint8)
+    return np.memmap(path, dtype=np.uint8, mode='r', offset=offset, shape=(size,))
+
+def extract_region(raw, num_channels, start, count):
+    # Decode only samples [start, start + count)
+    first = start * num_channels // 8
+    stop = -(-(start + count) * num_channels // 8)
+    channels = extract_channels(raw[first:stop], num_channels)
+    skip = start - num_samples(first, num_channels)
+    return [c[skip:skip + count] for c in channels]
+
+# Sub-byte modes: byte value -> the samples it holds, first sample in the
+# low bits (4ch: two nibbles, 2ch: four 2-bit groups)
+_UNPACK_LUT = {
+    n: np.array([[(b >> (n * k)) & ((1 << n) - 1) for k in range(8 // n)]
+                 for b in range(256)], dtype=np.uint8)
+    for n in (4, 2)
+}
+
+def decode_words(data, num_channels):
+    # One integer word per sample, bit i holding channel i
     if num_channels == 16:
         # Each sample is 2 bytes, little-endian
-        data = np.frombuffer(data, dtype=np.uint16)
-        channels = [(data >> i) & 1 for i in range(16)]
+        return np.frombuffer(data, dtype=np.uint16)
     elif num_channels == 8:
         # Each sample is 1 byte
-        data = np.frombuffer(data, dtype=np.uint8)
-        channels = [(data >> i) & 1 for i in range(8)]
-    elif num_channels == 4:
-        # Each sample is 4 bits (packed two samples per byte)
-        data = np.frombuffer(data, dtype=np.uint8)
-        # Unpack nibbles
-        n = len(data) * 2
-        unpacked = np.empty(n, dtype=np.uint8)
-        unpacked[0::2] = data & 0x0F
-        unpacked[1::2] = (data >> 4) & 0x0F
-        channels = [(unpacked >> i) & 1 for i in range(4)]
+        return np.frombuffer(data, dtype=np.uint8)
+    elif num_channels in _UNPACK_LUT:
+        # 4ch: two samples per byte, 2ch: four samples per byte
+        return _UNPACK_LUT[num_channels][np.frombuffer(data, dtype=np.uint8)].ravel()
+    elif num_channels == 1:
+        # Eight samples per byte, LSB first
+        return np.unpackbits(np.frombuffer(data, dtype=np.uint8), bitorder='little')
+    raise ValueError("Unsupported channel count: %d" % num_channels)
+
+def extract_channels(data, num_channels):
+    words = decode_words(data, num_channels)
+    return [(words >> i) & 1 for i in range(num_channels)]
+
+def _iter_chunks(source, chunk_size):
+    if hasattr(source, 'read'):
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
     else:
-        raise ValueError("Unsupported channel count: %d" % num_channels)
-    return channels
+        view = memoryview(source).cast('B')
+        for pos in range(0, len(view), chunk_size):
+            yield view[pos:pos + chunk_size]
 
-def detect_pwm_freq(samples, sample_rate):
-    # Find rising edges (0->1)
-    edges = np.where((samples[:-1] == 0) & (samples[1:] == 1))[0]
-    if len(edges) < 2:
+def iter_words(source, num_channels, chunk_size=CHUNK_SIZE):
+    # Decode block_bytes(chunk_size, num_channels) bytes per step, the same
+    # number of samples for every channel count, so memory stays bounded.
+    # Partial samples left over by short reads go into the next block.
+    width = sample_width(num_channels)
+    pending = b''
+    for chunk in _iter_chunks(source, block_bytes(chunk_size, num_channels)):
+        if pending:
+            chunk = pending + bytes(chunk)
+        usable = len(chunk) - len(chunk) % width
+        pending = bytes(chunk[usable:])
+        if usable:
+            yield decode_words(chunk[:usable], num_channels)
+
+def iter_channel_blocks(source, num_channels, chunk_size=CHUNK_SIZE):
+    for words in iter_words(source, num_channels, chunk_size):
+        yield [(words >> i) & 1 for i in range(num_channels)]
+
+def iter_channel(source, num_channels, ch, chunk_size=CHUNK_SIZE):
+    for channels in iter_channel_blocks(source, num_channels, chunk_size):
+        yield channels[ch]
+
+def _as_blocks(samples):
+    if isinstance(samples, np.ndarray):
+        return (samples,)
+    return samples
+
+class RisingEdgeScanner:
+    # Push-style rising edge scanner for a stream of sample blocks.
+    #
+    # feed() returns (edges, highs) for a block: edges holds the absolute index
+    # of the last low sample before each 0->1 transition, highs the number of
+    # high samples preceding that index. The last sample of each block is
+    # carried over so edges straddling a block boundary are not lost.
+
+    def __init__(self):
+        self.offset = 0
+        self.high_total = 0
+        self.prev = None
+
+    def feed(self, block):
+        n = len(block)
+        if n == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        found = np.flatnonzero((block[:-1] == 0) & (block[1:] == 1))
+        # High samples between consecutive edges, without an n-sized cumsum
+        bounds = np.concatenate(([0], found))
+        segments = np.add.reduceat(block, bounds, dtype=np.int64)
+        segments[:-1][found == bounds[:-1]] = 0
+        counts = self.high_total + np.cumsum(segments)
+        highs = counts[:-1]
+        edges = self.offset + found
+        if self.prev == 0 and block[0] == 1:
+            edges = np.concatenate(([self.offset - 1], edges))
+            highs = np.concatenate(([self.high_total], highs))
+        self.offset += n
+        self.high_total = int(counts[-1])
+        self.prev = block[-1]
+        return edges, highs
+
+def iter_rising_edges(blocks):
+    # Yield (edges, highs) per block, see RisingEdgeScanner.
+    scanner = RisingEdgeScanner()
+    for block in _as_blocks(blocks):
+        if len(block):
+            yield scanner.feed(block)
+
+# PWM statistics over all complete periods; periods are in samples
+PwmStats = namedtuple('PwmStats', [
+    'periods', 'freq',
+    'period_mean', 'period_min', 'period_max', 'period_std',
+    'duty_mean', 'duty_min', 'duty_max', 'duty_std',
+])
+
+class RunningStats:
+    # Count, mean, standard deviation and extrema of a stream of values.
+    #
+    # Values are merged (Chan et al.) in fixed groups of GROUP values, whatever
+    # the sizes passed to add(), so the result depends only on the sequence of
+    # values and matches pt/src/logic_analyzer.py bit for bit; both tools write
+    # the same analysis cache entries.
+    GROUP = 4096
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self._pending = np.zeros(0, dtype=np.float64)
+
+    @staticmethod
+    def _merge(state, group):
+        count, mean, m2 = state
+        n = len(group)
+        group_mean = float(np.mean(group))
+        d = group - group_mean
+        delta = group_mean - mean
+        total = count + n
+        return total, mean + delta * n / total, m2 + float(np.dot(d, d)) + delta * delta * count * n / total
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        if len(self._pending):
+            values = np.concatenate((self._pending, values))
+        full = len(values) - len(values) % self.GROUP
+        state = (self.count, self.mean, self.m2)
+        for pos in range(0, full, self.GROUP):
+            state = self._merge(state, values[pos:pos + self.GROUP])
+        self.count, self.mean, self.m2 = state
+        self._pending = values[full:].copy()
+
+    def __len__(self):
+        return self.count + len(self._pending)
+
+    def result(self):
+        # (mean, min, max, std), or None if no value was added
+        state = (self.count, self.mean, self.m2)
+        if len(self._pending):
+            state = self._merge(state, self._pending)
+        count, mean, m2 = state
+        if count == 0:
+            return None
+        return mean, self.min, self.max, float(np.sqrt(m2 / count))
+
+def _pwm_stats(sample_rate, period, duty):
+    if len(period) == 0:
         return None
-    periods = np.diff(edges)  # in samples
-    avg_period = np.mean(periods)
-    if avg_period == 0:
+    period_stats = period.result()
+    freq = sample_rate / period_stats[0] if sample_rate else None
+    return PwmStats(len(period), freq, *period_stats, *duty.result())
+
+class PwmAccumulator:
+    # Running per-period PWM statistics, fed one block at a time.
+    #
+    # A period spans two consecutive rising edges. Only RunningStats are kept,
+    # so memory does not grow with the capture length.
+
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+        self.scanner = RisingEdgeScanner()
+        self.last_edge = self.last_high = None
+        self.period = RunningStats()
+        self.duty = RunningStats()
+
+    @property
+    def count(self):
+        return len(self.period)
+
+    def restart(self, offset):
+        # Forget the signal history (after dropped data) but keep the statistics
+        self.scanner = RisingEdgeScanner()
+        self.scanner.offset = offset
+        self.last_edge = self.last_high = None
+
+    def feed(self, block):
+        edges, highs = self.scanner.feed(block)
+        if len(edges) == 0:
+            return
+        if self.last_edge is not None:
+            edges = np.concatenate(([self.last_edge], edges))
+            highs = np.concatenate(([self.last_high], highs))
+        if len(edges) > 1:
+            periods = np.diff(edges).astype(np.float64)
+            self.period.add(periods)
+            self.duty.add(np.diff(highs) / periods)
+        self.last_edge, self.last_high = edges[-1], highs[-1]
+
+    def result(self):
+        # Return PwmStats, or None if fewer than two rising edges were seen.
+        return _pwm_stats(self.sample_rate, self.period, self.duty)
+
+def measure_pwm(samples, sample_rate):
+    # PWM statistics of one channel given as an array or iterable of blocks.
+    acc = PwmAccumulator(sample_rate)
+    for block in _as_blocks(samples):
+        acc.feed(block)
+    return acc.result()
+
+def _split_at_gaps(blocks, gaps):
+    # Yield (start, block, restart) with blocks cut at the gap positions;
+    # restart is set on pieces that begin right after a gap
+    pos = 0
+    for block in blocks:
+        stop = pos + len(block)
+        cuts = gaps[(gaps >= pos) & (gaps < stop)]
+        bounds = np.concatenate(([pos], cuts, [stop]))
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            if end > start:
+                yield int(start), block[start - pos:end - pos], bool(np.any(cuts == start))
+        pos = stop
+
+def measure_channels(source, num_channels, sample_rate, chunk_size=CHUNK_SIZE, gaps=None):
+    # PWM statistics of every channel of a raw capture in a single pass.
+    # gaps (see gap_samples) restart the edge and period state of every channel.
+    accs = [PwmAccumulator(sample_rate) for _ in range(num_channels)]
+    gaps = np.zeros(0, dtype=np.int64) if gaps is None else np.asarray(gaps, dtype=np.int64)
+    for start, words, restart in _split_at_gaps(iter_words(source, num_channels, chunk_size), gaps):
+        for ch, acc in enumerate(accs):
+            if restart:
+                acc.restart(start)
+            acc.feed((words >> ch) & 1)
+    return [acc.result() for acc in accs]
+
+def detect_pwm_freq(samples, sample_rate):
+    stats = measure_pwm(samples, sample_rate)
+    if stats is None:
         return None
-    freq = sample_rate / avg_period
-    return freq
+    return stats.freq
 
 def check_pwm_duty(samples):
-    # Find rising edges (0->1)
-    edges = np.where((samples[:-1] == 0) & (samples[1:] == 1))[0]
-    if len(edges) < 2:
+    stats = measure_pwm(samples, None)
+    if stats is None:
         return None
-    # Analyze each period
-    duty_cycles = []
-    for i in range(len(edges) - 1):
-        period = samples[edges[i]:edges[i+1]]
-        if len(period) == 0:
-            continue
-        high = np.count_nonzero(period)
-        duty = high / len(period)
-        duty_cycles.append(duty)
-    if not duty_cycles:
+    return stats.duty_mean
+
+# Analysis cache, shared with the PT GUI (pt/src/analysis_cache.py)
+CACHE_DIR = os.environ.get('SLOGIC_CACHE_DIR') or os.path.join(
+    os.path.expanduser('~'), '.cache', 'slogic16u3')
+MAX_CACHE_BYTES = 1024 * 1024 * 1024
+HASH_BLOCK = 64 * 1024
+HASH_PROBES = 16
+# Must match pt/src/analysis_cache.py, which bumps it when results change
+CACHE_VERSION = 2
+
+def capture_key(path, num_channels):
+    # Size, mtime and a hash of head, tail and evenly spaced blocks
+    st = os.stat(path)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{CACHE_VERSION}:{num_channels}:{st.st_size}:{st.st_mtime_ns}".encode())
+    with open(path, 'rb') as f:
+        span = max(st.st_size - HASH_BLOCK, 0)
+        for i in range(HASH_PROBES + 2):
+            f.seek(span * i // (HASH_PROBES + 1))
+            h.update(f.read(HASH_BLOCK))
+    return h.hexdigest()
+
+def load_cached_stats(key, sample_rate):
+    entry = os.path.join(CACHE_DIR, key + '.npz')
+    try:
+        with np.load(entry) as data:
+            if 'stats' not in data.files or data['sample_rate'] != sample_rate:
+                return None
+            table = data['stats']
+        os.utime(entry)
+    except (OSError, ValueError):
         return None
-    avg_duty = np.mean(duty_cycles)
-    return avg_duty
+    results = []
+    for row in table:
+        if np.isnan(row[0]):
+            results.append(None)
+        else:
+            values = [None if np.isnan(v) else float(v) for v in row]
+            results.append(PwmStats(int(row[0]), *values[1:]))
+    return results
+
+def store_cached_stats(key, results, sample_rate):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    entry = os.path.join(CACHE_DIR, key + '.npz')
+    arrays = {}
+    try:
+        # Keep the edge arrays the PT GUI may have stored for this capture
+        with np.load(entry) as data:
+            arrays = {name: data[name] for name in data.files}
+    except (OSError, ValueError):
+        pass
+    table = np.full((len(results), len(PwmStats._fields)), np.nan)
+    for ch, stats in enumerate(results):
+        if stats is not None:
+            table[ch] = [np.nan if v is None else v for v in stats]
+    arrays.update(stats=table, sample_rate=float(sample_rate))
+    fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, entry)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    # Evict least recently used entries beyond the size limit; the PT GUI
+    # evicts concurrently, so entries that disappear meanwhile are skipped
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        if name.endswith('.npz') and name != key + '.npz':
+            try:
+                st = os.stat(os.path.join(CACHE_DIR, name))
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+    total = sum(size for _, size, _ in entries)
+    try:
+        total += os.path.getsize(entry)
+    except FileNotFoundError:
+        pass
+    for _, size, name in sorted(entries):
+        if total <= MAX_CACHE_BYTES:
+            break
+        try:
+            os.unlink(os.path.join(CACHE_DIR, name))
+        except FileNotFoundError:
+            pass
+        total -= size
+
+# Samples per cell of the finest pyramid level, and cells merged per level
+PYRAMID_BASE = 256
+PYRAMID_FACTOR = 4
+
+class MinMaxPyramid:
+    # Multi-resolution min/max summary of a capture for plotting.
+    #
+    # Level k holds one (lo, hi) word pair per PYRAMID_BASE * PYRAMID_FACTOR**k
+    # samples: lo is the AND and hi the OR of all sample words in the cell, so
+    # bit ch of lo/hi is the min/max of channel ch. Any view is drawn from
+    # O(pixels) cells of the coarsest level that still resolves it.
+
+    def __init__(self, levels, num_samples):
+        self.levels = levels
+        self.num_samples = num_samples
+
+    @classmethod
+    def build(cls, raw, num_channels, chunk_size=CHUNK_SIZE):
+        los, his = [], []
+        n = 0
+        pending = None
+        for words in iter_words(raw, num_channels, chunk_size):
+            n += len(words)
+            if pending is not None:
+                words = np.concatenate((pending, words))
+            full = len(words) - len(words) % PYRAMID_BASE
+            cells = words[:full].reshape(-1, PYRAMID_BASE)
+            los.append(np.bitwise_and.reduce(cells, axis=1))
+            his.append(np.bitwise_or.reduce(cells, axis=1))
+            pending = words[full:]
+        if pending is not None and len(pending):
+            los.append(np.bitwise_and.reduce(pending, keepdims=True))
+            his.append(np.bitwise_or.reduce(pending, keepdims=True))
+        if not los:
+            return cls([], n)
+        lo, hi = np.concatenate(los), np.concatenate(his)
+        levels = [(lo, hi)]
+        while len(lo) > 1:
+            # Padding with the last cell is harmless for AND/OR
+            pad = (-len(lo)) % PYRAMID_FACTOR
+            lo = np.bitwise_and.reduce(np.pad(lo, (0, pad), mode='edge').reshape(-1, PYRAMID_FACTOR), axis=1)
+            hi = np.bitwise_or.reduce(np.pad(hi, (0, pad), mode='edge').reshape(-1, PYRAMID_FACTOR), axis=1)
+            levels.append((lo, hi))
+        return cls(levels, n)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            count = len(data.files) // 2
+            levels = [(data[f'lo_{k}'], data[f'hi_{k}']) for k in range(count)]
+            return cls(levels, int(data['num_samples']))
+
+    def save(self, path):
+        arrays = {'num_samples': self.num_samples}
+        for k, (lo, hi) in enumerate(self.levels):
+            arrays[f'lo_{k}'] = lo
+            arrays[f'hi_{k}'] = hi
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def query(self, start, stop, pixels):
+        # Returns (cell start positions, lo, hi) for [start, stop), or None if
+        # the view is too narrow for the finest level and raw samples are needed
+        per_pixel = (stop - start) / max(pixels, 1)
+        if per_pixel < PYRAMID_BASE or not self.levels:
+            return None
+        k = min(int(np.log(per_pixel / PYRAMID_BASE) / np.log(PYRAMID_FACTOR)), len(self.levels) - 1)
+        cell = PYRAMID_BASE * PYRAMID_FACTOR ** k
+        lo, hi = self.levels[k]
+        first, last = start // cell, min(-(-stop // cell), len(lo))
+        return np.arange(first, last) * cell, lo[first:last], hi[first:last]
+
+def load_pyramid(filename, key, raw, num_channels):
+    # The pyramid is kept next to the analysis cache entry of the capture
+    path = os.path.join(CACHE_DIR, key + '.pyr.npz')
+    try:
+        pyramid = MinMaxPyramid.load(path)
+        os.utime(path)
+        return pyramid
+    except (OSError, ValueError, KeyError):
+        pass
+    pyramid = MinMaxPyramid.build(raw, num_channels)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    pyramid.save(path)
+    return pyramid
+
+class WaveView:
+    # Redraws the visible window from the pyramid whenever the x range changes
+
+    def __init__(self, ax, raw, num_channels, pyramid, labels):
+        self.ax = ax
+        self.raw = raw
+        self.num_channels = num_channels
+        self.pyramid = pyramid
+        self.lines = [ax.plot([], [], drawstyle='steps-post', label=label)[0] for label in labels]
+        self.bands = [None] * num_channels
+        ax.set_xlim(0, max(pyramid.num_samples, 1))
+        ax.set_ylim(num_channels * 2, -1)
+        ax.callbacks.connect('xlim_changed', self.update)
+        self.update(ax)
+
+    def update(self, ax):
+        left, right = ax.get_xlim()
+        start = int(max(left, 0))
+        stop = int(min(np.ceil(right), self.pyramid.num_samples))
+        if stop <= start:
+            return
+        pixels = int(ax.get_window_extent().width) or 1000
+        cells = self.pyramid.query(start, stop, pixels)
+        if cells is None:
+            x = np.arange(start, stop)
+            channels = extract_region(self.raw, self.num_channels, start, stop - start)
+            levels = [(samples, samples) for samples in channels]
+        else:
+            x, lo, hi = cells
+            levels = [((lo >> ch) & 1, (hi >> ch) & 1) for ch in range(self.num_channels)]
+        # Repeat the last cell so steps-post covers it up to `stop`
+        x = np.append(x, stop)
+        for ch, (lo, hi) in enumerate(levels):
+            lo = np.append(lo, lo[-1:]) + ch * 2
+            hi = np.append(hi, hi[-1:]) + ch * 2
+            line = self.lines[ch]
+            line.set_data(x, hi)
+            if self.bands[ch] is not None:
+                self.bands[ch].remove()
+            # Cells holding both levels are drawn as a filled band
+            self.bands[ch] = ax.fill_between(x, lo, hi, step='post', color=line.get_color(), alpha=0.4, linewidth=0)
+        ax.figure.canvas.draw_idle()
 
 CHANNEL_SAMPLE_DESIRED = [
     (10*10**6, 50),
@@ -86,24 +607,40 @@ CHANNEL_SAMPLE_DESIRED = [
 
 def main():
     if len(sys.argv) != 2:
-        print("Usage: python3 main.py <xch_xM_wave.bin>")
+        print("Usage: python3 show.py <capture file or xch_xM_wave.bin>")
         sys.exit(1)
     filename = sys.argv[1]
     base_filename = os.path.basename(filename)
-    num_channels, sample_rate = parse_filename(base_filename)
-    print(f"Detected: {num_channels} channels, {sample_rate} Hz sample rate")
-
-    with open(filename, "rb") as f:
-        raw = f.read()
+    header = read_capture_header(filename)
+    if header is None:
+        # Legacy raw capture, described by its name only
+        num_channels, sample_rate = parse_filename(base_filename)
+    else:
+        num_channels, sample_rate = header['num_channels'], header['sample_rate']
+    print(f"Detected: {num_channels} channels, {sample_rate:.0f} Hz sample rate")
+    if header is not None:
+        chunks = header['chunks']
+        if header['voltage']:
+            print(f"Voltage threshold: {header['voltage']:g} mV")
+        starts = chunks['stream_offset'].astype(np.int64)
+        gaps = starts[1:] - (starts[:-1] + chunks['length'][:-1].astype(np.int64))
+        if np.any(gaps > 0):
+            print(f"Chunks: {len(chunks)}, dropped {int(gaps[gaps > 0].sum())} bytes in {np.count_nonzero(gaps > 0)} gaps")
 
-    channels = extract_channels(raw, num_channels)
-    print(f"Total samples: {len(channels[0])}")
+    raw = load_capture(filename, header)
+    print(f"Total samples: {num_samples(len(raw), num_channels)}")
+    # Measure over the whole capture
+    key = capture_key(filename, num_channels)
+    results = load_cached_stats(key, sample_rate)
+    if results is None:
+        results = measure_channels(raw, num_channels, sample_rate, gaps=gap_samples(header))
+        store_cached_stats(key, results, sample_rate)
 
-    plt.figure(figsize=(12, 6))
+    labels = []
     for ch in range(num_channels):
-        samples = channels[ch][:1000]
-        freq = detect_pwm_freq(samples, sample_rate)
-        duty = check_pwm_duty(samples)
+        stats = results[ch]
+        freq = stats.freq if stats else None
+        duty = stats.duty_mean if stats else None
         # Prepare label for both console and plot
         if freq:
             freq_str = f"{freq/1e6:.6f}MHz"
@@ -115,18 +652,25 @@ def main():
             duty_str = "N/A"
 
         # Remove validation and fail print
-        label = f'CH{ch} ({freq_str}, {duty_str})'
+        labels.append(f'CH{ch} ({freq_str}, {duty_str})')
         # Print to console
         print(f"CH{ch}: PWM freq = {freq_str}, duty cycle = {duty_str}")
-        plt.plot(samples + ch*2, label=label)
-    plt.legend(loc='upper right', fontsize='small')
+        if stats:
+            print(f"  periods = {stats.periods}, "
+                  f"period = {stats.period_min:.0f}..{stats.period_max:.0f} samples (std {stats.period_std:.3f}), "
+                  f"duty = {stats.duty_min*100:.2f}..{stats.duty_max*100:.2f}% (std {stats.duty_std*100:.3f}%)")
+
+    # Full-capture overview; zooming re-reads only the visible pyramid cells
+    pyramid = load_pyramid(filename, key, raw, num_channels)
+    fig, ax = plt.subplots(figsize=(12, 6))
+    view = WaveView(ax, raw, num_channels, pyramid, labels)
+    ax.legend(loc='upper right', fontsize='small')
 
-    plt.title(base_filename)
+    ax.set_title(base_filename)
 
-    plt.xlabel("Sample Index")
-    plt.ylabel("Logic Level (offset by channel)")
-    plt.tight_layout()
-    plt.gca().invert_yaxis()
+    ax.set_xlabel("Sample Index")
+    ax.set_ylabel("Logic Level (offset by channel)")
+    fig.tight_layout()
     plt.show()
 
 if __name__ == "__main__":
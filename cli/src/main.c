@@ -6,6 +6,11 @@
 #include <libusb-1.0/libusb.h>
 
 #include <unistd.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <signal.h>
+#include <sys/mman.h>
+#include <pthread.h>
 
 #define USB_VID_SIPEED 0x359f
 #define USB_PID_SLOGIC16U3 0x3031
@@ -21,6 +26,72 @@
 #define BULK_TIMEOUT 1000
 #define TRANSFER_SIZE 4096*512
 
+// 采集文件格式 (小端), 与 pt/src/logic_analyzer.py 保持一致:
+//   0x0000 capture_header, 补零到 CAPTURE_HEADER_SIZE
+//   0x1000 原始采样数据 (与旧 *_wave.bin 相同的打包方式)
+//   ...    capture_chunk 索引, 每个写入块一条
+// payload_size == 0 表示文件未正常结束, 数据一直到文件末尾且没有索引
+#define CAPTURE_MAGIC "SLOGICAP"
+#define CAPTURE_VERSION 1
+#define CAPTURE_HEADER_SIZE 4096
+
+// 实时流 (--stream), 格式与采集文件相同但没有结尾索引:
+//   补零到 CAPTURE_HEADER_SIZE 的 capture_header (payload_size 为 0)
+//   之后每个块: capture_chunk 记录 + length 字节原始数据
+// payload_offset 为已写入流的数据量, stream_offset 不连续处即丢弃的块
+#define STREAM_SLOTS 8
+
+// 共享内存环形缓冲 (--ring), 文件映射, 可放在 /dev/shm:
+//   0x0000 ring_header, 补零到 CAPTURE_HEADER_SIZE
+//   0x1000 capacity 字节的数据区, 每个块: capture_chunk 记录 + 数据 (8 字节对齐)
+// 记录不跨越数据区末尾: 剩余空间放不下时写一个 length 为 RING_WRAP 的记录
+// (剩余不足一个记录时省略) 并从 0 重新开始. write_pos/read_pos 只增不减,
+// 数据区满时整块丢弃并计入溢出计数, 已写入但未读的数据不会被覆盖
+// 每次采集先删除旧文件再新建, 仍映射着旧文件的读端不受影响 (不会被截断);
+// producer_pid 供读端判断生产者是否仍在运行
+#define RING_MAGIC "SLOGRING"
+#define RING_VERSION 2
+#define RING_DEFAULT_SIZE_MB 256
+#define RING_WRAP UINT64_MAX
+
+typedef struct {
+    char magic[8];
+    uint32_t version;
+    uint32_t header_size;
+    uint32_t num_channels;
+    uint32_t flags;
+    double sample_rate;         // Hz
+    double voltage_threshold;   // mV
+    double start_time;          // Unix 时间, 秒
+    uint64_t payload_size;
+    uint64_t index_offset;
+    uint64_t index_count;
+} capture_header;
+
+typedef struct {
+    uint64_t payload_offset;    // 在数据区中的偏移
+    uint64_t stream_offset;     // 在 USB 数据流中的偏移, 不连续处即丢弃的数据
+    uint64_t length;
+} capture_chunk;
+
+typedef struct {
+    char magic[8];
+    uint32_t version;
+    uint32_t header_size;
+    uint32_t num_channels;
+    uint32_t flags;
+    double sample_rate;         // Hz
+    double voltage_threshold;   // mV
+    double start_time;          // Unix 时间, 秒
+    uint64_t capacity;          // 数据区大小
+    uint64_t write_pos;         // 生产者游标, 记录写完后更新
+    uint64_t read_pos;          // 消费者游标, 由读端更新
+    uint64_t dropped_bytes;     // 溢出计数
+    uint64_t dropped_blocks;
+    uint64_t closed;            // 采集结束后置 1
+    uint64_t producer_pid;      // 写入进程的 PID
+} ring_header;
+
 // 设备上下文结构
 typedef struct {
     libusb_device_handle *dev_handle;
@@ -34,6 +105,30 @@ typedef struct {
     struct libusb_transfer *transfers[NUM_TRANSFERS];
     int active_transfers;
     int should_stop;
+
+    FILE *wave_fp;
+    capture_header header;
+    capture_chunk *chunks;
+    size_t chunk_count;
+    size_t chunk_capacity;
+
+    // 实时流: USB 回调只把块拷贝到空闲槽, 由写线程写出, 读端跟不上时整块丢弃
+    int stream_fd;
+    pthread_t stream_thread;
+    pthread_mutex_t stream_lock;
+    pthread_cond_t stream_cond;
+    uint8_t *stream_buf[STREAM_SLOTS];
+    capture_chunk stream_chunk[STREAM_SLOTS];
+    size_t stream_head;         // 下一个写入的槽
+    size_t stream_count;        // 待写出的槽数
+    uint64_t stream_written;
+    uint64_t stream_dropped;
+    int stream_closing;
+
+    // 共享内存环形缓冲, 在 USB 回调中直接写入
+    ring_header *ring;
+    uint8_t *ring_data;
+    size_t ring_map_size;
 } slogic16u3_context;
 
 // error: redefinition of ‘__uint16_identity’
@@ -431,8 +526,41 @@ static int slogic16u3_stop_acquisition(libusb_device_handle *dev_handle)
                                   (uint8_t*)cmd_stop, sizeof(cmd_stop), 500);
 }
 
-// 查找并打开设备
-static libusb_device_handle* find_and_open_device(libusb_context *ctx)
+// 设备位置 "<bus>-<port>[.<port>...]", 与 Linux sysfs 设备名一致
+static void device_location(libusb_device *dev, char *buf, size_t len)
+{
+    uint8_t ports[8];
+    int n = libusb_get_port_numbers(dev, ports, sizeof(ports));
+    int pos = snprintf(buf, len, "%u-", libusb_get_bus_number(dev));
+    for (int i = 0; i < n && pos > 0 && (size_t)pos < len; i++) {
+        pos += snprintf(buf + pos, len - pos, i ? ".%u" : "%u", ports[i]);
+    }
+}
+
+// 列出所有已连接的 SLogic16U3, 每行一个位置
+static int list_devices(libusb_context *ctx)
+{
+    libusb_device **devs;
+    char location[64];
+    ssize_t cnt = libusb_get_device_list(ctx, &devs);
+    if (cnt < 0) {
+        fprintf(stderr, "Error: Failed to get device list\n");
+        return -1;
+    }
+    for (ssize_t i = 0; i < cnt; i++) {
+        struct libusb_device_descriptor desc;
+        if (libusb_get_device_descriptor(devs[i], &desc) == 0 &&
+            desc.idVendor == USB_VID_SIPEED && desc.idProduct == USB_PID_SLOGIC16U3) {
+            device_location(devs[i], location, sizeof(location));
+            printf("%s\n", location);
+        }
+    }
+    libusb_free_device_list(devs, 1);
+    return 0;
+}
+
+// 查找并打开设备; location 非 NULL 时只打开该位置的设备
+static libusb_device_handle* find_and_open_device(libusb_context *ctx, const char *location)
 {
     libusb_device **devs;
     libusb_device_handle *dev_handle = NULL;
@@ -450,7 +578,12 @@ static libusb_device_handle* find_and_open_device(libusb_context *ctx)
         
         if (libusb_get_device_descriptor(dev, &desc) == 0) {
             if (desc.idVendor == USB_VID_SIPEED && desc.idProduct == USB_PID_SLOGIC16U3) {
-                printf("Found SLogic16U3 device\n");
+                char found[64];
+                device_location(dev, found, sizeof(found));
+                if (location && strcmp(location, found) != 0) {
+                    continue;
+                }
+                printf("Found SLogic16U3 device at %s\n", found);
                 
                 int ret = libusb_open(dev, &dev_handle);
                 if (ret == 0) {
@@ -476,6 +609,348 @@ static libusb_device_handle* find_and_open_device(libusb_context *ctx)
 
 static uint64_t bytes_received_all = 0;
 
+// 采集文件名: 整数 MHz 用 M, 否则用 K (如 1500K)
+static void capture_filename(slogic16u3_context *ctx, char *filename, size_t len)
+{
+    if (ctx->cur_samplerate % 1000000 == 0) {
+        snprintf(filename, len, "%uch_%luM_wave.bin", ctx->cur_samplechannel, ctx->cur_samplerate/1000000);
+    } else {
+        snprintf(filename, len, "%uch_%luK_wave.bin", ctx->cur_samplechannel, ctx->cur_samplerate/1000);
+    }
+}
+
+static int capture_write_header(slogic16u3_context *ctx)
+{
+    uint8_t block[CAPTURE_HEADER_SIZE] = { 0 };
+    memcpy(block, &ctx->header, sizeof(ctx->header));
+    if (fseek(ctx->wave_fp, 0, SEEK_SET) != 0 ||
+        fwrite(block, 1, sizeof(block), ctx->wave_fp) != sizeof(block)) {
+        perror("Failed to write capture header");
+        return -1;
+    }
+    return 0;
+}
+
+static void capture_init_header(slogic16u3_context *ctx, capture_header *header)
+{
+    struct timeval tv;
+
+    gettimeofday(&tv, NULL);
+    memset(header, 0, sizeof(*header));
+    memcpy(header->magic, CAPTURE_MAGIC, sizeof(header->magic));
+    header->version = CAPTURE_VERSION;
+    header->header_size = CAPTURE_HEADER_SIZE;
+    header->num_channels = ctx->cur_samplechannel;
+    header->sample_rate = (double)ctx->cur_samplerate;
+    header->voltage_threshold = (ctx->voltage_threshold[0] + ctx->voltage_threshold[1]) / 2.0;
+    header->start_time = tv.tv_sec + tv.tv_usec / 1e6;
+}
+
+static int capture_open(slogic16u3_context *ctx)
+{
+    char filename[64];
+
+    capture_filename(ctx, filename, sizeof(filename));
+    ctx->wave_fp = fopen(filename, "wb");
+    if (!ctx->wave_fp) {
+        perror("Failed to open wave file");
+        return -1;
+    }
+
+    capture_init_header(ctx, &ctx->header);
+    ctx->chunk_count = 0;
+    return capture_write_header(ctx);
+}
+
+// 追加一个数据块并记录它在数据流中的位置
+static int capture_append(slogic16u3_context *ctx, const uint8_t *data, size_t len, uint64_t stream_offset)
+{
+    if (!ctx->wave_fp && capture_open(ctx) < 0) {
+        return -1;
+    }
+    if (ctx->chunk_count == ctx->chunk_capacity) {
+        size_t capacity = ctx->chunk_capacity ? ctx->chunk_capacity * 2 : 64;
+        capture_chunk *chunks = realloc(ctx->chunks, capacity * sizeof(capture_chunk));
+        if (!chunks) {
+            fprintf(stderr, "Failed to grow chunk index\n");
+            return -1;
+        }
+        ctx->chunks = chunks;
+        ctx->chunk_capacity = capacity;
+    }
+    if (fseek(ctx->wave_fp, CAPTURE_HEADER_SIZE + ctx->header.payload_size, SEEK_SET) != 0 ||
+        fwrite(data, 1, len, ctx->wave_fp) != len) {
+        perror("Failed to write wave file");
+        return -1;
+    }
+    fflush(ctx->wave_fp);
+    capture_chunk *chunk = &ctx->chunks[ctx->chunk_count++];
+    chunk->payload_offset = ctx->header.payload_size;
+    chunk->stream_offset = stream_offset;
+    chunk->length = len;
+    // 头部的 payload_size 在 capture_close 之前保持为 0
+    ctx->header.payload_size += len;
+    return 0;
+}
+
+// 写入块索引并更新头部
+static void capture_close(slogic16u3_context *ctx)
+{
+    if (!ctx->wave_fp) {
+        return;
+    }
+    ctx->header.index_offset = CAPTURE_HEADER_SIZE + ctx->header.payload_size;
+    ctx->header.index_count = ctx->chunk_count;
+    if (fseek(ctx->wave_fp, ctx->header.index_offset, SEEK_SET) != 0 ||
+        fwrite(ctx->chunks, sizeof(capture_chunk), ctx->chunk_count, ctx->wave_fp) != ctx->chunk_count) {
+        perror("Failed to write chunk index");
+    } else {
+        capture_write_header(ctx);
+    }
+    fclose(ctx->wave_fp);
+    ctx->wave_fp = NULL;
+    free(ctx->chunks);
+    ctx->chunks = NULL;
+    ctx->chunk_capacity = 0;
+}
+
+static int write_all(int fd, const void *data, size_t len)
+{
+    const uint8_t *p = data;
+    while (len > 0) {
+        ssize_t n = write(fd, p, len);
+        if (n < 0) {
+            if (errno == EINTR) {
+                continue;
+            }
+            return -1;
+        }
+        p += n;
+        len -= n;
+    }
+    return 0;
+}
+
+static void *stream_writer(void *arg)
+{
+    slogic16u3_context *ctx = arg;
+
+    pthread_mutex_lock(&ctx->stream_lock);
+    for (;;) {
+        while (ctx->stream_count == 0 && !ctx->stream_closing) {
+            pthread_cond_wait(&ctx->stream_cond, &ctx->stream_lock);
+        }
+        if (ctx->stream_count == 0) {
+            break;
+        }
+        size_t slot = (ctx->stream_head + STREAM_SLOTS - ctx->stream_count) % STREAM_SLOTS;
+        capture_chunk *chunk = &ctx->stream_chunk[slot];
+        pthread_mutex_unlock(&ctx->stream_lock);
+
+        chunk->payload_offset = ctx->stream_written;
+        int r = write_all(ctx->stream_fd, chunk, sizeof(*chunk));
+        if (r == 0) {
+            r = write_all(ctx->stream_fd, ctx->stream_buf[slot], chunk->length);
+        }
+
+        pthread_mutex_lock(&ctx->stream_lock);
+        if (r < 0) {
+            // 读端已关闭, 不再转发
+            perror("Stream write failed");
+            ctx->stream_closing = 1;
+            ctx->stream_count = 0;
+            break;
+        }
+        ctx->stream_written += chunk->length;
+        ctx->stream_count--;
+    }
+    pthread_mutex_unlock(&ctx->stream_lock);
+    return NULL;
+}
+
+// 打开实时流, path 为 "-" 时写到标准输出 (日志改为输出到 stderr)
+static int stream_open(slogic16u3_context *ctx, const char *path)
+{
+    capture_header header;
+    uint8_t block[CAPTURE_HEADER_SIZE] = { 0 };
+
+    if (strcmp(path, "-") == 0) {
+        fflush(stdout);
+        ctx->stream_fd = dup(STDOUT_FILENO);
+        dup2(STDERR_FILENO, STDOUT_FILENO);
+    } else {
+        // 命名管道会阻塞到读端打开
+        ctx->stream_fd = open(path, O_WRONLY | O_CREAT | O_TRUNC, 0644);
+    }
+    if (ctx->stream_fd < 0) {
+        perror("Failed to open stream");
+        return -1;
+    }
+    signal(SIGPIPE, SIG_IGN);
+
+    capture_init_header(ctx, &header);
+    memcpy(block, &header, sizeof(header));
+    if (write_all(ctx->stream_fd, block, sizeof(block)) < 0) {
+        perror("Failed to write stream header");
+        close(ctx->stream_fd);
+        ctx->stream_fd = -1;
+        return -1;
+    }
+    for (int i = 0; i < STREAM_SLOTS; i++) {
+        ctx->stream_buf[i] = malloc(TRANSFER_SIZE);
+        if (!ctx->stream_buf[i]) {
+            fprintf(stderr, "Failed to allocate stream buffers\n");
+            close(ctx->stream_fd);
+            ctx->stream_fd = -1;
+            return -1;
+        }
+    }
+    pthread_mutex_init(&ctx->stream_lock, NULL);
+    pthread_cond_init(&ctx->stream_cond, NULL);
+    if (pthread_create(&ctx->stream_thread, NULL, stream_writer, ctx) != 0) {
+        perror("Failed to create stream thread");
+        close(ctx->stream_fd);
+        ctx->stream_fd = -1;
+        return -1;
+    }
+    return 0;
+}
+
+// 在 USB 回调中调用: 没有空闲槽时丢弃该块, 读端可从 stream_offset 看到缺口
+static void stream_push(slogic16u3_context *ctx, const uint8_t *data, size_t len, uint64_t stream_offset)
+{
+    if (ctx->stream_fd < 0) {
+        return;
+    }
+    pthread_mutex_lock(&ctx->stream_lock);
+    if (ctx->stream_closing || ctx->stream_count == STREAM_SLOTS) {
+        ctx->stream_dropped += len;
+    } else {
+        size_t slot = ctx->stream_head;
+        memcpy(ctx->stream_buf[slot], data, len);
+        ctx->stream_chunk[slot].stream_offset = stream_offset;
+        ctx->stream_chunk[slot].length = len;
+        ctx->stream_head = (slot + 1) % STREAM_SLOTS;
+        ctx->stream_count++;
+        pthread_cond_signal(&ctx->stream_cond);
+    }
+    pthread_mutex_unlock(&ctx->stream_lock);
+}
+
+// 写完已排队的块后关闭实时流
+static void stream_close(slogic16u3_context *ctx)
+{
+    if (ctx->stream_fd < 0) {
+        return;
+    }
+    pthread_mutex_lock(&ctx->stream_lock);
+    ctx->stream_closing = 1;
+    pthread_cond_signal(&ctx->stream_cond);
+    pthread_mutex_unlock(&ctx->stream_lock);
+    pthread_join(ctx->stream_thread, NULL);
+    fprintf(stderr, "Stream: %lu bytes written, %lu bytes dropped\n",
+            ctx->stream_written, ctx->stream_dropped);
+    close(ctx->stream_fd);
+    ctx->stream_fd = -1;
+    for (int i = 0; i < STREAM_SLOTS; i++) {
+        free(ctx->stream_buf[i]);
+        ctx->stream_buf[i] = NULL;
+    }
+}
+
+static int ring_open(slogic16u3_context *ctx, const char *path, uint64_t size_mb)
+{
+    uint64_t capacity = size_mb * 1024 * 1024;
+    size_t map_size = CAPTURE_HEADER_SIZE + capacity;
+
+    // 新建而不是截断: 上次采集的读端可能还映射着旧文件
+    if (unlink(path) < 0 && errno != ENOENT) {
+        perror("Failed to remove old ring file");
+        return -1;
+    }
+    int fd = open(path, O_RDWR | O_CREAT | O_EXCL, 0644);
+    if (fd < 0) {
+        perror("Failed to open ring file");
+        return -1;
+    }
+    if (ftruncate(fd, map_size) < 0) {
+        perror("Failed to size ring file");
+        close(fd);
+        return -1;
+    }
+    void *map = mmap(NULL, map_size, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+    close(fd);
+    if (map == MAP_FAILED) {
+        perror("Failed to map ring file");
+        return -1;
+    }
+    ctx->ring = map;
+    ctx->ring_data = (uint8_t *)map + CAPTURE_HEADER_SIZE;
+    ctx->ring_map_size = map_size;
+
+    capture_header header;
+    capture_init_header(ctx, &header);
+    ctx->ring->version = RING_VERSION;
+    ctx->ring->header_size = CAPTURE_HEADER_SIZE;
+    ctx->ring->num_channels = header.num_channels;
+    ctx->ring->sample_rate = header.sample_rate;
+    ctx->ring->voltage_threshold = header.voltage_threshold;
+    ctx->ring->start_time = header.start_time;
+    ctx->ring->capacity = capacity;
+    ctx->ring->producer_pid = (uint64_t)getpid();
+    // magic 最后写入, 读端据此判断头部已就绪
+    __atomic_thread_fence(__ATOMIC_RELEASE);
+    memcpy(ctx->ring->magic, RING_MAGIC, sizeof(ctx->ring->magic));
+    return 0;
+}
+
+// 在 USB 回调中调用, 单生产者; 读端跟不上时整块丢弃
+static void ring_push(slogic16u3_context *ctx, const uint8_t *data, size_t len, uint64_t stream_offset)
+{
+    ring_header *ring = ctx->ring;
+    if (!ring) {
+        return;
+    }
+    uint64_t capacity = ring->capacity;
+    uint64_t write_pos = ring->write_pos;
+    uint64_t read_pos = __atomic_load_n(&ring->read_pos, __ATOMIC_ACQUIRE);
+    uint64_t record = (sizeof(capture_chunk) + len + 7) & ~(uint64_t)7;
+    uint64_t pos = write_pos % capacity;
+    uint64_t skip = pos + record > capacity ? capacity - pos : 0;
+
+    if (write_pos + skip + record - read_pos > capacity) {
+        ring->dropped_bytes += len;
+        ring->dropped_blocks++;
+        return;
+    }
+    if (skip) {
+        if (skip >= sizeof(capture_chunk)) {
+            capture_chunk wrap = { write_pos, 0, RING_WRAP };
+            memcpy(ctx->ring_data + pos, &wrap, sizeof(wrap));
+        }
+        write_pos += skip;
+        pos = 0;
+    }
+    capture_chunk chunk = { write_pos, stream_offset, len };
+    memcpy(ctx->ring_data + pos, &chunk, sizeof(chunk));
+    memcpy(ctx->ring_data + pos + sizeof(chunk), data, len);
+    // 数据写完后才推进游标, 读端看到的记录总是完整的
+    __atomic_store_n(&ring->write_pos, write_pos + record, __ATOMIC_RELEASE);
+}
+
+static void ring_close(slogic16u3_context *ctx)
+{
+    if (!ctx->ring) {
+        return;
+    }
+    __atomic_store_n(&ctx->ring->closed, 1, __ATOMIC_RELEASE);
+    fprintf(stderr, "Ring: %lu bytes written, %lu blocks (%lu bytes) dropped\n",
+            ctx->ring->write_pos, ctx->ring->dropped_blocks, ctx->ring->dropped_bytes);
+    munmap(ctx->ring, ctx->ring_map_size);
+    ctx->ring = NULL;
+    ctx->ring_data = NULL;
+}
+
 static void LIBUSB_CALL user_receive_transfer_cb(struct libusb_transfer *transfer)
 {
     slogic16u3_context *ctx = (slogic16u3_context *)transfer->user_data;
@@ -496,6 +971,13 @@ static void LIBUSB_CALL user_receive_transfer_cb(struct libusb_transfer *transfe
 
         if (transfer->actual_length > 0) {
             bytes_received_all += transfer->actual_length;
+            stream_push(ctx, transfer->buffer, transfer->actual_length,
+                        bytes_received_all - transfer->actual_length);
+            ring_push(ctx, transfer->buffer, transfer->actual_length,
+                      bytes_received_all - transfer->actual_length);
+            // 每个传输块都写入文件, 只有真正丢失的数据才在块索引中留下空隙
+            capture_append(ctx, transfer->buffer, transfer->actual_length,
+                           bytes_received_all - transfer->actual_length);
             static uint64_t last_report_time = 0;
             static uint64_t last_report_bytes = 0;
             struct timeval tv;
@@ -522,23 +1004,21 @@ static void LIBUSB_CALL user_receive_transfer_cb(struct libusb_transfer *transfe
                         uint8_t s = *(uint8_t *)(transfer->buffer + i);
                         printf("%01X %01X ", s & 0x0F, (s >> 4) & 0x0F);
                     }
-                }
-                printf("%s\n", transfer->actual_length > 64 ? "..." : "");
-
-                // === 新增：保存有效数据 ===
-                if (is_valid) {
-                    // 构造文件名
-                    char filename[64];
-                    snprintf(filename, sizeof(filename), "%uch_%luM_wave.bin", ctx->cur_samplechannel, ctx->cur_samplerate/1000000);
-                    FILE *fp = fopen(filename, "ab");
-                    if (fp) {
-                        fwrite(transfer->buffer, 1, transfer->actual_length, fp);
-                        fclose(fp);
-                    } else {
-                        perror("Failed to open wave file");
+                } else if (ctx->cur_samplechannel == 2) {
+                    for (int i = 0; i < transfer->actual_length && i < 64; i += 1) {
+                        uint8_t s = *(uint8_t *)(transfer->buffer + i);
+                        printf("%u %u %u %u ", s & 0x03, (s >> 2) & 0x03, (s >> 4) & 0x03, (s >> 6) & 0x03);
+                    }
+                } else if (ctx->cur_samplechannel == 1) {
+                    for (int i = 0; i < transfer->actual_length && i < 64; i += 1) {
+                        uint8_t s = *(uint8_t *)(transfer->buffer + i);
+                        for (int b = 0; b < 8; b++) {
+                            printf("%u", (s >> b) & 0x01);  // 低位为先采样
+                        }
+                        printf(" ");
                     }
                 }
-                // === 新增结束 ===
+                printf("%s\n", transfer->actual_length > 64 ? "..." : "");
 
                 last_report_time = current_time;
                 last_report_bytes = bytes_received_all;
@@ -706,6 +1186,11 @@ static struct option long_options[] = {
     {"ch",    required_argument, 0, 'c'},  // -ch 选项，需要参数
     {"volt",  required_argument, 0, 'v'},  // -volt 选项，需要参数
     {"timeout",required_argument, 0, 't'}, // -t 或 --timeout 选项
+    {"stream", required_argument, 0, 'o'}, // 实时流输出: 文件/命名管道, "-" 为标准输出
+    {"ring",  required_argument, 0, 'r'},  // 共享内存环形缓冲文件
+    {"ring-size", required_argument, 0, 'R'}, // 环形缓冲数据区大小 (MiB)
+    {"device", required_argument, 0, 'd'}, // 按位置选择设备, 如 1-2.3
+    {"list",  no_argument,       0, 'l'},  // 列出已连接设备的位置
     {0, 0, 0, 0}                           // 选项数组结束标记
 };
 
@@ -723,6 +1208,27 @@ int parse_arg(const char *arg) {
     return atoi(arg);
 }
 
+// 同 parse_arg, 但允许小数 (如 --sr 1.5)
+double parse_arg_double(const char *arg) {
+    if (arg == NULL) return -1;
+
+    const char *equal_sign = strchr(arg, '=');
+    if (equal_sign != NULL) {
+        return atof(equal_sign + 1);
+    }
+
+    return atof(arg);
+}
+
+
+// SIGINT/SIGTERM 只结束等待, 之后照常停止采集并写完文件/实时流
+static volatile sig_atomic_t stop_requested = 0;
+
+static void on_stop_signal(int sig)
+{
+    (void)sig;
+    stop_requested = 1;
+}
 
 // 主测试函数
 int main(int argc, char *argv[])
@@ -733,17 +1239,22 @@ int main(int argc, char *argv[])
     slogic16u3_context slogic_ctx = {0};
 
     // 设置默认值
-    int sr = 200;       // 采样率默认值：200 MHz
+    double sr = 200;    // 采样率默认值：200 MHz
     int ch = 16;        // 通道数默认值：16
     int volt = 3300;    // 电压默认值：3300 mV
     int timeout = 5; // 超时默认值：5 秒
+    const char *stream_path = NULL;
+    const char *ring_path = NULL;
+    int ring_size = RING_DEFAULT_SIZE_MB;
+    const char *device = NULL;
+    int list_only = 0;
 
     // 使用 getopt_long() 解析命令行选项
-    for (int c, option_index = 0; (c = getopt_long(argc, argv, "s:c:v:t:",
+    for (int c, option_index = 0; (c = getopt_long(argc, argv, "s:c:v:t:o:r:R:d:l",
                            long_options, &option_index)) != -1;) {
         switch (c) {
             case 's': {
-                int val = parse_arg(optarg);
+                double val = parse_arg_double(optarg);
                 if (val > 0) sr = val;  // 只接受正数值
                 else {
                     fprintf(stderr, "错误: 所有选项都必须提供正数值\n");
@@ -774,6 +1285,27 @@ int main(int argc, char *argv[])
                 if (val >= 0) timeout = val;  // 接受0或正数值（0表示无超时）
                 break;
             }
+            case 'o':
+                stream_path = optarg;
+                break;
+            case 'r':
+                ring_path = optarg;
+                break;
+            case 'R': {
+                int val = parse_arg(optarg);
+                if (val > 0) ring_size = val;
+                else {
+                    fprintf(stderr, "错误: 所有选项都必须提供正数值\n");
+                    return 1;
+                }
+                break;
+            }
+            case 'd':
+                device = optarg;
+                break;
+            case 'l':
+                list_only = 1;
+                break;
             case '?':
                 fprintf(stderr, "未知选项或缺少参数\n");
                 fprintf(stderr, "用法: %s [选项]\n", argv[0]);
@@ -782,6 +1314,11 @@ int main(int argc, char *argv[])
                 fprintf(stderr, "  -c, --ch <num>    设置通道数\n");
                 fprintf(stderr, "  -v, --volt <mV>   设置电压 (单位: mV)\n");
                 fprintf(stderr, "  -t, --timeout <second>   设置超时 (单位: second)\n");
+                fprintf(stderr, "  -o, --stream <path>      实时输出采样块到文件/命名管道, - 为标准输出\n");
+                fprintf(stderr, "  -r, --ring <path>        写入共享内存环形缓冲 (如 /dev/shm/slogic.ring)\n");
+                fprintf(stderr, "  -R, --ring-size <MiB>    环形缓冲大小 (默认 %d MiB)\n", RING_DEFAULT_SIZE_MB);
+                fprintf(stderr, "  -d, --device <bus-port>  使用指定位置的设备 (如 1-2.3), 默认第一个\n");
+                fprintf(stderr, "  -l, --list               列出已连接设备的位置后退出\n");
                 fprintf(stderr, "参数格式支持: -sr 200 或 -sr=200\n");
                 return 1;
             default:
@@ -789,9 +1326,20 @@ int main(int argc, char *argv[])
         }
     }
 
+    if (list_only) {
+        libusb_context *list_ctx;
+        if (libusb_init(&list_ctx) < 0) {
+            fprintf(stderr, "Error: Failed to initialize libusb\n");
+            return 1;
+        }
+        int list_ret = list_devices(list_ctx);
+        libusb_exit(list_ctx);
+        return list_ret < 0 ? 1 : 0;
+    }
+
     // 输出解析结果（包含默认值说明）
     printf("参数解析结果:\n");
-    printf("  采样率: %d MHz %s\n", sr, (sr == 200) ? "(默认值)" : "");
+    printf("  采样率: %g MHz %s\n", sr, (sr == 200) ? "(默认值)" : "");
     printf("  通道数: %d %s\n", ch, (ch == 16) ? "(默认值)" : "");
     printf("  电压: %d mV %s\n", volt, (volt == 3300) ? "(默认值)" : "");
     printf("  超时时间: %d s %s\n", timeout, (timeout == 5) ? "(默认值)" : (timeout == 0) ? "(Forever)" : "");
@@ -807,18 +1355,31 @@ int main(int argc, char *argv[])
     }
     
     // 查找并打开设备
-    dev_handle = find_and_open_device(slogic_ctx.ctx);
+    dev_handle = find_and_open_device(slogic_ctx.ctx, device);
     if (!dev_handle) {
-        printf("Error: Could not find or open SLogic16U3 device\n");
+        if (device) {
+            printf("Error: Could not find or open SLogic16U3 device at %s\n", device);
+        } else {
+            printf("Error: Could not find or open SLogic16U3 device\n");
+        }
         libusb_exit(slogic_ctx.ctx);
         return 1;
     }
     
     slogic_ctx.dev_handle = dev_handle;
     slogic_ctx.cur_samplechannel = ch;  // 默认16通道
-    slogic_ctx.cur_samplerate = 1000000ull * sr;  // 默认200MHz
+    slogic_ctx.cur_samplerate = (uint64_t)(sr * 1000000.0 + 0.5);  // 默认200MHz
     slogic_ctx.voltage_threshold[0] = volt;
     slogic_ctx.voltage_threshold[1] = volt;
+    slogic_ctx.stream_fd = -1;
+    if ((stream_path && stream_open(&slogic_ctx, stream_path) < 0) ||
+        (ring_path && ring_open(&slogic_ctx, ring_path, ring_size) < 0)) {
+        stream_close(&slogic_ctx);
+        libusb_release_interface(dev_handle, 0);
+        libusb_close(dev_handle);
+        libusb_exit(slogic_ctx.ctx);
+        return 1;
+    }
 
     pthread_t thread;
     if (pthread_create(&thread, NULL, thread_function, &slogic_ctx) != 0) {
@@ -867,7 +1428,11 @@ int main(int argc, char *argv[])
         
         // 等待一段时间
         printf("Acquiring data for %d seconds...\n", timeout_s);
-        sleep(timeout_s);
+        signal(SIGINT, on_stop_signal);
+        signal(SIGTERM, on_stop_signal);
+        for (long ms = 0; !stop_requested && (timeout_s < 0 || ms < timeout_s * 1000L); ms += 100) {
+            usleep(100 * 1000);
+        }
         
         // 测试停止采集
         printf("\n4. Testing acquisition stop...\n");
@@ -879,9 +1444,12 @@ int main(int argc, char *argv[])
         }
     }
     stop_async_bulk_in_transfers(&slogic_ctx);
+    capture_close(&slogic_ctx);
     
     // 清理
 _clean_up:
+    stream_close(&slogic_ctx);
+    ring_close(&slogic_ctx);
     // Wait for threads to finish
     pthread_join(thread, NULL);
     libusb_release_interface(dev_handle, 0);
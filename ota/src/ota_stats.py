@@ -0,0 +1,152 @@
+"""
+Instrumentation of an OTA run: USB transfer and SPI batch counters with
+latency histograms, per-phase wall time, and rate-limited progress output.
+
+OTAStats wraps the USB device and the SPIDevice of a SPIFlashDevice; report()
+returns a JSON-serializable dict (spi_flash.py --report writes it to a file).
+"""
+import math
+import time
+from contextlib import contextmanager
+
+
+class LatencyHistogram:
+    """Count, total/max time and power-of-two microsecond buckets of timed calls"""
+
+    def __init__(self):
+        self.count = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.max = 0.0
+        # k -> calls that took at most 2**k us
+        self.buckets = {}
+
+    def add(self, seconds, nbytes=0):
+        self.count += 1
+        self.bytes += nbytes
+        self.seconds += seconds
+        self.max = max(self.max, seconds)
+        us = seconds * 1e6
+        k = math.ceil(math.log2(us)) if us > 1 else 0
+        self.buckets[k] = self.buckets.get(k, 0) + 1
+
+    def report(self):
+        return {
+            'count': self.count,
+            'bytes': self.bytes,
+            'seconds': self.seconds,
+            'mean_us': 1e6 * self.seconds / self.count if self.count else None,
+            'max_us': 1e6 * self.max,
+            'histogram': [{'le_us': 1 << k, 'count': n} for k, n in sorted(self.buckets.items())],
+        }
+
+
+class InstrumentedUSB:
+    """USBDevice proxy timing every write/read into the OTAStats histograms"""
+
+    def __init__(self, usb_device, stats):
+        self.usb_device = usb_device
+        self.stats = stats
+
+    def write(self, data, timeout=1000):
+        t = self.stats.clock()
+        written = self.usb_device.write(data, timeout)
+        self.stats.usb_write.add(self.stats.clock() - t, written)
+        return written
+
+    def read(self, size, timeout=1000):
+        t = self.stats.clock()
+        data = self.usb_device.read(size, timeout)
+        self.stats.usb_read.add(self.stats.clock() - t, len(data))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.usb_device, name)
+
+
+class OTAStats:
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.started = clock()
+        self.usb_write = LatencyHistogram()
+        self.usb_read = LatencyHistogram()
+        self.spi_batch = LatencyHistogram()
+        self.spi_transactions = 0
+        # One record per phase, in the order they ran
+        self.phases = []
+
+    def instrument_usb(self, usb_device):
+        return InstrumentedUSB(usb_device, self)
+
+    def instrument_spi(self, spi):
+        """Time spi.xfer_batch, which SPIDevice.xfer and SPIBatch.flush go through"""
+        xfer_batch = spi.xfer_batch
+
+        def timed_xfer_batch(transactions):
+            t = self.clock()
+            try:
+                return xfer_batch(transactions)
+            finally:
+                self.spi_transactions += len(transactions)
+                self.spi_batch.add(self.clock() - t)
+
+        spi.xfer_batch = timed_xfer_batch
+        return spi
+
+    def _counters(self):
+        return {
+            'usb_writes': self.usb_write.count, 'bytes_out': self.usb_write.bytes,
+            'usb_reads': self.usb_read.count, 'bytes_in': self.usb_read.bytes,
+            'spi_batches': self.spi_batch.count, 'spi_transactions': self.spi_transactions,
+        }
+
+    @contextmanager
+    def phase(self, name, planned=None):
+        """Record the wall time and USB/SPI traffic of the enclosed block; yields the record,
+        complete once the block exits (planned may be set on it from inside)"""
+        record = {'name': name, 'seconds': None, 'planned': planned}
+        before = self._counters()
+        t = self.clock()
+        try:
+            yield record
+        finally:
+            record['seconds'] = self.clock() - t
+            record.update({key: value - before[key] for key, value in self._counters().items()})
+            self.phases.append(record)
+
+    def report(self):
+        return {
+            'seconds': self.clock() - self.started,
+            'phases': self.phases,
+            'usb': {'write': self.usb_write.report(), 'read': self.usb_read.report()},
+            'spi': {'transactions': self.spi_transactions, 'batches': self.spi_batch.report()},
+        }
+
+
+class Progress:
+    """
+    progress(what, done, total) callable that forwards to callback at most
+    every interval seconds, on a new task, and on completion if a partial
+    update was held back, so console output does not slow down the loop reporting it.
+    """
+
+    def __init__(self, callback=None, interval=0.5):
+        self.callback = callback or self.print_progress
+        self.interval = interval
+        self._what = None
+        self._last = 0.0
+        self._held = False
+
+    @staticmethod
+    def print_progress(what, done, total):
+        print(f"[{100.0 * done / total if total else 100.0:.1f}%] {what} {done}/{total}")
+
+    def __call__(self, what, done, total):
+        now = time.monotonic()
+        if what != self._what or (done >= total and self._held) or now - self._last >= self.interval:
+            self._what = what
+            self._last = now
+            self._held = False
+            self.callback(what, done, total)
+        elif done < total:
+            self._held = True
@@ -1,9 +1,77 @@
-from usb_device import USBDevice
+from collections import namedtuple
+from typing import TYPE_CHECKING
 from spi_config import SPIConfigRegister
 from spi_data_packet import SPIPacket
 
+if TYPE_CHECKING:
+    # 只用于类型标注; pyusb 仅在打开真实设备时才需要 (见 SPIFlashDevice)
+    from usb_device import USBDevice
+
+# 传输完成且 FIFO 为空时的状态寄存器值
+STATUS_IDLE = 0x00404000
+
+
+# 预先构造好 USB 数据包的事务, 见 SPIDevice.prepare
+SPITransfer = namedtuple('SPITransfer', ['wr_data', 'rd_nbytes', 'dummy', 'config', 'packet'])
+
+
+class SPIError(Exception):
+    """SPI 传输失败, index 为出错的事务序号 (无法确定时为 None)"""
+
+    def __init__(self, message: str, index=None, status=None):
+        super().__init__(message)
+        self.index = index
+        self.status = status
+
+
+def describe_transaction(wr_data: bytes) -> str:
+    """事务的简短描述: 操作码及 (若有) 24 位地址"""
+    if not wr_data:
+        return 'read-only'
+    if len(wr_data) >= 4:
+        return f'0x{wr_data[0]:02X} @0x{int.from_bytes(wr_data[1:4], "big"):06X}'
+    return f'0x{wr_data[0]:02X}'
+
+
+class SPIBatch:
+    """
+    SPI 事务队列, flush() 时依次发送, 整批只检查一次状态寄存器
+    xfer() 返回事务序号, flush() 返回各事务读到的数据
+    """
+
+    def __init__(self, spi: 'SPIDevice'):
+        self.spi = spi
+        self.transactions = []
+
+    def xfer(self, wr_data: bytes, rd_nbytes: int = 0, dummy: int = 0) -> int:
+        self.transactions.append((wr_data, rd_nbytes, dummy))
+        return len(self.transactions) - 1
+
+    def queue(self, transfer: SPITransfer) -> int:
+        """加入 SPIDevice.prepare 构造好的事务"""
+        self.transactions.append(transfer)
+        return len(self.transactions) - 1
+
+    def flush(self) -> list:
+        transactions, self.transactions = self.transactions, []
+        return self.spi.xfer_batch(transactions)
+
+    def __len__(self):
+        return len(self.transactions)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """正常退出时发送队列, 异常时丢弃"""
+        if exc_type is None:
+            self.flush()
+        else:
+            self.transactions = []
+
+
 class SPIDevice:
-    def __init__(self, usb_dev: USBDevice, timeout: int = 1000):
+    def __init__(self, usb_dev: 'USBDevice', timeout: int = 1000):
         self.usb = usb_dev
         self.timeout = timeout  # 默认超时时间(ms)
 
@@ -56,15 +124,14 @@ class SPIDevice:
         config.ControlRegister.TXFIFORST = 1
         return self.set_register(config)
 
-    def xfer(self, wr_data: bytes, rd_nbytes: int=0, dummy: int=0) -> bytes:
+    def _transfer_config(self, wr_data: bytes, rd_nbytes: int, dummy: int):
+        """构造一次事务的寄存器配置, 返回 (config, 补齐到 4 字节的写数据)"""
         wr_nbytes = len(wr_data)
         padding = (4 - wr_nbytes % 4) % 4
         wr_data += b'\xff' * padding
 
         config = SPIConfigRegister()
-        if wr_nbytes == 0 and rd_nbytes == 0:
-            return b''
-        elif rd_nbytes == 0:
+        if rd_nbytes == 0:
             config.TransferControlRegister.TransMode = 0x1 # Write only
             config.TransferControlRegister.WrTranCnt = wr_nbytes -1
         elif wr_nbytes == 0:
@@ -81,16 +148,53 @@ class SPIDevice:
                 config.TransferControlRegister.TransMode = 0x5 # Write, dummy, and read
                 config.TransferControlRegister.DummyCnt = dummy - 1 - padding
                 config.TransferControlRegister.WrTranCnt += padding
+        return config, wr_data
 
-        assert(self.set_register_payload(config, wr_data))
-        if rd_nbytes:
-            data = self.read_data_raw(config.TransferControlRegister.RdTranCnt + 1)
-            sr = self.read_register().StatusRegister.value
-            # print(f'rd_sr {sr:08X} ({len(data)}): {data.hex()}')
-            assert sr == 0x00404000
-            return data
-        else:
+    def batch(self) -> SPIBatch:
+        return SPIBatch(self)
+
+    def prepare(self, wr_data: bytes, rd_nbytes: int = 0, dummy: int = 0) -> SPITransfer:
+        """提前构造事务的寄存器配置和 USB 数据包 (如在等待 flash 忙时)"""
+        config, padded = self._transfer_config(wr_data, rd_nbytes, dummy)
+        packet = SPIPacket(command=SPIPacket.CMD_SET_REGISTER, data=bytes(config) + padded).serialize()
+        return SPITransfer(wr_data, rd_nbytes, dummy, config, packet)
+
+    def xfer_batch(self, transactions) -> list:
+        """
+        依次执行 (wr_data, rd_nbytes, dummy) 或 SPITransfer 事务, 最后只读一次状态寄存器
+        USB 写入不完整或读回长度不符时立即报告对应事务; 最终状态异常时
+        无法定位到单个事务, 报告整批
+        """
+        results = []
+        for index, transaction in enumerate(transactions):
+            wr_data, rd_nbytes = transaction[0], transaction[1]
+            if not wr_data and rd_nbytes == 0:
+                results.append(b'')
+                continue
+            if not isinstance(transaction, SPITransfer):
+                transaction = self.prepare(*transaction)
+            config, packet = transaction.config, transaction.packet
+            if self.usb.write(packet, self.timeout) != len(packet):
+                raise SPIError(f'SPI transaction {index + 1}/{len(transactions)} '
+                               f'({describe_transaction(wr_data)}): USB write incomplete', index)
+            if rd_nbytes:
+                data = self.read_data_raw(config.TransferControlRegister.RdTranCnt + 1)
+                if len(data) != rd_nbytes:
+                    raise SPIError(f'SPI transaction {index + 1}/{len(transactions)} '
+                                   f'({describe_transaction(wr_data)}): read {len(data)} of {rd_nbytes} bytes', index)
+                results.append(data)
+            else:
+                results.append(b'')
+        if results:
             sr = self.read_register().StatusRegister.value
-            # print(f'wr_sr {sr:08X}')
-            assert sr == 0x00404000
-            return b''
+            # print(f'batch_sr {sr:08X}')
+            if sr != STATUS_IDLE:
+                first = describe_transaction(transactions[0][0])
+                last = describe_transaction(transactions[-1][0])
+                index = 0 if len(transactions) == 1 else None
+                raise SPIError(f'SPI status 0x{sr:08X} after batch of {len(transactions)} '
+                               f'transactions ({first} .. {last})', index, sr)
+        return results
+
+    def xfer(self, wr_data: bytes, rd_nbytes: int=0, dummy: int=0) -> bytes:
+        return self.xfer_batch([(wr_data, rd_nbytes, dummy)])[0]
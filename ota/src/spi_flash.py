@@ -1,13 +1,249 @@
-from usb_device import USBDevice
+import os
+import json
+import time
+import argparse
+from contextlib import contextmanager
 from spi_device import SPIDevice
+from ota_stats import OTAStats, Progress
+
+# RdTranCnt is 9 bits wide, so one transaction reads at most 512 bytes
+MAX_READ_SIZE = 0x200
+# Read transactions queued per status check
+READ_BATCH = 64
+# Smallest erasable unit (0x20 sector erase)
+SECTOR_SIZE = 0x1000
+# Sectors read back to check a cached image against the flash before a differential update
+CACHE_CHECK_SECTORS = 16
+# Erase commands by block size, with typical erase times (s) from W25Q-class datasheets
+ERASE_OPS = {
+    0x1000: (0x20, 0.045),
+    0x8000: (0x52, 0.120),
+    0x10000: (0xD8, 0.150),
+}
+# Program page size and typical page program time (s)
+FLASH_PAGE_SIZE = 0x100
+PAGE_PROGRAM_TIME = 0.0007
+
+def plan_erase(start, end, lo=None, hi=None):
+    """
+    Cheapest list of (addr, size) erases covering [start, end) by ERASE_OPS typical times
+
+    Blocks are aligned to their size and may extend over [lo, hi) (default: the
+    sector-aligned [start, end)), never outside it.
+    """
+    first = start // SECTOR_SIZE
+    last = -(-end // SECTOR_SIZE)
+    lo = first if lo is None else lo // SECTOR_SIZE
+    hi = last if hi is None else -(-hi // SECTOR_SIZE)
+    assert lo <= first and last <= hi
+    # best[p]: (cost, size, next p) to cover sectors [p, last)
+    best = {}
+    for p in range(last - 1, first - 1, -1):
+        for size, (_, seconds) in ERASE_OPS.items():
+            sectors = size // SECTOR_SIZE
+            q = p - p % sectors
+            if q < lo or q + sectors > hi:
+                continue
+            nxt = q + sectors
+            cost = seconds + (best[nxt][0] if nxt < last else 0.0)
+            if p not in best or cost < best[p][0]:
+                best[p] = (cost, size, nxt)
+    plan = []
+    p = first
+    while p < last:
+        _, size, nxt = best[p]
+        plan.append(((nxt * SECTOR_SIZE) - size, size))
+        p = nxt
+    return plan
+
+def plan_update(addr, payload, current, page_size=FLASH_PAGE_SIZE):
+    """
+    Plan turning current flash contents at addr into payload:
+    (diff_sectors, erase plan, list of (addr, data) page programs)
+    """
+    changed = diff_sectors(current, payload)
+    # Runs of adjacent sectors to erase may merge into 32KB/64KB erases
+    runs = []
+    for offset, needs_erase in changed:
+        if not needs_erase:
+            continue
+        if runs and runs[-1][1] == addr+offset:
+            runs[-1][1] += SECTOR_SIZE
+        else:
+            runs.append([addr+offset, addr+offset+SECTOR_SIZE])
+    erases = [block for start, end in runs for block in plan_erase(start, end)]
+    pages = []
+    for offset, needs_erase in changed:
+        new = payload[offset:offset+SECTOR_SIZE]
+        old = b'\xff' * len(new) if needs_erase else current[offset:offset+len(new)]
+        page = 0
+        while page < len(new):
+            # A page program must not wrap around the end of a flash page
+            need = min(page_size, FLASH_PAGE_SIZE - (addr+offset+page) % FLASH_PAGE_SIZE)
+            data = new[page:page+need]
+            if data != old[page:page+len(data)] and data.count(0xFF) != len(data):
+                pages.append((addr+offset+page, data))
+            page += len(data)
+    return changed, erases, pages
+
+def page_size_arg(value):
+    """argparse type of --page-size: a divisor of FLASH_PAGE_SIZE"""
+    size = int(value, 0)
+    if size <= 0 or size > FLASH_PAGE_SIZE or FLASH_PAGE_SIZE % size:
+        raise argparse.ArgumentTypeError(f"page size must divide 0x{FLASH_PAGE_SIZE:X}, got {value}")
+    return size
+
+def erase_cost(plan):
+    """Typical time (s) of an erase plan"""
+    return sum(ERASE_OPS[size][1] for _, size in plan)
+
+def print_phase(name, seconds, planned=None):
+    """Print the elapsed time of an OTA phase next to its planned (typical) time"""
+    if planned is None:
+        print(f"[{name}] {seconds:.2f} s")
+    else:
+        print(f"[{name}] {seconds:.2f} s (planned {planned:.2f} s)")
+
+def diff_sectors(current, payload, sector_size=SECTOR_SIZE):
+    """List (offset, needs_erase) of the sectors where payload differs from current"""
+    changed = []
+    for offset in range(0, len(payload), sector_size):
+        new = payload[offset:offset+sector_size]
+        old = current[offset:offset+len(new)]
+        if new != old:
+            # Programming only clears bits, so an erase is needed unless new is a subset of old
+            new_bits = int.from_bytes(new, 'big')
+            changed.append((offset, int.from_bytes(old, 'big') & new_bits != new_bits))
+    return changed
+
+def image_cache_path(cache_dir, uid, addr):
+    """Cache file of the image last written to the flash with this unique ID"""
+    return os.path.join(cache_dir, f'{uid.hex()}_{addr:06X}.bin')
+
+def load_image_cache(cache_dir, uid, addr, length):
+    """Cached flash contents of [addr, addr+length), or None if unknown or shorter than length"""
+    try:
+        with open(image_cache_path(cache_dir, uid, addr), 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    # An earlier, longer image may be cached: only its head is compared and diffed
+    return data[:length] if len(data) >= length else None
+
+def cache_check_offsets(length, count=CACHE_CHECK_SECTORS):
+    """Offsets of count sectors spread over [0, length), first and last included"""
+    sectors = (length + SECTOR_SIZE - 1) // SECTOR_SIZE
+    if sectors <= count:
+        return [i * SECTOR_SIZE for i in range(sectors)]
+    return sorted({(i * (sectors - 1) // (count - 1)) * SECTOR_SIZE for i in range(count)})
+
+def save_image_cache(cache_dir, uid, addr, image):
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(image_cache_path(cache_dir, uid, addr), 'wb') as f:
+        f.write(image)
+
+def drop_image_cache(cache_dir, uid, addr):
+    try:
+        os.remove(image_cache_path(cache_dir, uid, addr))
+    except OSError:
+        pass
+
+class WipWaiter:
+    """
+    Wait for a program/erase to finish: sleep most of its expected time, then
+    poll WIP with exponential backoff bounded by MAX_POLL. Expected times per
+    opcode start from the typical figures and follow the measured ones; all
+    measurements are kept in timings for tuning.
+    """
+    SLEEP_FRACTION = 0.8
+    # Shorter sleeps are left out, a status poll takes about as long
+    MIN_SLEEP = 0.001
+    MIN_POLL = 0.0002
+    MAX_POLL = 0.005
+    # Weight of a new measurement in the expected time
+    LEARN_RATE = 0.2
+    TIMEOUT = 5.0
+
+    def __init__(self, clock=time.monotonic, sleep=time.sleep):
+        # Injectable so an emulated device can run the waits on its virtual clock
+        self.clock = clock
+        self.sleep = sleep
+        self.expected = {0x02: PAGE_PROGRAM_TIME}
+        self.expected.update({opcode: seconds for opcode, seconds in ERASE_OPS.values()})
+        # opcode -> list of (seconds, status polls)
+        self.timings = {}
+
+    def wait(self, read_status, opcode, started, idle=None):
+        """Block until read_status() clears WIP for an operation issued at started (self.clock)"""
+        if idle is not None:
+            idle()
+        expected = self.expected.get(opcode, 0.0)
+        remaining = started + expected * self.SLEEP_FRACTION - self.clock()
+        if remaining >= self.MIN_SLEEP:
+            self.sleep(remaining)
+        interval = self.MIN_POLL
+        polls = 1
+        while 0x1 & read_status():  # Status Register-1 S0:WIP
+            if self.clock() - started > self.TIMEOUT:
+                raise TimeoutError(f'flash still busy {self.TIMEOUT} s after opcode 0x{opcode:02X}')
+            self.sleep(interval)
+            interval = min(interval * 2, self.MAX_POLL)
+            polls += 1
+        elapsed = self.clock() - started
+        self.timings.setdefault(opcode, []).append((elapsed, polls))
+        if opcode in self.expected:
+            if polls > 1:
+                # Still busy after the sleep: elapsed is close to the real duration
+                self.expected[opcode] += self.LEARN_RATE * (elapsed - self.expected[opcode])
+            else:
+                # Done at the first poll, so elapsed only bounds it: try a shorter sleep next time
+                self.expected[opcode] *= 1 - self.LEARN_RATE * (1 - self.SLEEP_FRACTION)
+        return elapsed
+
+    def report(self):
+        """Per opcode (hex): waits, mean/max seconds and mean status polls"""
+        report = {}
+        for opcode, samples in sorted(self.timings.items()):
+            seconds = [t for t, _ in samples]
+            report[f'0x{opcode:02X}'] = {'waits': len(samples), 'mean': sum(seconds) / len(seconds),
+                                         'max': max(seconds), 'polls': sum(n for _, n in samples) / len(samples),
+                                         'expected': self.expected.get(opcode)}
+        return report
+
+    def summary(self):
+        """One line per opcode: count, mean/max wait and mean status polls"""
+        lines = []
+        for opcode, samples in sorted(self.timings.items()):
+            seconds = [t for t, _ in samples]
+            polls = sum(n for _, n in samples) / len(samples)
+            lines.append(f'0x{opcode:02X}: {len(samples)} waits, mean {1000*sum(seconds)/len(seconds):.2f} ms, '
+                         f'max {1000*max(seconds):.2f} ms, {polls:.1f} polls')
+        return lines
+
+def print_throughput(what, nbytes, seconds):
+    """Print the size, duration and rate of a bulk transfer"""
+    rate = nbytes / seconds / 1024 if seconds > 0 else float('inf')
+    print(f"{what} {nbytes} bytes in {seconds:.2f} s ({rate:.1f} KiB/s)")
 
 class SPIFlashDevice:
-    def __init__(self, vid, pid):
-        self.usb_device = USBDevice(vid, pid)
+    def __init__(self, vid, pid, usb_device=None, stats=None, progress=None):
+        # usb_device replaces the USB connection, e.g. usb_emulator.EmulatedUSBDevice
+        self.stats = stats if stats is not None else OTAStats()
+        if usb_device is None:
+            # pyusb is only needed for a real device
+            from usb_device import USBDevice
+            usb_device = USBDevice(vid, pid)
+        self.usb_device = self.stats.instrument_usb(usb_device)
+        # progress(what, done, total), called for every block/page of the bulk operations
+        self.progress = progress if progress is not None else Progress()
         self.page_size = 0x100
+        self.read_size = MAX_READ_SIZE
+        self.wip = WipWaiter()
+        # (addr, payload, SPITransfer) of the page prepared while the previous one was written
+        self._prepared = None
         
     def __enter__(self):
-        self.spi = SPIDevice(self.usb_device).__enter__()
+        self.spi = self.stats.instrument_spi(SPIDevice(self.usb_device).__enter__())
         return self
         
     def __exit__(self, exc_type, exc_val, exc_tb):
@@ -26,49 +262,110 @@ class SPIFlashDevice:
         return self.spi.xfer(b'\x4B', 16, 4)
         
     def read_data(self, addr, length):
-        """Read data from specified address"""
-        data = b''
+        """Read data from specified address into a bytearray, read_size bytes per transaction"""
+        data = bytearray(length)
+        view = memoryview(data)
         got = 0
         while got < length:
-            need = length - got
-            if need > 0x50:
-                need = 0x50
-            data += self.spi.xfer(b'\x0B' + self._addr_to_bytes(addr+got), need, 1)
-            got += need
-        assert(len(data) == got)
+            batch = self.spi.batch()
+            start = got
+            while got < length and len(batch) < READ_BATCH:
+                need = min(length - got, self.read_size)
+                batch.xfer(b'\x0B' + self._addr_to_bytes(addr+got), need, 1)
+                got += need
+            for chunk in batch.flush():
+                view[start:start+len(chunk)] = chunk
+                start += len(chunk)
+            self.progress('read', got, length)
         assert(length == got)
         return data
         
-    def we(self):
-        """Context manager for write enable/disable operations"""
-        return self._WriteEnableManager(self)
+    def we(self, idle=None):
+        """Context manager for write enable/disable operations, yielding the SPI batch to queue them on;
+        idle() runs while waiting for the operation to complete"""
+        return self._WriteEnableManager(self, idle)
         
+    def erase_block(self, addr, size):
+        """Erase a 4KB, 32KB or 64KB block at specified address"""
+        opcode, _ = ERASE_OPS[size]
+        with self.we() as batch:
+            batch.xfer(bytes([opcode]) + self._addr_to_bytes(addr))
+
+    def erase_4kb(self, addr):
+        """Erase a 4KB sector at specified address"""
+        self.erase_block(addr, 0x1000)
+
+    def erase_32kb(self, addr):
+        """Erase a 32KB block at specified address"""
+        self.erase_block(addr, 0x8000)
+
     def erase_64kb(self, addr):
         """Erase a 64KB block at specified address"""
-        with self.we():
-            print(f'erase 64KB 0x{addr:06X}...')
-            self.spi.xfer(b'\xD8' + self._addr_to_bytes(addr))
+        self.erase_block(addr, 0x10000)
+
+    def erase_range(self, start, end, lo=None, hi=None):
+        """Erase [start, end) following plan_erase; returns the plan"""
+        plan = plan_erase(start, end, lo, hi)
+        self.erase_plan(plan)
+        return plan
+
+    def erase_plan(self, plan):
+        """Erase the (addr, size) blocks of plan"""
+        for i, (addr, size) in enumerate(plan):
+            self.erase_block(addr, size)
+            self.progress('erase', i + 1, len(plan))
         
-    def program_page(self, addr, payload):
-        """Program a page at specified address with given payload"""
-        with self.we():
-            self.spi.xfer(b'\x02' + self._addr_to_bytes(addr) + payload)
+    def _prepare_page(self, addr, payload):
+        self._prepared = (addr, payload, self.spi.prepare(b'\x02' + self._addr_to_bytes(addr) + payload))
+
+    def program_page(self, addr, payload, next_page=None):
+        """Program a page at specified address with given payload;
+        the transfer of next_page (addr, payload) is prepared while this one completes"""
+        prepared = self._prepared
+        self._prepared = None
+        if prepared is None or prepared[:2] != (addr, payload):
+            self._prepare_page(addr, payload)
+            prepared, self._prepared = self._prepared, None
+        idle = (lambda: self._prepare_page(*next_page)) if next_page else None
+        with self.we(idle) as batch:
+            batch.queue(prepared[2])
 
     def program(self, addr, payload):
         length = len(payload)
+        pages = []
         programed = 0
         while programed < length:
             need = length - programed
-            if need > self.page_size:
-                need = self.page_size
-            data = payload[programed: programed+need]
-            if data.count(0xFF) != len(data):
-                print(f'[{100.0*programed/length:.2f}%]program 0x{addr+programed:06X}...')
-                self.program_page(addr+programed, data)
-            else:
-                print(f'skip 0x{addr+programed:06X}...')
+            # A page program must not wrap around the end of a flash page
+            need = min(need, self.page_size, FLASH_PAGE_SIZE - (addr+programed) % FLASH_PAGE_SIZE)
+            pages.append((addr+programed, payload[programed: programed+need]))
             programed += need
         assert(length == programed)
+        todo = [page for page in pages if page[1].count(0xFF) != len(page[1])]
+        following = dict(zip(todo, todo[1:]))
+        for page_addr, data in pages:
+            # Blank pages are skipped
+            if data.count(0xFF) != len(data):
+                self.program_page(page_addr, data, following.get((page_addr, data)))
+            self.progress('program', page_addr + len(data) - addr, length)
+
+    def update(self, addr, payload, current):
+        """Erase and program only the sectors where payload differs from current flash contents; returns diff_sectors"""
+        changed, erases, pages = plan_update(addr, payload, current, self.page_size)
+        with self.phase("erase", erase_cost(erases)):
+            self.erase_plan(erases)
+        with self.phase("program", len(pages) * PAGE_PROGRAM_TIME):
+            for i, (page_addr, data) in enumerate(pages):
+                self.program_page(page_addr, data, pages[i+1] if i+1 < len(pages) else None)
+                self.progress('program', i + 1, len(pages))
+        return changed
+
+    @contextmanager
+    def phase(self, name, planned=None):
+        """stats.phase, printing the elapsed (and planned) time at the end"""
+        with self.stats.phase(name, planned) as record:
+            yield record
+        print_phase(name, record['seconds'], record['planned'])
         
     def _addr_to_bytes(self, addr):
         """Convert 24-bit address to 3 bytes (big-endian)"""
@@ -79,29 +376,65 @@ class SPIFlashDevice:
         ])
         
     class _WriteEnableManager:
-        def __init__(self, flash_dev):
+        # Write enable and the operation share one batch; completion is awaited by the WipWaiter
+
+        def __init__(self, flash_dev, idle=None):
             self.flash_dev = flash_dev
+            self.idle = idle
             
         def __enter__(self):
-            self.flash_dev.spi.xfer(b'\x06')  # Write Enable
-            return self
+            self.batch = self.flash_dev.spi.batch()
+            self.batch.xfer(b'\x06')  # Write Enable
+            return self.batch
             
         def __exit__(self, exc_type, exc_val, exc_tb):
-            while 0x1 & self.flash_dev.spi.xfer(b'\x05', 1)[0]:  # Status Register-1 S0:WIP
-                continue
-            self.flash_dev.spi.xfer(b'\x04')  # Write Disable
+            if exc_type is not None:
+                self._recover()
+                return
+            opcode = self.batch.transactions[-1][0][0]
+            spi = self.flash_dev.spi
+            try:
+                self.batch.flush()
+                self.flash_dev.wip.wait(lambda: spi.xfer(b'\x05', 1)[0], opcode, self.flash_dev.wip.clock(), self.idle)
+            except Exception:
+                self._recover()
+                raise
+            spi.xfer(b'\x04')  # Write Disable
 
+        def _recover(self):
+            # After a failure: let an operation that did start finish (bounded by WipWaiter.TIMEOUT),
+            # then clear WEL, so the next command does not run into a busy or write-enabled flash
+            spi = self.flash_dev.spi
+            wip = self.flash_dev.wip
+            deadline = wip.clock() + wip.TIMEOUT
+            try:
+                while 0x1 & spi.xfer(b'\x05', 1)[0] and wip.clock() < deadline:
+                    wip.sleep(wip.MAX_POLL)
+                spi.xfer(b'\x04')  # Write Disable
+            except Exception:
+                # The device may be gone; the original error is the one to report
+                pass
 
-# python spi_flash.py firmware.bin
-if __name__ == "__main__":
-    import sys
 
-    if len(sys.argv) < 2:
-        print(f'usage: {sys.argv[0]} <firmware.bin>')
-        sys.exit(1)
+# python spi_flash.py firmware.bin [--diff] [--emulate flash.img]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('firmware')
+    parser.add_argument('--diff', action='store_true',
+                        help='erase and program only the 4KB sectors that differ from the flash contents')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='read the flash contents back instead of using the cached image of this unit')
+    parser.add_argument('--cache-dir', default='flash_cache', help='images last written, by flash UID')
+    parser.add_argument('--page-size', type=page_size_arg, default=FLASH_PAGE_SIZE,
+                        help='bytes per page program transaction (a divisor of 256)')
+    parser.add_argument('--emulate', metavar='IMAGE',
+                        help='run against an emulated flash kept in IMAGE instead of the device')
+    parser.add_argument('--report', metavar='JSON',
+                        help='write phase times, USB/SPI transfer statistics and WIP waits to JSON')
+    args = parser.parse_args()
 
     # 直接读取文件（二进制模式）
-    with open(sys.argv[1], 'rb') as f:
+    with open(args.firmware, 'rb') as f:
         firmware = f.read()
         firmware_size = len(firmware)
     print(f"Read {firmware_size} bytes")
@@ -114,13 +447,28 @@ if __name__ == "__main__":
     # firmware_size += padding_size
     # print(f'paded size: {firmware_size}')
 
-    with SPIFlashDevice(0x359F, 0x30F1) as flash: 
+    usb = None
+    stats = OTAStats()
+    if args.emulate:
+        import hashlib
+        from usb_emulator import EmulatedUSBDevice, NORFlash, VirtualClock
+        clock = VirtualClock()
+        image = open(args.emulate, 'rb').read() if os.path.exists(args.emulate) else None
+        # One UID per image file, so the image cache follows the emulated contents
+        emulated_uid = hashlib.md5(os.path.abspath(args.emulate).encode()).digest()
+        usb = EmulatedUSBDevice(NORFlash(clock, image=image, uid=emulated_uid))
+        stats = OTAStats(clock.monotonic)
+
+    with SPIFlashDevice(0x359F, 0x30F1, usb, stats) as flash: 
+        if usb is not None:
+            flash.wip = WipWaiter(clock.monotonic, clock.sleep)
         # Reset flash
         assert flash.reset()
         
         # Read ID and UID
         print("ID:", flash.read_id().hex())
-        print("UID:", flash.read_uid().hex())
+        uid = flash.read_uid()
+        print("UID:", uid.hex())
         print("STATUS:")
         data = flash.spi.xfer(b'\x05', 1)
         print(data.hex())
@@ -129,62 +477,132 @@ if __name__ == "__main__":
         data = flash.spi.xfer(b'\x15', 1)
         print(data.hex())
         
-        # Read data
-        data = flash.read_data(0x0, firmware_size)
-        print(f"Dump {len(data)} bytes")
-        open('dump.bin', 'wb').write(data)
-
         # start = 0x100000
         start = 0x0
 
-        print(f"=======================================================================")
-        # Erase
-        for addr in range(start, start+firmware_size, alignment):
-            flash.erase_64kb(addr)
-        data = flash.read_data(start, firmware_size)
-        # print(f"Dump {len(data)} bytes to erased.bin")
-        # open('erased.bin', 'wb').write(data)
-        print(data.count(0xFF) == len(data))
-
-        # data = b''
-        # for addr in range(start, start+firmware_size, alignment):
-        #     tmp = flash.read_data(addr, alignment)
-        #     while tmp.count(0xFF) != len(tmp):
-        #         print(f"Erase 0x{addr:06X}:")
-        #         with flash.we():
-        #             flash.spi.xfer(b'\xD8' + flash._addr_to_bytes(addr))
-        #         tmp = flash.read_data(addr, alignment)
-        #         tmp = flash.read_data(addr, alignment)
-        #     data += tmp
-        # print(f"Read {len(data)} bytes:") #, data.hex())
-        # open('erased.bin', 'wb').write(data)
-        # print(data.count(0xFF) == len(data))
-
-
-        print(f"=======================================================================")
-        # program
-        flash.page_size = 0x20
-        flash.program(start, firmware)
-        print(f"=======================================================================")
-        print("Check Program Result(True=Pass, False=Fail):")
-        data = flash.read_data(start, firmware_size)
-        # print(f"Dump {len(data)} bytes to rdback.bin")
-        # open('rdback.bin', 'wb').write(data)
-        print(firmware == data)
-
-        # flash.page_size = 0x40
-        # data = b''
-        # for addr in range(start, start+firmware_size, flash.page_size):
-        #     page_payload = firmware[addr-start:addr-start+flash.page_size]
-        #     tmp = flash.read_data(addr, flash.page_size)
-        #     while tmp != page_payload:
-        #         print(f"Program Page 0x{addr:06X}:")
-        #         flash.program_page(addr, page_payload)
-        #         # with flash.we():
-        #         #     flash.spi.xfer(b'\x02' + flash._addr_to_bytes(addr) + page_payload)
-        #         tmp = flash.read_data(addr, flash.page_size)
-        #         tmp = flash.read_data(addr, flash.page_size)
-        #     data += tmp
-        # print(f"Read {len(data)} bytes:") #, data.hex())
-        # open('rdback.bin', 'wb').write(data)
-        # print(firmware == data)
+        # Read data; in differential mode the cached image of this unit stands in for the dump
+        data = None
+        if args.diff and not args.no_cache:
+            data = load_image_cache(args.cache_dir, uid, start, firmware_size)
+            if data is not None:
+                # The unit may have been flashed by other means since the cache was written
+                with flash.phase("cache check"):
+                    stale = [offset for offset in cache_check_offsets(firmware_size)
+                             if flash.read_data(start+offset, min(SECTOR_SIZE, firmware_size-offset))
+                             != data[offset:offset+SECTOR_SIZE]]
+                if stale:
+                    print(f"Cached image {image_cache_path(args.cache_dir, uid, start)} differs from the flash "
+                          f"at 0x{start+stale[0]:06X}, reading the flash back")
+                    drop_image_cache(args.cache_dir, uid, start)
+                    data = None
+                else:
+                    print(f"Using cached image {image_cache_path(args.cache_dir, uid, start)}")
+        if data is None:
+            with flash.phase("dump") as phase:
+                data = flash.read_data(start, firmware_size)
+            print_throughput("Dump", len(data), phase['seconds'])
+            open('dump.bin', 'wb').write(data)
+
+        flash.page_size = args.page_size
+
+        if args.diff:
+            print(f"=======================================================================")
+            # Erase and program the changed sectors only
+            changed = flash.update(start, firmware, data)
+            sectors = (firmware_size + SECTOR_SIZE - 1) // SECTOR_SIZE
+            print(f"{len(changed)} of {sectors} sectors changed, {sum(e for _, e in changed)} erased")
+            print(f"=======================================================================")
+            print("Check Program Result(True=Pass, False=Fail):")
+            # The whole image: unchanged sectors are only known from the cache or the dump
+            with flash.phase("verify") as phase:
+                data = flash.read_data(start, firmware_size)
+            print_throughput("Verify read", len(data), phase['seconds'])
+            ok = firmware == data
+            print(ok)
+            if not ok:
+                print("Flash differs from the image, run again with --no-cache")
+        else:
+            print(f"=======================================================================")
+            # Erase, within the 64KB blocks covering the image
+            plan = plan_erase(start, start+firmware_size, start - start % alignment,
+                              -(-(start+firmware_size) // alignment) * alignment)
+            with flash.phase("erase", erase_cost(plan)):
+                flash.erase_plan(plan)
+            with flash.phase("erase check") as phase:
+                data = flash.read_data(start, firmware_size)
+            print_throughput("Erase check read", len(data), phase['seconds'])
+            # print(f"Dump {len(data)} bytes to erased.bin")
+            # open('erased.bin', 'wb').write(data)
+            print(data.count(0xFF) == len(data))
+
+            # data = b''
+            # for addr in range(start, start+firmware_size, alignment):
+            #     tmp = flash.read_data(addr, alignment)
+            #     while tmp.count(0xFF) != len(tmp):
+            #         print(f"Erase 0x{addr:06X}:")
+            #         with flash.we():
+            #             flash.spi.xfer(b'\xD8' + flash._addr_to_bytes(addr))
+            #         tmp = flash.read_data(addr, alignment)
+            #         tmp = flash.read_data(addr, alignment)
+            #     data += tmp
+            # print(f"Read {len(data)} bytes:") #, data.hex())
+            # open('erased.bin', 'wb').write(data)
+            # print(data.count(0xFF) == len(data))
+
+
+            print(f"=======================================================================")
+            # program
+            pages = sum(firmware[i:i+FLASH_PAGE_SIZE].count(0xFF) != len(firmware[i:i+FLASH_PAGE_SIZE])
+                        for i in range(0, firmware_size, FLASH_PAGE_SIZE))
+            with flash.phase("program", pages * PAGE_PROGRAM_TIME):
+                flash.program(start, firmware)
+            print(f"=======================================================================")
+            print("Check Program Result(True=Pass, False=Fail):")
+            with flash.phase("verify") as phase:
+                data = flash.read_data(start, firmware_size)
+            print_throughput("Verify read", len(data), phase['seconds'])
+            # print(f"Dump {len(data)} bytes to rdback.bin")
+            # open('rdback.bin', 'wb').write(data)
+            ok = firmware == data
+            print(ok)
+
+            # flash.page_size = 0x40
+            # data = b''
+            # for addr in range(start, start+firmware_size, flash.page_size):
+            #     page_payload = firmware[addr-start:addr-start+flash.page_size]
+            #     tmp = flash.read_data(addr, flash.page_size)
+            #     while tmp != page_payload:
+            #         print(f"Program Page 0x{addr:06X}:")
+            #         flash.program_page(addr, page_payload)
+            #         # with flash.we():
+            #         #     flash.spi.xfer(b'\x02' + flash._addr_to_bytes(addr) + page_payload)
+            #         tmp = flash.read_data(addr, flash.page_size)
+            #         tmp = flash.read_data(addr, flash.page_size)
+            #     data += tmp
+            # print(f"Read {len(data)} bytes:") #, data.hex())
+            # open('rdback.bin', 'wb').write(data)
+            # print(firmware == data)
+
+        print("WIP wait:")
+        for line in flash.wip.summary():
+            print(f"  {line}")
+
+        # Only an image verified over its whole range describes the flash contents
+        if ok:
+            save_image_cache(args.cache_dir, uid, start, firmware)
+        else:
+            drop_image_cache(args.cache_dir, uid, start)
+
+        if args.report:
+            report = {'firmware': os.path.abspath(args.firmware), 'size': firmware_size,
+                      'mode': 'diff' if args.diff else 'full', 'page_size': args.page_size,
+                      'uid': uid.hex(), 'emulated': usb is not None, 'ok': ok}
+            report.update(stats.report())
+            report['wip'] = flash.wip.report()
+            with open(args.report, 'w') as f:
+                json.dump(report, f, indent=2)
+
+    if usb is not None:
+        with open(args.emulate, 'wb') as f:
+            f.write(usb.flash.mem)
+        print("Emulator:", usb.summary())
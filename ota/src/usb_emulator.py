@@ -0,0 +1,236 @@
+"""
+In-process stand-in for USBDevice: the USB-SPI bridge (SPIPacket commands,
+SPIConfigRegister transfer semantics) in front of a NOR flash model.
+
+Time is virtual: every USB transfer advances the clock by a configurable
+latency plus its size over the link bandwidth, every SPI transfer by its
+bit time, and host waits go through VirtualClock.sleep. Program and erase
+durations are modelled on that clock, so OTA runs are reproducible and
+their emulated time can be compared between commits.
+
+    python spi_flash.py firmware.bin --emulate flash.img
+"""
+from spi_config import SPIConfigRegister
+from spi_data_packet import SPIPacket
+from spi_device import STATUS_IDLE
+
+# TransferControlRegister.TransMode values used by SPIDevice
+MODE_WRITE_READ = 0x3
+MODE_WRITE = 0x1
+MODE_READ = 0x2
+MODE_WRITE_DUMMY_READ = 0x5
+MODE_NONE = 0x7
+
+
+class FlashModelError(Exception):
+    """A command the flash would silently ignore or corrupt data with (strict mode)"""
+
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.now += seconds
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class NORFlash:
+    """
+    Serial NOR flash (W25Q-like command set) on a VirtualClock.
+
+    Programming only clears bits; in strict mode programming a 1 over a 0,
+    a write without WEL, or any command but a status read while busy raises
+    FlashModelError instead of being silently ANDed or ignored.
+    """
+    PAGE_SIZE = 0x100
+    ERASE_SIZES = {0x20: 0x1000, 0x52: 0x8000, 0xD8: 0x10000}
+    STATUS_READS = {0x05: 0, 0x35: 1, 0x15: 2}
+
+    def __init__(self, clock, size=16 << 20, image=None, program_time=0.0007,
+                 erase_times=None, chip_erase_time=10.0, jedec_id=b'\xef\x40\x18',
+                 uid=bytes(range(16)), strict=True):
+        self.clock = clock
+        self.size = size
+        self.mem = bytearray(b'\xff' * size)
+        if image is not None:
+            self.mem[:len(image)] = image
+        self.program_time = program_time
+        self.erase_times = erase_times or {0x20: 0.045, 0x52: 0.120, 0xD8: 0.150}
+        self.chip_erase_time = chip_erase_time
+        self.jedec_id = jedec_id
+        self.uid = uid
+        self.strict = strict
+        self.status = bytearray(3)
+        self.busy_until = 0.0
+        # opcode -> number of executed commands
+        self.counts = {}
+
+    @property
+    def busy(self):
+        return self.clock.monotonic() < self.busy_until
+
+    def _error(self, message):
+        if self.strict:
+            raise FlashModelError(message)
+
+    def _addr(self, mosi):
+        return int.from_bytes(mosi[1:4], 'big') % self.size
+
+    def _start_write(self, seconds):
+        self.status[0] &= ~0x02  # WEL clears when the operation starts
+        self.busy_until = self.clock.monotonic() + seconds
+
+    def transaction(self, mosi, nread):
+        """One chip-select period: shift out mosi, return the nread bytes clocked in afterwards"""
+        opcode = mosi[0]
+        self.counts[opcode] = self.counts.get(opcode, 0) + 1
+        wip = 0x01 if self.busy else 0x00
+        if opcode in self.STATUS_READS:
+            reg = self.STATUS_READS[opcode]
+            value = (self.status[reg] | wip) if reg == 0 else self.status[reg]
+            return bytes([value]) * nread
+        if wip:
+            self._error(f'command 0x{opcode:02X} while busy')
+            return b'\xff' * nread
+        if opcode == 0x06:
+            self.status[0] |= 0x02
+        elif opcode == 0x04:
+            self.status[0] &= ~0x02
+        elif opcode == 0x9F:
+            return self._stream(self.jedec_id, 1, mosi, nread)
+        elif opcode == 0x4B:
+            return self._stream(self.uid, 5, mosi, nread)
+        elif opcode in (0x03, 0x0B):
+            header = 4 if opcode == 0x03 else 5
+            addr = self._addr(mosi)
+            end = addr + len(mosi) + nread - header
+            data = bytes(self.mem[addr:min(end, self.size)]) + bytes(self.mem[:max(end - self.size, 0)])
+            return self._stream(data, header, mosi, nread)
+        elif opcode == 0x02:
+            self._program(self._addr(mosi), mosi[4:])
+        elif opcode in self.ERASE_SIZES:
+            self._erase(self._addr(mosi), self.ERASE_SIZES[opcode], self.erase_times[opcode])
+        elif opcode in (0x60, 0xC7):
+            self._erase(0, self.size, self.chip_erase_time)
+        return b'\xff' * nread
+
+    def _stream(self, data, header, mosi, nread):
+        # Output byte k of the transaction is data[k - header]
+        out = bytes(header) + bytes(data)
+        out = out[len(mosi):len(mosi) + nread]
+        return out + b'\xff' * (nread - len(out))
+
+    def _program(self, addr, data):
+        if not self.status[0] & 0x02:
+            self._error(f'page program 0x{addr:06X} without write enable')
+            return
+        if len(data) > self.PAGE_SIZE:
+            self._error(f'page program 0x{addr:06X} of {len(data)} bytes')
+        base = addr - addr % self.PAGE_SIZE
+        for i, value in enumerate(data[-self.PAGE_SIZE:]):
+            pos = base + (addr + i) % self.PAGE_SIZE
+            if value & ~self.mem[pos] & 0xFF:
+                self._error(f'program over unerased data at 0x{pos:06X}')
+            self.mem[pos] &= value
+        self._start_write(self.program_time)
+
+    def _erase(self, addr, size, seconds):
+        if not self.status[0] & 0x02:
+            self._error(f'erase 0x{addr:06X} without write enable')
+            return
+        addr -= addr % size
+        self.mem[addr:addr + size] = b'\xff' * size
+        self._start_write(seconds)
+
+
+class EmulatedUSBDevice:
+    """
+    Drop-in for USBDevice (write/read/close) emulating the bridge firmware.
+
+    latency is charged per USB transfer, plus the transfer size over
+    bandwidth (bytes/s); spi_hz sets the SPI clock of the emulated bus.
+    """
+
+    def __init__(self, flash=None, clock=None, latency=125e-6, bandwidth=30e6, spi_hz=30e6):
+        self.clock = clock or (flash.clock if flash is not None else VirtualClock())
+        self.flash = flash or NORFlash(self.clock)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.spi_hz = spi_hz
+        self.rx = b''
+        self.pending = None
+        self.transfers = 0
+        self.bytes = 0
+
+    def _charge(self, nbytes):
+        self.transfers += 1
+        self.bytes += nbytes
+        self.clock.advance(self.latency + nbytes / self.bandwidth)
+
+    def write(self, data: bytes, timeout: int = 1000) -> int:
+        data = bytes(data)
+        self._charge(len(data))
+        packet = SPIPacket.parse(data)
+        if packet.command == SPIPacket.CMD_SET_REGISTER:
+            self._set_register(packet.data)
+        elif packet.command in (SPIPacket.CMD_READ_REGISTER, SPIPacket.CMD_READ_DATA):
+            self.pending = packet.command
+        else:
+            raise ValueError(f'Unknown SPIPacket command 0x{packet.command:08X}')
+        return len(data)
+
+    def read(self, size: int, timeout: int = 1000) -> bytes:
+        if self.pending == SPIPacket.CMD_READ_REGISTER:
+            config = SPIConfigRegister()
+            # Unread RX data shows up as a non-empty RX FIFO
+            config.StatusRegister.value = STATUS_IDLE if not self.rx else STATUS_IDLE & ~(1 << 14)
+            data = bytes(config)[:size]
+        elif self.pending == SPIPacket.CMD_READ_DATA:
+            data, self.rx = self.rx[:size], self.rx[size:]
+        else:
+            raise TimeoutError('USB read without a pending request')
+        self.pending = None
+        self._charge(len(data))
+        return data
+
+    def _set_register(self, payload):
+        n = SPIConfigRegister.size()
+        config = SPIConfigRegister.from_buffer_copy(payload[:n])
+        if config.ControlRegister.RXFIFORST:
+            self.rx = b''
+        tc = config.TransferControlRegister
+        mode = tc.TransMode
+        if mode == MODE_NONE:
+            return
+        mosi = b''
+        if mode in (MODE_WRITE, MODE_WRITE_READ, MODE_WRITE_DUMMY_READ):
+            mosi = payload[n:n + tc.WrTranCnt + 1]
+        if mode == MODE_WRITE_DUMMY_READ:
+            mosi += b'\xff' * (tc.DummyCnt + 1)
+        nread = tc.RdTranCnt + 1 if mode in (MODE_READ, MODE_WRITE_READ, MODE_WRITE_DUMMY_READ) else 0
+        self.clock.advance((len(mosi) + nread) * 8 / self.spi_hz)
+        if mosi:
+            self.rx += self.flash.transaction(mosi, nread)
+        else:
+            self.rx += b'\xff' * nread
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def summary(self):
+        counts = ', '.join(f'0x{op:02X} x{n}' for op, n in sorted(self.flash.counts.items()))
+        return (f'emulated time {self.clock.monotonic():.3f} s, {self.transfers} USB transfers, '
+                f'{self.bytes} bytes; flash commands: {counts}')
@@ -0,0 +1,127 @@
+import os
+import random
+import subprocess
+import sys
+import pytest
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+from spi_flash import SPIFlashDevice, WipWaiter, SECTOR_SIZE, plan_update
+from usb_emulator import EmulatedUSBDevice, NORFlash, VirtualClock
+
+SIZE = 0x40000
+
+def random_image(size, seed):
+    return random.Random(seed).randbytes(size)
+
+def emulated_flash(image=None):
+    """SPIFlashDevice on a strict NORFlash: unerased programs, missing write enables
+    and commands while busy raise FlashModelError"""
+    clock = VirtualClock()
+    usb = EmulatedUSBDevice(NORFlash(clock, size=1 << 20, image=image, strict=True))
+    flash = SPIFlashDevice(0, 0, usb, progress=lambda what, done, total: None)
+    flash.wip = WipWaiter(clock.monotonic, clock.sleep)
+    return flash, usb.flash
+
+def erase_ops(nor):
+    return {op: nor.counts.get(op, 0) for op in (0x20, 0x52, 0xD8)}
+
+def test_erase_range_mixes_block_sizes():
+    image = random_image(SIZE, 0)
+    flash, nor = emulated_flash(image)
+    start, end = 0x3000, 0x2D000
+    with flash:
+        plan = flash.erase_range(start, end)
+        data = flash.read_data(0, SIZE)
+    assert {size for _, size in plan} == {0x1000, 0x8000, 0x10000}
+    assert all(count for count in erase_ops(nor).values())
+    assert data[start:end].count(0xFF) == end - start
+    assert data[:start] == image[:start] and data[end:] == image[end:]
+
+def test_full_update():
+    firmware = random_image(SIZE, 1)
+    flash, nor = emulated_flash(random_image(SIZE, 2))
+    with flash:
+        flash.erase_range(0, SIZE)
+        flash.program(0, firmware)
+        assert flash.read_data(0, SIZE) == firmware
+
+def test_diff_update():
+    old = random_image(SIZE, 3)
+    new = bytearray(old)
+    # Sectors 1..0x2C rewritten: an erase run planned as 4KB, 32KB and 64KB blocks
+    new[0x1000:0x2D000] = random_image(0x2C000, 4)
+    # Only clears bits: programmed without an erase
+    new[0x30000] = old[0x30000] & 0x0F
+    new = bytes(new)
+    flash, nor = emulated_flash(old)
+    with flash:
+        changed = flash.update(0, new, old)
+        assert flash.read_data(0, SIZE) == new
+    assert (0x30000, False) in changed
+    assert len(changed) == 0x2C + 1
+    _, erases, _ = plan_update(0, new, old)
+    assert {size for _, size in erases} == {0x1000, 0x8000, 0x10000}
+    assert all(count for count in erase_ops(nor).values())
+
+@pytest.mark.parametrize('page_size', [0x30, 0x200])
+def test_diff_update_keeps_programs_within_flash_pages(page_size):
+    old = random_image(SIZE, 8)
+    new = bytearray(old)
+    new[0x5000:0x7000] = random_image(0x2000, 9)
+    new = bytes(new)
+    flash, nor = emulated_flash(old)
+    flash.page_size = page_size
+    with flash:
+        flash.update(0, new, old)
+        assert flash.read_data(0, SIZE) == new
+    _, _, pages = plan_update(0, new, old, page_size)
+    assert all(addr // 0x100 == (addr + len(data) - 1) // 0x100 for addr, data in pages)
+
+def run_spi_flash(tmp_path, firmware, *args):
+    path = tmp_path / 'firmware.bin'
+    path.write_bytes(firmware)
+    result = subprocess.run([sys.executable, os.path.join(SRC, 'spi_flash.py'), str(path),
+                             '--emulate', 'flash.img', *args],
+                            cwd=tmp_path, capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+def verified(out):
+    # The verify result is printed right after the verify read throughput
+    lines = out.splitlines()
+    return lines[next(i for i, line in enumerate(lines) if line.startswith('Verify read')) + 1] == 'True'
+
+@pytest.mark.parametrize('cache', [True, False])
+def test_spi_flash_emulate(tmp_path, cache):
+    firmware = random_image(SIZE, 5)
+    out = run_spi_flash(tmp_path, firmware)
+    assert verified(out)
+    assert (tmp_path / 'flash.img').read_bytes()[:SIZE] == firmware
+    # Second image: a changed run of sectors and a changed last sector
+    update = bytearray(firmware)
+    update[0x2000:0x22000] = random_image(0x20000, 6)
+    update[-SECTOR_SIZE:] = random_image(SECTOR_SIZE, 7)
+    update = bytes(update)
+    out = run_spi_flash(tmp_path, update, '--diff', *(() if cache else ('--no-cache',)))
+    assert ('Using cached image' in out) == cache
+    assert verified(out)
+    assert (tmp_path / 'flash.img').read_bytes()[:SIZE] == update
+
+def test_spi_flash_rejects_page_sizes_not_dividing_flash_pages(tmp_path):
+    for page_size in ('0x30', '0x200', '0'):
+        result = subprocess.run([sys.executable, os.path.join(SRC, 'spi_flash.py'), 'firmware.bin',
+                                 '--emulate', 'flash.img', '--page-size', page_size],
+                                cwd=tmp_path, capture_output=True, text=True)
+        assert result.returncode == 2 and 'page size must divide' in result.stderr
+
+def test_spi_flash_diff_uses_cache_of_longer_image(tmp_path):
+    firmware = random_image(SIZE, 10)
+    assert verified(run_spi_flash(tmp_path, firmware))
+    # Not a whole number of sectors, so the last sector checked is partial
+    update = bytearray(firmware[:SIZE // 2 + 0x800])
+    update[0x1000:0x3000] = random_image(0x2000, 11)
+    out = run_spi_flash(tmp_path, bytes(update), '--diff')
+    assert 'Using cached image' in out
+    assert verified(out)
+    assert (tmp_path / 'flash.img').read_bytes()[:len(update)] == update
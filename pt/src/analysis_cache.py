@@ -0,0 +1,175 @@
+import hashlib
+import os
+import tempfile
+import numpy as np
+from logic_analyzer import PwmStats, TransitionIndex
+
+# Bytes hashed from the head, the tail and each probe in between
+HASH_BLOCK = 64 * 1024
+HASH_PROBES = 16
+MAX_CACHE_BYTES = 1024 * 1024 * 1024
+# Part of every key: bumped when the stored results change meaning, so older
+# entries are no longer hit (2: measurements restart at dropped data)
+CACHE_VERSION = 2
+
+def default_cache_dir():
+    return os.environ.get('SLOGIC_CACHE_DIR') or os.path.join(
+        os.path.expanduser('~'), '.cache', 'slogic16u3')
+
+def capture_key(path, num_channels):
+    """
+    Fast content key of a capture file.
+
+    Combines size and mtime with a hash of the head, the tail and a few
+    evenly spaced blocks, so multi-GB files are keyed without reading them.
+    """
+    st = os.stat(path)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{CACHE_VERSION}:{num_channels}:{st.st_size}:{st.st_mtime_ns}".encode())
+    with open(path, 'rb') as f:
+        span = max(st.st_size - HASH_BLOCK, 0)
+        for i in range(HASH_PROBES + 2):
+            f.seek(span * i // (HASH_PROBES + 1))
+            h.update(f.read(HASH_BLOCK))
+    return h.hexdigest()
+
+def _encode_stats(results):
+    table = np.full((len(results), len(PwmStats._fields)), np.nan)
+    for ch, stats in enumerate(results):
+        if stats is not None:
+            table[ch] = [np.nan if v is None else v for v in stats]
+    return table
+
+def _decode_stats(table):
+    results = []
+    for row in table:
+        if np.isnan(row[0]):
+            results.append(None)
+        else:
+            values = [None if np.isnan(v) else float(v) for v in row]
+            results.append(PwmStats(int(row[0]), *values[1:]))
+    return results
+
+class AnalysisCache:
+    """
+    LRU directory of analysis results keyed by capture content.
+
+    Each entry is one .npz file holding the measurement table and, when
+    available, the per-channel edge arrays of the TransitionIndex. A hit
+    refreshes the entry's mtime; entries are evicted oldest first once the
+    directory grows past max_bytes.
+    """
+
+    def __init__(self, directory=None, max_bytes=MAX_CACHE_BYTES):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+
+    def _entry(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key, names=None):
+        """Return the arrays stored under key (only `names` if given), or None."""
+        entry = self._entry(key)
+        try:
+            with np.load(entry) as data:
+                arrays = {name: data[name] for name in data.files
+                          if names is None or name in names}
+            os.utime(entry)
+        except (OSError, ValueError):
+            return None
+        return arrays
+
+    def put(self, key, **arrays):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp, self._entry(key))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """
+        Drop least recently used entries until the size limit is met.
+
+        Other processes may share the directory and evict concurrently, so
+        entries that disappear meanwhile are skipped.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz') and name != f'{keep}.npz':
+                try:
+                    st = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        if keep is not None:
+            try:
+                total += os.path.getsize(self._entry(keep))
+            except FileNotFoundError:
+                pass
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            # Gone either way
+            total -= size
+
+    @staticmethod
+    def _index(data, num_channels, sample_rate):
+        if data is None or 'initial' not in data:
+            return None
+        return TransitionIndex(
+            [data[f'rising_{ch}'] for ch in range(num_channels)],
+            [data[f'falling_{ch}'] for ch in range(num_channels)],
+            [int(v) for v in data['initial']],
+            int(data['num_samples']), sample_rate, data['gaps'])
+
+    def load_index(self, path, num_channels, sample_rate=None, executor=None, progress=None):
+        """
+        Cached TransitionIndex of a capture, built and stored on a miss.
+
+        executor and progress are passed to TransitionIndex.build_parallel.
+        """
+        key = capture_key(path, num_channels)
+        data = self.get(key)
+        index = self._index(data, num_channels, sample_rate)
+        if index is None:
+            index = TransitionIndex.build_parallel(path, num_channels, sample_rate,
+                                                   executor=executor, progress=progress)
+            arrays = self._index_arrays(index)
+            if data is not None and 'stats' in data:
+                arrays.update(stats=data['stats'], sample_rate=data['sample_rate'])
+            self.put(key, **arrays)
+        return index
+
+    def measure(self, path, num_channels, sample_rate, executor=None, progress=None):
+        """Cached per-channel PwmStats of a capture (see load_index for the options)."""
+        key = capture_key(path, num_channels)
+        data = self.get(key, ('stats', 'sample_rate'))
+        if data is not None and 'stats' in data and data['sample_rate'] == sample_rate:
+            return _decode_stats(data['stats'])
+        data = self.get(key)
+        index = self._index(data, num_channels, sample_rate)
+        if index is None:
+            index = TransitionIndex.build_parallel(path, num_channels, sample_rate,
+                                                   executor=executor, progress=progress)
+        results = [index.pwm_stats(ch) for ch in range(num_channels)]
+        self.put(key, stats=_encode_stats(results), sample_rate=float(sample_rate),
+                 **self._index_arrays(index))
+        return results
+
+    @staticmethod
+    def _index_arrays(index):
+        arrays = {'initial': np.array(index.initial), 'num_samples': index.num_samples, 'gaps': index.gaps}
+        for ch in range(index.num_channels):
+            arrays[f'rising_{ch}'] = index.rising[ch]
+            arrays[f'falling_{ch}'] = index.falling[ch]
+        return arrays
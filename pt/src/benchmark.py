@@ -0,0 +1,238 @@
+"""
+Benchmark the capture decode and measurement kernels.
+
+Generates synthetic PWM captures in the on-disk formats written by
+slogic_cli (1/2/4/8/16 channels, <ch>ch_<rate>M_wave.bin, as the current
+container and as legacy headerless files) and times every kernel in a fresh
+process, so the reported peak RSS belongs to that kernel alone. Results are
+printed and saved as JSON for comparing commits.
+
+    python benchmark.py --sizes 1M,64M,1G --channels 4,8,16 -o bench.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import subprocess
+import sys
+import time
+import numpy as np
+import logic_analyzer as la
+import trigger
+
+SAMPLE_RATE_MHZ = 400
+# PWM period (samples) and duty of every generated channel
+PWM_PERIODS = [40, 8, 8, 16, 24, 32, 40, 48, 56, 64, 72, 80, 88, 96, 104, 112]
+PWM_DUTY = 0.5
+# extract_channels keeps every channel in memory, so bound its input
+EXTRACT_LIMIT = 512 * 1024 * 1024
+FORMATS = ('container', 'legacy')
+# Default limit (seconds) for one kernel run
+KERNEL_TIMEOUT = 600
+
+def parse_size(text):
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    text = text.strip().upper()
+    if text[-1:] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+def generate_capture(path, num_channels, size, chunk_size=la.CHUNK_SIZE, container=True):
+    """Write a synthetic PWM capture with a `size` bytes payload, block by block."""
+    samples_per_chunk = la.num_samples(la.block_bytes(chunk_size, num_channels), num_channels)
+    periods = np.array(PWM_PERIODS[:num_channels])[:, None]
+    total = la.num_samples(size, num_channels)
+    f = la.CaptureWriter(path, num_channels, SAMPLE_RATE_MHZ * 1e6) if container else open(path, 'wb')
+    write = f.append if container else f.write
+    with f:
+        for start in range(0, total, samples_per_chunk):
+            t = np.arange(start, min(start + samples_per_chunk, total))
+            bits = (t % periods) < periods * PWM_DUTY
+            words = np.zeros(len(t), dtype=np.uint16)
+            for ch in range(num_channels):
+                words |= bits[ch].astype(np.uint16) << ch
+            if num_channels == 16:
+                write(words.tobytes())
+            elif num_channels == 8:
+                write(words.astype(np.uint8).tobytes())
+            else:
+                # Several samples per byte, first sample in the low bits
+                per_byte = 8 // num_channels
+                shifts = np.arange(per_byte, dtype=np.uint16) * num_channels
+                packed = np.bitwise_or.reduce(words.reshape(-1, per_byte) << shifts, axis=1)
+                write(packed.astype(np.uint8).tobytes())
+
+def _peak_rss():
+    # ru_maxrss survives exec on Linux and would include the parent's peak,
+    # so prefer the per-address-space high water mark
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+def _kernel_extract_channels(path, num_channels, sample_rate):
+    # Read the whole payload into memory, as the original loader did
+    la.extract_channels(np.array(la.load_capture(path)), num_channels)
+
+def _kernel_iter_channel_blocks(path, num_channels, sample_rate):
+    for _ in la.iter_channel_blocks(la.load_capture(path), num_channels):
+        pass
+
+def _kernel_detect_pwm_freq(path, num_channels, sample_rate):
+    la.detect_pwm_freq(la.iter_channel(la.load_capture(path), num_channels, 0), sample_rate)
+
+def _kernel_check_pwm_duty(path, num_channels, sample_rate):
+    la.check_pwm_duty(la.iter_channel(la.load_capture(path), num_channels, 0))
+
+def _kernel_measure_channels(path, num_channels, sample_rate):
+    la.measure_channels(la.load_capture(path), num_channels, sample_rate)
+
+def _kernel_transition_index(path, num_channels, sample_rate):
+    la.TransitionIndex.build(la.load_capture(path), num_channels, sample_rate)
+
+def _kernel_transition_index_parallel(path, num_channels, sample_rate):
+    la.TransitionIndex.build_parallel(path, num_channels, sample_rate)
+
+def _kernel_capture_pack(path, num_channels, sample_rate):
+    la.Capture.from_raw(la.load_capture(path), num_channels, sample_rate)
+
+def _kernel_trigger(path, num_channels, sample_rate):
+    trigger.find_triggers(la.load_capture(path), num_channels, trigger.Trigger(rising=1))
+
+KERNELS = {
+    'extract_channels': _kernel_extract_channels,
+    'iter_channel_blocks': _kernel_iter_channel_blocks,
+    'detect_pwm_freq': _kernel_detect_pwm_freq,
+    'check_pwm_duty': _kernel_check_pwm_duty,
+    'measure_channels': _kernel_measure_channels,
+    'transition_index': _kernel_transition_index,
+    'transition_index_parallel': _kernel_transition_index_parallel,
+    'capture_pack': _kernel_capture_pack,
+    'trigger': _kernel_trigger,
+}
+
+def _run_kernel(name, path, num_channels, sample_rate, queue):
+    start = time.perf_counter()
+    KERNELS[name](path, num_channels, sample_rate)
+    queue.put((time.perf_counter() - start, _peak_rss()))
+
+def run_kernel(name, path, num_channels, sample_rate, timeout=KERNEL_TIMEOUT):
+    """
+    Run one kernel in a fresh process; return (seconds, peak RSS bytes).
+
+    Raises RuntimeError if the process dies without a result (exception,
+    OOM kill) and TimeoutError if it runs longer than timeout seconds.
+    """
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    proc = ctx.Process(target=_run_kernel, args=(name, path, num_channels, sample_rate, results))
+    proc.start()
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                return results.get(timeout=1)
+            except queue.Empty:
+                pass
+            if not proc.is_alive():
+                # The result may have been queued just before exiting
+                try:
+                    return results.get(timeout=1)
+                except queue.Empty:
+                    raise RuntimeError(f"{name} exited with code {proc.exitcode}") from None
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{name} did not finish within {timeout} s")
+    finally:
+        if proc.is_alive():
+            proc.terminate()
+        proc.join()
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark logic_analyzer kernels")
+    parser.add_argument('--sizes', default='1M,16M,256M', help="capture sizes, e.g. 1M,1G,4G")
+    parser.add_argument('--channels', default='1,2,4,8,16')
+    parser.add_argument('--kernels', default=','.join(KERNELS))
+    parser.add_argument('--formats', default=','.join(FORMATS), help="capture file formats")
+    parser.add_argument('--timeout', type=float, default=KERNEL_TIMEOUT, help="seconds per kernel run")
+    parser.add_argument('--dir', default='bench_data', help="where generated captures are kept")
+    parser.add_argument('-o', '--output', default='bench_results.json')
+    args = parser.parse_args()
+
+    sample_rate = SAMPLE_RATE_MHZ * 1_000_000
+    report = {
+        'revision': git_revision(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'cpus': os.cpu_count(),
+        'results': [],
+    }
+    print(f"{'kernel':<26} {'format':<9} {'ch':>3} {'size':>10} {'MB/s':>10} {'Msamples/s':>11} {'peak RSS MB':>12}")
+    for size in map(parse_size, args.sizes.split(',')):
+        for num_channels in map(int, args.channels.split(',')):
+            size -= size % la.sample_width(num_channels)
+            samples = la.num_samples(size, num_channels)
+            for fmt in args.formats.split(','):
+                if fmt not in FORMATS:
+                    parser.error(f"unknown format {fmt}")
+                fmt_dir = os.path.join(args.dir, str(size), fmt)
+                os.makedirs(fmt_dir, exist_ok=True)
+                path = os.path.join(fmt_dir, f"{num_channels}ch_{SAMPLE_RATE_MHZ}M_wave.bin")
+                info = la.read_capture_info(path) if os.path.exists(path) else None
+                complete = (info is not None and info.payload_size == size if fmt == 'container'
+                            else os.path.exists(path) and os.path.getsize(path) == size)
+                if not complete:
+                    generate_capture(path, num_channels, size, container=fmt == 'container')
+                for name in args.kernels.split(','):
+                    if name == 'extract_channels' and size > EXTRACT_LIMIT:
+                        continue
+                    entry = {
+                        'kernel': name,
+                        'format': fmt,
+                        'channels': num_channels,
+                        'bytes': size,
+                        'samples': samples,
+                    }
+                    try:
+                        seconds, rss = run_kernel(name, path, num_channels, sample_rate, args.timeout)
+                    except (RuntimeError, TimeoutError) as e:
+                        entry['error'] = str(e)
+                        report['results'].append(entry)
+                        print(f"{name:<26} {fmt:<9} {num_channels:>3} {size:>10} FAILED: {e}")
+                        continue
+                    entry.update({
+                        'seconds': seconds,
+                        'mb_per_s': size / seconds / 1e6,
+                        'samples_per_s': samples / seconds,
+                        'peak_rss': rss,
+                    })
+                    report['results'].append(entry)
+                    rss_str = f"{rss / 1e6:.1f}" if rss is not None else "N/A"
+                    print(f"{name:<26} {fmt:<9} {num_channels:>3} {size:>10} {entry['mb_per_s']:>10.1f} "
+                          f"{entry['samples_per_s'] / 1e6:>11.1f} {rss_str:>12}")
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved {len(report['results'])} results to {args.output}")
+
+if __name__ == "__main__":
+    main()
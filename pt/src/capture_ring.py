@@ -0,0 +1,174 @@
+"""
+Reader of the shared-memory capture ring written by slogic_cli --ring.
+
+The ring is a file (put it on /dev/shm for pure shared memory): a padded
+header holding the capture parameters, the producer and consumer cursors
+and the overrun counters, followed by a data area of CHUNK_DTYPE records
+each directly followed by the block's raw data. Blocks are handed out as
+numpy views into the mapping, so a 400 MB/s stream reaches the analysis
+without being copied or going through the filesystem.
+
+    python capture_ring.py /dev/shm/slogic.ring
+"""
+import os
+import sys
+import time
+import numpy as np
+from logic_analyzer import CHUNK_DTYPE, CaptureInfo, LiveMeasurement
+
+RING_MAGIC = b'SLOGRING'
+RING_VERSION = 2
+# Record length marking that the next record starts at the beginning of the data area
+RING_WRAP = 0xFFFFFFFFFFFFFFFF
+# Seconds without a new block after which blocks() gives up by default
+RING_IDLE_TIMEOUT = 10.0
+RING_HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'), ('version', '<u4'), ('header_size', '<u4'),
+    ('num_channels', '<u4'), ('flags', '<u4'),
+    ('sample_rate', '<f8'), ('voltage', '<f8'), ('start_time', '<f8'),
+    ('capacity', '<u8'), ('write_pos', '<u8'), ('read_pos', '<u8'),
+    ('dropped_bytes', '<u8'), ('dropped_blocks', '<u8'), ('closed', '<u8'),
+    ('producer_pid', '<u8'),
+])
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class CaptureRing:
+    """
+    Consumer side of a capture ring.
+
+    The producer never overwrites data the consumer has not released, it
+    drops whole blocks instead and counts them; the consumer sees those as
+    jumps in stream_offset. There is one consumer cursor, shared through the
+    header, so only one CaptureRing should consume a ring at a time.
+
+    The CLI replaces the file for every capture. Rings left by a finished or
+    dead producer are skipped while waiting to attach, and a producer that
+    dies while attached ends the iteration like a closed ring.
+    """
+
+    def __init__(self, path, timeout=5.0, poll_interval=0.001):
+        self.poll_interval = poll_interval
+        deadline = time.monotonic() + timeout
+        # The CLI creates the file and fills in the magic last
+        while True:
+            if os.path.exists(path) and os.path.getsize(path) >= RING_HEADER_DTYPE.itemsize:
+                self._map = np.memmap(path, dtype=np.uint8, mode='r+')
+                self._header = self._map[:RING_HEADER_DTYPE.itemsize].view(RING_HEADER_DTYPE)
+                if self._header['magic'][0] == RING_MAGIC and not self._stale():
+                    break
+                del self._map, self._header
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"No capture ring at {path}")
+            time.sleep(0.01)
+        if self._field('version') != RING_VERSION:
+            raise ValueError("Unsupported ring version: %d" % self._field('version'))
+        header_size = self._field('header_size')
+        self.capacity = self._field('capacity')
+        self.data = self._map[header_size:header_size + self.capacity]
+        self.read_pos = self._field('read_pos')
+
+    def _field(self, name):
+        return self._header[name][0].item()
+
+    def _stale(self):
+        # Left over from an earlier capture, or from another ring version
+        if self._field('version') != RING_VERSION:
+            return False
+        return bool(self._field('closed')) or not self.producer_alive
+
+    @property
+    def producer_alive(self):
+        return _process_alive(self._field('producer_pid'))
+
+    @property
+    def info(self):
+        h = self._header[0]
+        return CaptureInfo(int(h['num_channels']), float(h['sample_rate']),
+                           float(h['voltage']) or None, float(h['start_time']) or None,
+                           0, 0, np.zeros(0, dtype=CHUNK_DTYPE))
+
+    @property
+    def dropped_bytes(self):
+        return self._field('dropped_bytes')
+
+    @property
+    def dropped_blocks(self):
+        return self._field('dropped_blocks')
+
+    @property
+    def backlog(self):
+        """Bytes written by the producer and not yet consumed."""
+        return self._field('write_pos') - self.read_pos
+
+    def _advance(self, size):
+        self.read_pos += size
+        self._header['read_pos'] = self.read_pos
+
+    def blocks(self, timeout=RING_IDLE_TIMEOUT):
+        """
+        Yield (stream_offset, data) per block until the producer closes the
+        ring or exits, or no block arrives within timeout seconds (None
+        waits as long as the producer runs).
+
+        data is a uint8 view into the ring; it is released to the producer
+        when the next block is requested, so copy anything kept beyond that.
+        """
+        record = CHUNK_DTYPE.itemsize
+        idle_since = time.monotonic()
+        while True:
+            closed = self._field('closed')
+            if self.read_pos == self._field('write_pos'):
+                if closed or not self.producer_alive:
+                    return
+                if timeout is not None and time.monotonic() - idle_since > timeout:
+                    return
+                time.sleep(self.poll_interval)
+                continue
+            idle_since = time.monotonic()
+            pos = self.read_pos % self.capacity
+            if self.capacity - pos < record:
+                self._advance(self.capacity - pos)
+                continue
+            chunk = self.data[pos:pos + record].view(CHUNK_DTYPE)[0]
+            length = int(chunk['length'])
+            if length == RING_WRAP:
+                self._advance(self.capacity - pos)
+                continue
+            yield int(chunk['stream_offset']), self.data[pos + record:pos + record + length]
+            self._advance((record + length + 7) & ~7)
+
+    def __iter__(self):
+        return self.blocks()
+
+def main():
+    if len(sys.argv) != 2:
+        print("Usage: python capture_ring.py <ring file, e.g. /dev/shm/slogic.ring>")
+        sys.exit(1)
+    ring = CaptureRing(sys.argv[1], timeout=30)
+    info = ring.info
+    print(f"Attached: {info.num_channels} channels, {info.sample_rate:.0f} Hz, {ring.capacity >> 20} MiB ring")
+    live = LiveMeasurement(info.num_channels, info.sample_rate)
+    received = 0
+    last_report = start = time.time()
+    for stream_offset, data in ring:
+        live.feed(data, stream_offset)
+        received += len(data)
+        if time.time() - last_report >= 1:
+            last_report = time.time()
+            print(f"{received / (last_report - start) / 1e6:.1f} MB/s, backlog {ring.backlog >> 20} MiB, "
+                  f"dropped {ring.dropped_blocks} blocks")
+            for ch, stats in enumerate(live.results()):
+                if stats:
+                    print(f"  CH{ch}: {stats.freq/1e6:.6f}MHz {stats.duty_mean*100:.2f}%")
+    print(f"Ring closed: {received} bytes received, {ring.dropped_bytes} bytes dropped")
+
+if __name__ == "__main__":
+    main()
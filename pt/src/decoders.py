@@ -0,0 +1,210 @@
+"""
+UART, SPI and I2C decoders working on a TransitionIndex.
+
+Bus events are located from the per-channel edge positions and every bit is
+sampled with one vectorized level lookup over all frames at once, so the
+cost follows the number of edges instead of the number of samples. Each
+decoder returns a numpy record array of frames; 'sample' is the index of
+the first sample of the frame and 'time' the same in seconds.
+
+    python decoders.py 8ch_400M_wave.bin uart --rx 0 --baud 115200
+"""
+import argparse
+import numpy as np
+from logic_analyzer import TransitionIndex, open_capture
+
+UART_FRAME = np.dtype([('sample', '<i8'), ('time', '<f8'), ('value', '<u2'), ('error', 'u1')])
+# UART_FRAME error bits
+UART_PARITY_ERROR = 1
+UART_FRAMING_ERROR = 2
+
+SPI_WORD = np.dtype([('sample', '<i8'), ('time', '<f8'), ('transfer', '<u4'),
+                     ('mosi', '<u4'), ('miso', '<u4')])
+
+I2C_BYTE = np.dtype([('sample', '<i8'), ('time', '<f8'), ('transaction', '<u4'),
+                     ('value', 'u1'), ('address', '?'), ('ack', '?')])
+
+def _times(index, samples):
+    if not index.sample_rate:
+        return np.full(len(samples), np.nan)
+    return samples / index.sample_rate
+
+def _levels(edges, initial, positions):
+    # TransitionIndex.level_at for an edge array sorted once by the caller
+    return (initial ^ (np.searchsorted(edges, positions, side='left') & 1)).astype(np.uint8)
+
+def _pack_bits(bits, msb_first):
+    """Combine a (words, nbits) array of 0/1 into integers."""
+    nbits = bits.shape[1]
+    shifts = np.arange(nbits - 1, -1, -1) if msb_first else np.arange(nbits)
+    return (bits.astype(np.uint64) << shifts.astype(np.uint64)).sum(axis=1)
+
+def _complete_words(group, nbits):
+    """
+    Indices of the events that form complete nbits-sized words.
+
+    group is the non-decreasing group id of every event; words never span
+    two groups, and a trailing partial word of a group is dropped.
+    """
+    if len(group) == 0:
+        return np.zeros(0, dtype=np.int64)
+    first = np.flatnonzero(np.concatenate(([True], group[1:] != group[:-1])))
+    length = np.diff(np.append(first, len(group)))
+    rank = np.arange(len(group)) - np.repeat(first, length)
+    usable = np.repeat(length - length % nbits, length)
+    return np.flatnonzero(rank < usable)
+
+def decode_uart(index, rx, baud, data_bits=8, parity=None, stop_bits=1, inverted=False):
+    """
+    Decode asynchronous serial frames (LSB first) on channel rx.
+
+    parity is None, 'even' or 'odd'. A frame starts at a falling edge of the
+    line (rising if inverted) found after the previous frame's stop bit;
+    every bit is sampled at its center.
+    """
+    if not index.sample_rate:
+        raise ValueError("UART decoding needs the capture sample rate")
+    bit = index.sample_rate / baud
+    starts = index.rising[rx] if inverted else index.falling[rx]
+    nbits = 1 + data_bits + (parity is not None) + stop_bits
+    # Next frame may start once the first stop bit has been sampled
+    resume = np.searchsorted(starts, starts + (nbits - stop_bits + 0.5) * bit, side='left')
+    chosen = []
+    i, n = 0, len(starts)
+    resume = resume.tolist()
+    while i < n:
+        chosen.append(i)
+        i = resume[i]
+    frame = starts[np.array(chosen, dtype=np.int64)] + 1
+    centers = (np.arange(nbits) + 0.5) * bit
+    positions = np.rint(frame[:, None] + centers).astype(np.int64)
+    keep = positions[:, -1] < index.num_samples
+    frame, positions = frame[keep], positions[keep]
+    bits = _levels(index.edges(rx), index.initial[rx], positions)
+    if inverted:
+        bits ^= 1
+    result = np.zeros(len(frame), dtype=UART_FRAME)
+    result['sample'] = frame
+    result['time'] = _times(index, frame)
+    result['value'] = _pack_bits(bits[:, 1:1 + data_bits], msb_first=False)
+    error = np.zeros(len(frame), dtype=np.uint8)
+    if parity is not None:
+        odd = bits[:, 1:2 + data_bits].sum(axis=1) & 1
+        error[odd != (1 if parity == 'odd' else 0)] |= UART_PARITY_ERROR
+    # A glitch instead of a start bit or a low stop bit
+    error[(bits[:, 0] == 1) | (bits[:, nbits - stop_bits:] == 0).any(axis=1)] |= UART_FRAMING_ERROR
+    result['error'] = error
+    return result.view(np.recarray)
+
+def decode_spi(index, clk, mosi=None, miso=None, cs=None, cpol=0, cpha=0, word_bits=8,
+               msb_first=True):
+    """
+    Decode SPI words clocked by channel clk.
+
+    Data lines are sampled on the clock edge selected by cpol/cpha (the
+    first sample after it). With cs (active low) words restart at every
+    select and clocks while deselected are ignored; 'transfer' counts the
+    selects. Without cs the whole capture is one transfer.
+    """
+    sample_rising = cpol == cpha
+    clock = (index.rising[clk] if sample_rising else index.falling[clk]) + 1
+    if cs is not None:
+        clock = clock[_levels(index.edges(cs), index.initial[cs], clock) == 0]
+        group = np.searchsorted(index.falling[cs] + 1, clock, side='right')
+    else:
+        group = np.zeros(len(clock), dtype=np.int64)
+    used = _complete_words(group, word_bits)
+    clock = clock[used].reshape(-1, word_bits)
+    result = np.zeros(len(clock), dtype=SPI_WORD)
+    result['sample'] = clock[:, 0]
+    result['time'] = _times(index, clock[:, 0])
+    result['transfer'] = group[used][::word_bits]
+    for name, ch in (('mosi', mosi), ('miso', miso)):
+        if ch is not None:
+            bits = _levels(index.edges(ch), index.initial[ch], clock)
+            result[name] = _pack_bits(bits, msb_first)
+    return result.view(np.recarray)
+
+def decode_i2c(index, scl, sda):
+    """
+    Decode I2C bytes.
+
+    START/STOP are SDA edges while SCL stays high; between a START (or
+    repeated START) and the next condition, SCL rising edges clock 8 data
+    bits (MSB first) plus the acknowledge bit. The first byte after each
+    START is flagged as the address byte (address << 1 | R/W).
+    """
+    sda_edges = index.edges(sda)
+    scl_edges = index.edges(scl)
+    scl_initial = index.initial[scl]
+
+    def while_scl_high(positions):
+        return positions[(_levels(scl_edges, scl_initial, positions) == 1)
+                         & (_levels(scl_edges, scl_initial, positions + 1) == 1)]
+
+    starts = while_scl_high(index.falling[sda])
+    stops = while_scl_high(index.rising[sda])
+    conditions = np.concatenate((starts, stops))
+    is_start = np.concatenate((np.ones(len(starts), bool), np.zeros(len(stops), bool)))
+    order = np.argsort(conditions, kind='stable')
+    conditions, is_start = conditions[order], is_start[order]
+    # Attribute every clock to the last condition before it
+    clock = index.rising[scl] + 1
+    owner = np.searchsorted(conditions, clock, side='left') - 1
+    clock_ok = owner >= 0
+    clock_ok[clock_ok] = is_start[owner[clock_ok]]
+    clock, owner = clock[clock_ok], owner[clock_ok]
+    used = _complete_words(owner, 9)
+    clock = clock[used].reshape(-1, 9)
+    owner = owner[used][::9]
+    bits = _levels(sda_edges, index.initial[sda], clock)
+    result = np.zeros(len(clock), dtype=I2C_BYTE)
+    result['sample'] = clock[:, 0]
+    result['time'] = _times(index, clock[:, 0])
+    # Transactions are numbered by their START condition
+    result['transaction'] = np.cumsum(is_start)[owner] - 1
+    result['value'] = _pack_bits(bits[:, :8], msb_first=True)
+    result['address'] = np.diff(owner, prepend=-1) != 0
+    result['ack'] = bits[:, 8] == 0
+    return result.view(np.recarray)
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode UART/SPI/I2C from a capture")
+    parser.add_argument('capture')
+    parser.add_argument('--limit', type=int, default=50, help="frames to print")
+    sub = parser.add_subparsers(dest='protocol', required=True)
+    uart = sub.add_parser('uart')
+    uart.add_argument('--rx', type=int, required=True)
+    uart.add_argument('--baud', type=float, required=True)
+    uart.add_argument('--data-bits', type=int, default=8)
+    uart.add_argument('--parity', choices=['even', 'odd'])
+    uart.add_argument('--stop-bits', type=int, default=1)
+    spi = sub.add_parser('spi')
+    spi.add_argument('--clk', type=int, required=True)
+    spi.add_argument('--mosi', type=int)
+    spi.add_argument('--miso', type=int)
+    spi.add_argument('--cs', type=int)
+    spi.add_argument('--mode', type=int, default=0, choices=range(4))
+    spi.add_argument('--word-bits', type=int, default=8)
+    i2c = sub.add_parser('i2c')
+    i2c.add_argument('--scl', type=int, required=True)
+    i2c.add_argument('--sda', type=int, required=True)
+    args = parser.parse_args()
+
+    raw, info = open_capture(args.capture)
+    index = TransitionIndex.build(raw, info.num_channels, info.sample_rate)
+    if args.protocol == 'uart':
+        frames = decode_uart(index, args.rx, args.baud, args.data_bits, args.parity, args.stop_bits)
+    elif args.protocol == 'spi':
+        frames = decode_spi(index, args.clk, args.mosi, args.miso, args.cs,
+                            args.mode >> 1, args.mode & 1, args.word_bits)
+    else:
+        frames = decode_i2c(index, args.scl, args.sda)
+    print(f"{len(frames)} frames")
+    for frame in frames[:args.limit]:
+        print("  " + "  ".join(f"{name}={frame[name]}" for name in frames.dtype.names))
+    if len(frames) > args.limit:
+        print("  ...")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+Background attach/detach monitor for SLogic16U3 devices.
+
+Events come from libusb hotplug callbacks when python-libusb1 (usb1) is
+installed and the platform supports them. Otherwise a thread watches the
+USB device list: on Linux by listing /sys/bus/usb/devices and reading
+idVendor/idProduct only for entries it has not seen before, elsewhere by a
+pyusb enumeration. Nothing runs on the caller's thread; callbacks are
+invoked from the monitor thread.
+
+    python device_monitor.py
+"""
+import os
+import threading
+import time
+from collections import namedtuple
+
+SLOGIC_VID = 0x359f
+SLOGIC_PID = 0x3031
+SLOGIC_OTA_PID = 0x30f1
+PRODUCT_NAMES = {SLOGIC_PID: "SLogic16U3", SLOGIC_OTA_PID: "SLogic16U3 OTA"}
+
+SYSFS_USB_DEVICES = '/sys/bus/usb/devices'
+# Fallback scan periods (seconds); a pyusb enumeration costs far more than a sysfs listing
+SYSFS_POLL_INTERVAL = 0.05
+PYUSB_POLL_INTERVAL = 0.5
+
+# location is "<bus>-<port>[.<port>...]", the sysfs name of the device
+UsbDevice = namedtuple('UsbDevice', ['location', 'vid', 'pid'])
+
+def device_location(bus, ports):
+    return f"{bus}-{'.'.join(map(str, ports))}" if ports else f"usb{bus}"
+
+class DeviceMonitor:
+    """
+    Track the connected devices with the given VID/PIDs.
+
+    callback(attached, device) is called for every change with the
+    UsbDevice concerned; devices present at start() are reported as
+    attached. devices() returns the current set at any time.
+    """
+
+    def __init__(self, callback=None, vid=SLOGIC_VID, pids=(SLOGIC_PID, SLOGIC_OTA_PID)):
+        self.callback = callback
+        self.vid = vid
+        self.pids = frozenset(pids)
+        self.backend = None
+        self._devices = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def devices(self):
+        with self._lock:
+            return sorted(self._devices.values())
+
+    def start(self):
+        if self._thread is not None:
+            return self
+        self._stop.clear()
+        loops = [('libusb hotplug', self._run_hotplug), ('sysfs', self._run_sysfs),
+                 ('pyusb', self._run_pyusb)]
+        for name, loop in loops:
+            run = loop()
+            if run is not None:
+                break
+        else:
+            raise RuntimeError("No USB backend available for device monitoring")
+        self.backend = name
+        self._thread = threading.Thread(target=run, name="DeviceMonitor", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _update(self, attached, device):
+        with self._lock:
+            if attached:
+                if self._devices.get(device.location) == device:
+                    return
+                self._devices[device.location] = device
+            elif self._devices.pop(device.location, None) is None:
+                return
+        if self.callback is not None:
+            self.callback(attached, device)
+
+    def _sync(self, present):
+        """Report the difference between a full scan result and the known devices."""
+        with self._lock:
+            known = dict(self._devices)
+        for location, device in known.items():
+            if present.get(location) != device:
+                self._update(False, device)
+        for device in present.values():
+            self._update(True, device)
+
+    # Each _run_* returns the thread body, or None when the backend is unusable
+
+    def _run_hotplug(self):
+        try:
+            import usb1
+            context = usb1.USBContext()
+        except Exception:
+            return None
+        if not context.hasCapability(usb1.CAP_HAS_HOTPLUG):
+            context.close()
+            return None
+
+        def on_event(context, dev, event):
+            device = UsbDevice(device_location(dev.getBusNumber(), dev.getPortNumberList()),
+                               dev.getVendorID(), dev.getProductID())
+            if device.pid in self.pids:
+                self._update(event == usb1.HOTPLUG_EVENT_DEVICE_ARRIVED, device)
+            # Returning True would deregister the callback
+            return False
+
+        def run():
+            try:
+                # Enumerates the already connected devices as arrivals
+                handle = context.hotplugRegisterCallback(
+                    on_event, vendor_id=self.vid, flags=usb1.HOTPLUG_ENUMERATE)
+                while not self._stop.is_set():
+                    context.handleEventsTimeout(0.05)
+                context.hotplugDeregisterCallback(handle)
+            finally:
+                context.close()
+        return run
+
+    def _run_sysfs(self):
+        if not os.path.isdir(SYSFS_USB_DEVICES):
+            return None
+        vid = f"{self.vid:04x}"
+        pids = {f"{pid:04x}": pid for pid in self.pids}
+
+        def read_id(name):
+            with open(os.path.join(SYSFS_USB_DEVICES, name, 'idVendor')) as f:
+                vendor = f.read().strip()
+            if vendor != vid:
+                return None
+            with open(os.path.join(SYSFS_USB_DEVICES, name, 'idProduct')) as f:
+                product = f.read().strip()
+            return UsbDevice(name, self.vid, pids[product]) if product in pids else None
+
+        def run():
+            # Entry name -> UsbDevice or None; a name keeps its IDs until it disappears
+            seen = {}
+            while not self._stop.is_set():
+                try:
+                    # Interfaces ("1-2:1.0") carry no idVendor
+                    names = {n for n in os.listdir(SYSFS_USB_DEVICES) if ':' not in n}
+                except OSError:
+                    names = set()
+                for name in list(seen):
+                    if name not in names:
+                        del seen[name]
+                for name in names - seen.keys():
+                    try:
+                        seen[name] = read_id(name)
+                    except OSError:
+                        # Still being set up; look again on the next pass
+                        continue
+                self._sync({d.location: d for d in seen.values() if d is not None})
+                self._stop.wait(SYSFS_POLL_INTERVAL)
+        return run
+
+    def _run_pyusb(self):
+        try:
+            import usb.core
+        except ImportError:
+            return None
+
+        def run():
+            while not self._stop.is_set():
+                present = {}
+                try:
+                    for dev in usb.core.find(find_all=True, idVendor=self.vid):
+                        if dev.idProduct in self.pids:
+                            device = UsbDevice(device_location(dev.bus, dev.port_numbers),
+                                               self.vid, dev.idProduct)
+                            present[device.location] = device
+                except Exception:
+                    # Keep the last known state if the backend fails transiently
+                    self._stop.wait(PYUSB_POLL_INTERVAL)
+                    continue
+                self._sync(present)
+                self._stop.wait(PYUSB_POLL_INTERVAL)
+        return run
+
+def main():
+    def report(attached, device):
+        name = PRODUCT_NAMES.get(device.pid, f"{device.vid:04x}:{device.pid:04x}")
+        print(f"{time.strftime('%H:%M:%S')} {'attached' if attached else 'detached'}: "
+              f"{name} at {device.location}")
+
+    monitor = DeviceMonitor(report).start()
+    print(f"Watching for SLogic16U3 devices ({monitor.backend}), Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    monitor.stop()
+
+if __name__ == "__main__":
+    main()
@@ -2,16 +2,30 @@ import sys
 import subprocess
 import os
 import re
+import json
 import threading
-import usb.core
+import queue
+import multiprocessing
 import time
+from concurrent.futures import ProcessPoolExecutor
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit,
-    QPushButton, QTextEdit, QComboBox, QMessageBox, QFileDialog, QTableWidget, QTableWidgetItem, QHeaderView
+    QPushButton, QTextEdit, QComboBox, QMessageBox, QFileDialog, QTableWidget, QTableWidgetItem, QHeaderView,
+    QCheckBox, QProgressBar
 )
-from PyQt5.QtCore import pyqtSignal, QTimer
+from PyQt5.QtCore import pyqtSignal
 from PyQt5.QtGui import QFont
-from logic_analyzer import extract_channels, detect_pwm_freq, check_pwm_duty
+from logic_analyzer import load_capture, read_capture_info, dropped_ranges, num_samples, check_pwm
+from live_test import results_from_json
+from analysis_cache import AnalysisCache
+from device_monitor import DeviceMonitor, SLOGIC_PID, SLOGIC_OTA_PID
+
+# Live mode: periods every channel needs before the verdict, and how often
+# running results are printed (seconds)
+LIVE_MIN_PERIODS = 1000
+LIVE_UPDATE_INTERVAL = 0.5
+# Live decoding runs in this script's process, not on the GUI's job thread
+LIVE_TEST_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'live_test.py')
 
 def parse_sample_rate_input(rate_str):
     m = re.match(r"^(\d+)([kKmM]?)$", rate_str.strip())
@@ -27,24 +41,83 @@ def parse_sample_rate_input(rate_str):
         rate = value
     return rate, value, unit if unit else ''
 
+class JobCancelled(Exception):
+    pass
+
+class Job:
+    """
+    A queued run of func(job, *args); cancel() may be called from any thread.
+
+    Jobs that must not be stopped half way (flashing) are only dropped
+    while still queued unless interruptible is set.
+    """
+
+    def __init__(self, name, func, *args, interruptible=True):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.interruptible = interruptible
+        self.process = None
+        self._cancelled = threading.Event()
+        # Orders cancel() against popen(): a cancel either stops the job before
+        # its process starts or sees the process and terminates it
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        with self._lock:
+            if self.process is not None and not self.interruptible:
+                return
+            self._cancelled.set()
+            process = self.process
+        if process is not None and process.poll() is None:
+            # slogic_cli stops the acquisition and finalizes its output on SIGTERM
+            process.terminate()
+
+    def check(self):
+        """Raise JobCancelled once the job has been cancelled."""
+        if self._cancelled.is_set():
+            raise JobCancelled()
+
+    def popen(self, cmd, **kwargs):
+        with self._lock:
+            self.check()
+            self.process = subprocess.Popen(cmd, **kwargs)
+            return self.process
+
 class LogicAnalyzerGUI(QWidget):
     log_signal = pyqtSignal(str)
     output_signal = pyqtSignal(str)
     output_html_signal = pyqtSignal(str)
+    progress_signal = pyqtSignal(int, int)
+    status_signal = pyqtSignal(str)
+    device_signal = pyqtSignal()
 
     def __init__(self):
         super().__init__()
         self.cli_path = os.path.abspath("../../SLogic16U3-tools/cli/build/slogic_cli")
         if not os.path.isfile(self.cli_path):
             self.cli_path = ""
+        self.analysis_cache = AnalysisCache()
+        # Test runs execute one after another on the job thread; the heavy
+        # analysis goes to worker processes so it never holds the GUI's GIL
+        self.pool = ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn'))
+        self.jobs = queue.Queue()
+        self.current_job = None
         self.init_ui()
         self.log_signal.connect(self.log_box.append)
         self.output_signal.connect(self.output_box.append)
         self.output_html_signal.connect(self.output_box.insertHtml)
-        # Add timer for real-time device detection
-        self.device_timer = QTimer(self)
-        self.device_timer.timeout.connect(self.update_device_status)
-        self.device_timer.start(1500)  # check every 1.5 seconds
+        self.progress_signal.connect(self.update_progress)
+        self.status_signal.connect(self.job_status_label.setText)
+        threading.Thread(target=self._job_loop, daemon=True).start()
+        # Attach/detach events arrive on the monitor thread; the label is
+        # refreshed through a queued signal
+        self.device_signal.connect(self.update_device_status)
+        self.device_monitor = DeviceMonitor(lambda attached, device: self.device_signal.emit())
+        try:
+            self.device_monitor.start()
+        except RuntimeError as e:
+            self.log_box.append(f"Device detection unavailable: {e}")
 
     def init_ui(self):
         self.setWindowTitle("Logic Analyzer GUI")
@@ -88,7 +161,7 @@ class LogicAnalyzerGUI(QWidget):
         channel_layout = QHBoxLayout()
         channel_label = QLabel("Channels:")
         self.channel_select = QComboBox()
-        self.channel_select.addItems(['4', '8', '16'])
+        self.channel_select.addItems(['1', '2', '4', '8', '16'])
         self.channel_select.setCurrentText('8')
         channel_layout.addWidget(channel_label)
         channel_layout.addWidget(self.channel_select)
@@ -103,10 +176,27 @@ class LogicAnalyzerGUI(QWidget):
         volt_layout.addWidget(self.volt_threshold_edit)
         left_panel.addLayout(volt_layout)
 
-        # Sampling button
+        # Sampling button, live analysis toggle
+        sampling_layout = QHBoxLayout()
         self.sampling_button = QPushButton("SAMPLING")
         self.sampling_button.clicked.connect(self.run_sampling)
-        left_panel.addWidget(self.sampling_button)
+        self.live_check = QCheckBox("Live")
+        self.live_check.setToolTip("Analyse blocks while slogic_cli is capturing and stop once the result is known")
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.setToolTip("Cancel the running test and every queued one")
+        self.cancel_button.clicked.connect(self.cancel_jobs)
+        sampling_layout.addWidget(self.sampling_button)
+        sampling_layout.addWidget(self.live_check)
+        sampling_layout.addWidget(self.cancel_button)
+        left_panel.addLayout(sampling_layout)
+
+        # Job progress
+        progress_layout = QHBoxLayout()
+        self.job_status_label = QLabel("Idle")
+        self.progress_bar = QProgressBar()
+        progress_layout.addWidget(self.job_status_label)
+        progress_layout.addWidget(self.progress_bar)
+        left_panel.addLayout(progress_layout)
 
         # Expected values table
         self.expected_table = QTableWidget()
@@ -175,6 +265,7 @@ class LogicAnalyzerGUI(QWidget):
         self.setLayout(layout)
 
         # Now all widgets exist, safe to call
+        self.device_monitor = None
         self.update_device_status()
 
     def select_cli(self):
@@ -211,68 +302,169 @@ class LogicAnalyzerGUI(QWidget):
             filename = f"{num_channels}ch_{rate_value}{unit_str}_wave.bin"
             out_dir = os.path.abspath(".")
             file_path = os.path.join(out_dir, filename)
-            if os.path.exists(file_path):
-                os.remove(file_path)
             cmd = [
                 self.cli_path,
                 "--sr", str(sample_rate/10**6),  # in MHz
                 "--ch", str(num_channels),
                 "--volt", str(volt_threshold)
             ]
-            self.log_box.append(f"Running: {' '.join(cmd)}")
-            # Run in thread to avoid blocking GUI
-            threading.Thread(target=self._run_sampling_thread, args=(cmd, file_path, filename, num_channels, sample_rate), daemon=True).start()
+            # Settings are captured now, so queued runs are not affected by later edits
+            expected = self._expected_values()
+            if self.live_check.isChecked():
+                cmd += ["--stream", "-"]
+                job = Job("Live test", self._run_live_job, cmd, expected)
+            else:
+                job = Job("Test", self._run_sampling_job, cmd, file_path, filename, num_channels, sample_rate, expected)
+            self.log_box.append(f"Queued: {' '.join(cmd)}")
+            self.jobs.put(job)
+            self._update_job_status()
         except Exception as e:
             QMessageBox.critical(self, "Error", str(e))
 
-    def _run_sampling_thread(self, cmd, file_path, filename, num_channels, sample_rate):
-        try:
-            start = time.time()
-            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
-            for line in process.stdout:
-                self.log_signal.emit(line.rstrip())
-            process.wait()
-            elapsed = time.time() - start
-            self.output_signal.emit(f"Sampling operation cost: {elapsed:.2f} s")
-            if process.returncode != 0:
-                self.log_signal.emit(f"slogic_cli failed with return code {process.returncode}")
+    def _expected_values(self):
+        return [(float(self.expected_table.item(ch, 0).text()), float(self.expected_table.item(ch, 1).text()))
+                for ch in range(self.expected_table.rowCount())]
+
+    def _update_job_status(self):
+        job = self.current_job
+        status = f"{job.name} running" if job else "Idle"
+        if self.jobs.qsize():
+            status += f", {self.jobs.qsize()} queued"
+        self.status_signal.emit(status)
+
+    def update_progress(self, done, total):
+        # total == 0 shows a busy indicator
+        self.progress_bar.setRange(0, total)
+        self.progress_bar.setValue(done)
+
+    def cancel_jobs(self):
+        while True:
+            try:
+                self.jobs.get_nowait().cancel()
+            except queue.Empty:
+                break
+        job = self.current_job
+        if job is not None:
+            job.cancel()
+        self._update_job_status()
+
+    def _job_loop(self):
+        while True:
+            job = self.jobs.get()
+            self.current_job = job
+            self._update_job_status()
+            self.progress_signal.emit(0, 0)
+            try:
+                job.check()
+                job.func(job, *job.args)
+            except JobCancelled:
+                self.output_signal.emit(f"{job.name} cancelled")
+            except Exception as e:
+                self.log_signal.emit(f"Error: {e}")
+            finally:
+                self.current_job = None
+                self.progress_signal.emit(1, 1)
+                self._update_job_status()
+
+    def _job_progress(self, job):
+        def progress(done, total):
+            job.check()
+            self.progress_signal.emit(done, total)
+        return progress
+
+    def _run_sampling_job(self, job, cmd, file_path, filename, num_channels, sample_rate, expected):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        self.log_signal.emit(f"Running: {' '.join(cmd)}")
+        start = time.time()
+        process = job.popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+        for line in process.stdout:
+            self.log_signal.emit(line.rstrip())
+        process.wait()
+        job.check()
+        elapsed = time.time() - start
+        self.output_signal.emit(f"Sampling operation cost: {elapsed:.2f} s")
+        if process.returncode != 0:
+            self.log_signal.emit(f"slogic_cli failed with return code {process.returncode}")
+            return
+        # Check output file
+        if not os.path.exists(file_path):
+            out_dir = os.path.dirname(file_path)
+            bin_files = [f for f in os.listdir(out_dir) if f.endswith("_wave.bin")]
+            if not bin_files:
+                self.log_signal.emit("No output .bin file found.")
                 return
-            # Check output file
-            if not os.path.exists(file_path):
-                out_dir = os.path.dirname(file_path)
-                bin_files = [f for f in os.listdir(out_dir) if f.endswith("_wave.bin")]
-                if not bin_files:
-                    self.log_signal.emit("No output .bin file found.")
-                    return
-                filename = max(bin_files, key=lambda f: os.path.getctime(os.path.join(out_dir, f)))
-                file_path = os.path.join(out_dir, filename)
-            self.output_signal.emit(f"Parsing file: {filename}")
-            with open(file_path, "rb") as f:
-                raw = f.read()
-            channels = extract_channels(raw, num_channels)
-            self.output_signal.emit(f"Total samples: {len(channels[0])}")
-            all_pass = True
-            for ch in range(num_channels):
-                samples = channels[ch][:1000]
-                freq = detect_pwm_freq(samples, sample_rate)
-                duty = check_pwm_duty(samples)
-                freq_str = f"{freq/1e6:.6f}MHz" if freq else "N/A"
-                duty_str = f"{duty*100:.2f}%" if duty is not None else "N/A"
-                self.output_signal.emit(f"CH{ch}: PWM freq = {freq_str}, duty cycle = {duty_str}")
-
-                expected_freq = float(self.expected_table.item(ch, 0).text())
-                expected_duty = float(self.expected_table.item(ch, 1).text())
-                freq_match = freq is not None and abs(freq - expected_freq) < expected_freq * 0.05
-                duty_match = duty is not None and abs(duty*100 - expected_duty) < 5
-                if not (freq_match and duty_match):
-                    all_pass = False
-                    self.output_signal.emit(f"  -> FAIL (Expected: {expected_freq}Hz, {expected_duty}%)")
-            if all_pass:
-                self.output_html_signal.emit('<br><span style="color:green;font-weight:bold;">PASS</span><br>')
-            else:
-                self.output_html_signal.emit('<br><span style="color:red;font-weight:bold;">FAIL</span><br>')
-        except Exception as e:
-            self.log_signal.emit(f"Error: {e}")
+            filename = max(bin_files, key=lambda f: os.path.getctime(os.path.join(out_dir, f)))
+            file_path = os.path.join(out_dir, filename)
+        self.output_signal.emit(f"Parsing file: {filename}")
+        info = read_capture_info(file_path)
+        if info is not None:
+            # Container header is authoritative over the requested settings
+            num_channels, sample_rate = info.num_channels, info.sample_rate
+            dropped = dropped_ranges(info)
+            if dropped:
+                self.output_signal.emit(f"Capture has {len(dropped)} gaps ({sum(b - a for a, b in dropped)} bytes dropped)")
+        raw = load_capture(file_path)
+        self.output_signal.emit(f"Total samples: {num_samples(len(raw), num_channels)}")
+        results = self.analysis_cache.measure(file_path, num_channels, sample_rate,
+                                              executor=self.pool, progress=self._job_progress(job))
+        self._report_results(results, expected)
+
+    def _forward_log(self, pipe):
+        for line in pipe:
+            self.log_signal.emit(line.decode(errors='replace').rstrip())
+
+    def _run_live_job(self, job, cmd, expected):
+        self.log_signal.emit(f"Running: {' '.join(cmd)}")
+        start = time.time()
+        # live_test.py runs slogic_cli and reports JSON lines; cancelling the job
+        # terminates it, and it stops slogic_cli in turn
+        worker = [sys.executable, LIVE_TEST_SCRIPT, '--min-periods', str(LIVE_MIN_PERIODS),
+                  '--interval', str(LIVE_UPDATE_INTERVAL), '--'] + cmd
+        process = job.popen(worker, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        threading.Thread(target=self._forward_log, args=(process.stderr,), daemon=True).start()
+        final = None
+        for line in process.stdout:
+            message = json.loads(line)
+            if message.get('done'):
+                final = message
+                break
+            self.progress_signal.emit(min(message['periods'], LIVE_MIN_PERIODS), LIVE_MIN_PERIODS)
+            self.output_signal.emit("Live: " + ", ".join(
+                f"CH{ch} {stats.freq/1e6:.6f}MHz {stats.duty_mean*100:.2f}%" if stats else f"CH{ch} N/A"
+                for ch, stats in enumerate(results_from_json(message['results']))))
+        process.stdout.close()
+        process.wait()
+        job.check()
+        if final is None:
+            self.log_signal.emit(f"Live test failed with return code {process.returncode}")
+            return
+        elapsed = time.time() - start
+        self.output_signal.emit(f"Live analysis cost: {elapsed:.2f} s, {final['samples']} samples analysed, "
+                                f"{final['dropped']} bytes skipped")
+        self._report_results(results_from_json(final['results']), expected)
+
+    def _report_results(self, results, expected):
+        all_pass = True
+        for ch in range(len(results)):
+            stats = results[ch]
+            freq = stats.freq if stats else None
+            duty = stats.duty_mean if stats else None
+            freq_str = f"{freq/1e6:.6f}MHz" if freq else "N/A"
+            duty_str = f"{duty*100:.2f}%" if duty is not None else "N/A"
+            self.output_signal.emit(f"CH{ch}: PWM freq = {freq_str}, duty cycle = {duty_str}")
+            if stats:
+                self.output_signal.emit(f"  duty {stats.duty_min*100:.2f}..{stats.duty_max*100:.2f}% (std {stats.duty_std*100:.3f}%), "
+                                        f"period std {stats.period_std:.3f} samples")
+
+            expected_freq, expected_duty = expected[ch]
+            if not check_pwm(stats, expected_freq, expected_duty):
+                all_pass = False
+                self.output_signal.emit(f"  -> FAIL (Expected: {expected_freq}Hz, {expected_duty}%)")
+        if all_pass:
+            self.output_html_signal.emit('<br><span style="color:green;font-weight:bold;">PASS</span><br>')
+        else:
+            self.output_html_signal.emit('<br><span style="color:red;font-weight:bold;">FAIL</span><br>')
 
     def select_ota_file(self):
         path, _ = QFileDialog.getOpenFileName(self, "Select firmware.bin", "", "BIN Files (*.bin)")
@@ -286,22 +478,21 @@ class LogicAnalyzerGUI(QWidget):
             return
         ota_script = os.path.abspath("../ota/src/spi_flash.py")
         cmd = ["python3", ota_script, firmware]
-        self.log_box.append(f"Running OTA: {' '.join(cmd)}")
-        threading.Thread(target=self._run_ota_thread, args=(cmd,), daemon=True).start()
-
-    def _run_ota_thread(self, cmd):
-        try:
-            start = time.time()
-            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
-            for line in process.stdout:
-                self.log_signal.emit(line.rstrip())
-            process.wait()
-            elapsed = time.time() - start
-            self.output_signal.emit(f"OTA operation cost: {elapsed:.2f} s")
-            if process.returncode != 0:
-                self.log_signal.emit(f"OTA failed with code {process.returncode}")
-        except Exception as e:
-            self.log_signal.emit(f"OTA error: {e}")
+        self.log_box.append(f"Queued OTA: {' '.join(cmd)}")
+        self.jobs.put(Job("OTA", self._run_ota_job, cmd, interruptible=False))
+        self._update_job_status()
+
+    def _run_ota_job(self, job, cmd):
+        self.log_signal.emit(f"Running OTA: {' '.join(cmd)}")
+        start = time.time()
+        process = job.popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+        for line in process.stdout:
+            self.log_signal.emit(line.rstrip())
+        process.wait()
+        elapsed = time.time() - start
+        self.output_signal.emit(f"OTA operation cost: {elapsed:.2f} s")
+        if process.returncode != 0:
+            self.log_signal.emit(f"OTA failed with code {process.returncode}")
 
     def log_box_clear(self):
         self.log_box.clear()
@@ -310,16 +501,14 @@ class LogicAnalyzerGUI(QWidget):
         self.output_box.clear()
 
     def update_device_status(self):
-        # Scan for SLogic devices by VID/PID
+        # Current SLogic devices as tracked by the device monitor
         found = None
-        try:
-            if usb.core.find(idVendor=0x359f, idProduct=0x3031):
-                found = "SLogic16U3"
-            elif usb.core.find(idVendor=0x359f, idProduct=0x30f1):
-                found = "SLogic16U3 OTA"
-        except Exception:
-            pass
-            
+        pids = {device.pid for device in self.device_monitor.devices()} if self.device_monitor else set()
+        if SLOGIC_PID in pids:
+            found = "SLogic16U3"
+        elif SLOGIC_OTA_PID in pids:
+            found = "SLogic16U3 OTA"
+
         if found == "SLogic16U3":
             self.device_status_label.setText("Found A device: SLogic16U3")
             self.device_status_label.setStyleSheet("color: green;")
@@ -349,22 +538,27 @@ class LogicAnalyzerGUI(QWidget):
             cmd = ["bash", "/home/sipeed007/gowin/scripts/usb_rst.sh"]
         else:
             return
-        self.log_box.append(f"Running: {' '.join(cmd)}")
-        threading.Thread(target=self._run_flash_cmd_thread, args=(cmd,), daemon=True).start()
-
-    def _run_flash_cmd_thread(self, cmd):
-        try:
-            start = time.time()
-            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
-            for line in process.stdout:
-                self.log_signal.emit(line.rstrip())
-            process.wait()
-            elapsed = time.time() - start
-            self.output_signal.emit(f"Flash operation ({' '.join(cmd)}) cost: {elapsed:.2f} s")
-            if process.returncode != 0:
-                self.log_signal.emit(f"Command failed with code {process.returncode}")
-        except Exception as e:
-            self.log_signal.emit(f"Command error: {e}")
+        self.log_box.append(f"Queued: {' '.join(cmd)}")
+        self.jobs.put(Job(action.capitalize(), self._run_flash_cmd_job, cmd, interruptible=False))
+        self._update_job_status()
+
+    def _run_flash_cmd_job(self, job, cmd):
+        self.log_signal.emit(f"Running: {' '.join(cmd)}")
+        start = time.time()
+        process = job.popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+        for line in process.stdout:
+            self.log_signal.emit(line.rstrip())
+        process.wait()
+        elapsed = time.time() - start
+        self.output_signal.emit(f"Flash operation ({' '.join(cmd)}) cost: {elapsed:.2f} s")
+        if process.returncode != 0:
+            self.log_signal.emit(f"Command failed with code {process.returncode}")
+
+    def closeEvent(self, event):
+        self.cancel_jobs()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.device_monitor.stop()
+        super().closeEvent(event)
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
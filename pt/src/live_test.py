@@ -0,0 +1,83 @@
+"""
+Live PWM measurement of a slogic_cli --stream capture.
+
+run_live() starts slogic_cli, decodes its stream with LiveMeasurement and
+stops the capture once every checked channel has min_periods periods. Run
+as a script it does the same in its own process and reports on stdout as
+JSON lines, so the GUI can run a live test without decoding competing with
+its event loop for the GIL:
+
+    python live_test.py --min-periods 1000 -- slogic_cli --sr 400 --ch 8 --stream -
+
+Every --interval seconds a line {"periods": n, "results": [...]} is written,
+then a final one with "done": true, "samples" and "dropped". results holds
+one PwmStats dict (or null) per channel.
+"""
+import argparse
+import json
+import signal
+import subprocess
+import sys
+import time
+from logic_analyzer import CaptureStream, LiveMeasurement, PwmStats
+
+def run_live(cmd, min_periods, channels=None, update=None, update_interval=0.5, **popen_kwargs):
+    """
+    Run cmd (a slogic_cli --stream - command line) until every channel in
+    channels (default: all) has min_periods periods or the stream ends.
+
+    update(live) is called at most every update_interval seconds. Returns
+    (results, samples, dropped bytes); popen_kwargs go to subprocess.Popen.
+    """
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, **popen_kwargs)
+    try:
+        stream = CaptureStream(process.stdout)
+        live = LiveMeasurement(stream.info.num_channels, stream.info.sample_rate)
+        if channels is not None:
+            channels = [ch for ch in channels if ch < stream.info.num_channels]
+        last_update = time.monotonic()
+        for stream_offset, data in stream:
+            live.feed(data, stream_offset)
+            if channels == [] or live.periods(channels) >= min_periods:
+                break
+            if update is not None and time.monotonic() - last_update >= update_interval:
+                last_update = time.monotonic()
+                update(live)
+    finally:
+        # Enough periods (or an error): stop the capture instead of waiting for its timeout
+        process.terminate()
+        process.stdout.close()
+        process.wait()
+    return live.results(), live.samples, stream.dropped
+
+def results_to_json(results):
+    return [stats._asdict() if stats else None for stats in results]
+
+def results_from_json(results):
+    return [PwmStats(**stats) if stats else None for stats in results]
+
+def main():
+    parser = argparse.ArgumentParser(description="Live PWM measurement of a slogic_cli stream")
+    parser.add_argument('--min-periods', type=int, default=1000)
+    parser.add_argument('--channels', help="comma-separated channels that must reach --min-periods (default: all)")
+    parser.add_argument('--interval', type=float, default=0.5, help="seconds between running results")
+    parser.add_argument('cmd', nargs=argparse.REMAINDER, help="slogic_cli command line, after --")
+    args = parser.parse_args()
+    cmd = args.cmd[1:] if args.cmd[:1] == ['--'] else args.cmd
+    if not cmd:
+        parser.error("missing slogic_cli command")
+    channels = [int(ch) for ch in args.channels.split(',')] if args.channels else None
+    # Cancelled by the caller: still stop slogic_cli on the way out
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+
+    def emit(message):
+        print(json.dumps(message), flush=True)
+
+    def update(live):
+        emit({'periods': live.periods(channels), 'results': results_to_json(live.results())})
+
+    results, samples, dropped = run_live(cmd, args.min_periods, channels, update, args.interval)
+    emit({'done': True, 'results': results_to_json(results), 'samples': samples, 'dropped': dropped})
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,34 @@
+import os
 import re
+import struct
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
 
+# Raw bytes of a 16-channel block decoded per step by the streaming decoder;
+# narrower captures decode the same number of samples per step (see block_bytes)
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# Capture container (little-endian):
+#   0x0000  header (CAPTURE_HEADER), zero padded to CAPTURE_HEADER_SIZE
+#   0x1000  raw payload, same packing as the legacy *_wave.bin files
+#   ...     chunk index: CHUNK_DTYPE records, one per appended block
+# payload_size == 0 marks a capture that was never finalized; its payload
+# then runs to the end of the file and it has no chunk index. Gaps between
+# stream_offset + length of a chunk and the next stream_offset are data the
+# writer dropped.
+CAPTURE_MAGIC = b'SLOGICAP'
+CAPTURE_VERSION = 1
+CAPTURE_HEADER_SIZE = 4096
+CAPTURE_HEADER = struct.Struct('<8sIIIIdddQQQ')
+CHUNK_DTYPE = np.dtype([('payload_offset', '<u8'), ('stream_offset', '<u8'), ('length', '<u8')])
+
+CaptureInfo = namedtuple('CaptureInfo', [
+    'num_channels', 'sample_rate', 'voltage', 'start_time',
+    'payload_offset', 'payload_size', 'chunks',
+])
+
 def parse_filename(filename):
     m = re.match(r"(\d+)ch_(\d+)([kKmM])_wave\.bin", filename)
     if not m:
@@ -14,48 +42,853 @@ def parse_filename(filename):
         rate *= 1_000
     return ch, rate
 
-def extract_channels(data, num_channels):
+def sample_width(num_channels):
+    """Return the byte granularity of one packed sample group."""
     if num_channels == 16:
-        data = np.frombuffer(data, dtype=np.uint16)
-        channels = [(data >> i) & 1 for i in range(16)]
+        return 2
+    elif num_channels in (8, 4, 2, 1):
+        return 1
+    raise ValueError("Unsupported channel count: %d" % num_channels)
+
+def num_samples(nbytes, num_channels):
+    """Number of samples held in nbytes of raw data."""
+    return nbytes * 8 // num_channels
+
+def block_bytes(chunk_size, num_channels):
+    """
+    Raw bytes per decode step: the samples of chunk_size bytes of a
+    16-channel capture, so the decoded working set does not grow as the
+    packing gets denser.
+    """
+    width = sample_width(num_channels)
+    return max(width, chunk_size * num_channels // 16 // width * width)
+
+def _parse_header(head):
+    if len(head) < CAPTURE_HEADER.size or not head.startswith(CAPTURE_MAGIC):
+        return None
+    fields = CAPTURE_HEADER.unpack_from(head)
+    if fields[1] != CAPTURE_VERSION:
+        raise ValueError("Unsupported capture version: %d" % fields[1])
+    return fields
+
+def read_capture_info(path):
+    """Parse the header of a capture container; None for a legacy raw file."""
+    with open(path, 'rb') as f:
+        fields = _parse_header(f.read(CAPTURE_HEADER.size))
+        if fields is None:
+            return None
+        (_, _, header_size, num_channels, _, sample_rate, voltage, start_time,
+         payload_size, index_offset, index_count) = fields
+        if payload_size == 0:
+            payload_size = os.fstat(f.fileno()).st_size - header_size
+        chunks = np.zeros(0, dtype=CHUNK_DTYPE)
+        if index_count:
+            f.seek(index_offset)
+            chunks = np.frombuffer(f.read(index_count * CHUNK_DTYPE.itemsize), dtype=CHUNK_DTYPE)
+    return CaptureInfo(num_channels, sample_rate, voltage or None, start_time or None,
+                       header_size, payload_size, chunks)
+
+def _map_payload(path, offset, size):
+    if size <= 0:
+        return np.empty(0, dtype=np.uint8)
+    return np.memmap(path, dtype=np.uint8, mode='r', offset=offset, shape=(size,))
+
+def payload_range(path):
+    """(offset, size) of the raw payload of a container or legacy file."""
+    info = read_capture_info(path)
+    if info is None:
+        return 0, os.path.getsize(path)
+    return info.payload_offset, info.payload_size
+
+def load_capture(path):
+    """
+    Map the raw payload of a capture file read-only without copying it.
+
+    The returned uint8 array is backed by the page cache, so opening is
+    cheap and only the regions that are sliced and decoded get read in.
+    """
+    return _map_payload(path, *payload_range(path))
+
+def open_capture(path):
+    """
+    Map a capture and describe it; returns (raw, CaptureInfo).
+
+    Containers are described by their header, legacy *_wave.bin files by
+    their name (see parse_filename).
+    """
+    info = read_capture_info(path)
+    if info is None:
+        num_channels, sample_rate = parse_filename(os.path.basename(path))
+        info = CaptureInfo(num_channels, sample_rate, None, None, 0,
+                           os.path.getsize(path), np.zeros(0, dtype=CHUNK_DTYPE))
+    return _map_payload(path, info.payload_offset, info.payload_size), info
+
+def dropped_ranges(info):
+    """Stream byte ranges (start, stop) lost between consecutive chunks."""
+    chunks = info.chunks
+    ends = chunks['stream_offset'][:-1] + chunks['length'][:-1]
+    gaps = np.flatnonzero(chunks['stream_offset'][1:] > ends)
+    return [(int(ends[i]), int(chunks['stream_offset'][i + 1])) for i in gaps]
+
+def gap_samples(info):
+    """
+    Sample positions that follow a dropped range, sorted. Samples p - 1 and p
+    were not adjacent in the device stream, so no edge or period may join
+    them. Empty for legacy files (info None).
+    """
+    if info is None:
+        return np.zeros(0, dtype=np.int64)
+    chunks = info.chunks
+    ends = chunks['stream_offset'][:-1] + chunks['length'][:-1]
+    gaps = np.flatnonzero(chunks['stream_offset'][1:] > ends)
+    return np.array([num_samples(int(chunks['payload_offset'][i + 1]), info.num_channels) for i in gaps],
+                    dtype=np.int64)
+
+def _split_at_gaps(blocks, gaps):
+    # Yield (start, block, restart) with blocks cut at the gap positions;
+    # restart is set on pieces that begin right after a gap
+    pos = 0
+    for block in blocks:
+        stop = pos + len(block)
+        cuts = gaps[(gaps >= pos) & (gaps < stop)]
+        bounds = np.concatenate(([pos], cuts, [stop]))
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            if end > start:
+                yield int(start), block[start - pos:end - pos], bool(np.any(cuts == start))
+        pos = stop
+
+class CaptureWriter:
+    """Write a capture container; blocks are appended as they arrive."""
+
+    def __init__(self, path, num_channels, sample_rate, voltage=None, start_time=None):
+        sample_width(num_channels)
+        self.f = open(path, 'wb')
+        self.num_channels = num_channels
+        self.sample_rate = sample_rate
+        self.voltage = voltage
+        self.start_time = time.time() if start_time is None else start_time
+        self.chunks = []
+        self.payload_size = 0
+        self.stream_end = 0
+        self._write_header(0, 0, 0)
+
+    def _write_header(self, payload_size, index_offset, index_count):
+        head = CAPTURE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, CAPTURE_HEADER_SIZE,
+                                   self.num_channels, 0, self.sample_rate,
+                                   self.voltage or 0.0, self.start_time,
+                                   payload_size, index_offset, index_count)
+        self.f.seek(0)
+        self.f.write(head.ljust(CAPTURE_HEADER_SIZE, b'\0'))
+
+    def append(self, data, stream_offset=None):
+        """Append a block; stream_offset places it in the device stream."""
+        if stream_offset is None:
+            stream_offset = self.stream_end
+        length = len(memoryview(data).cast('B'))
+        self.chunks.append((self.payload_size, stream_offset, length))
+        self.f.seek(CAPTURE_HEADER_SIZE + self.payload_size)
+        self.f.write(data)
+        self.payload_size += length
+        self.stream_end = stream_offset + length
+
+    def close(self):
+        if self.f.closed:
+            return
+        index_offset = CAPTURE_HEADER_SIZE + self.payload_size
+        self.f.seek(index_offset)
+        self.f.write(np.array(self.chunks, dtype=CHUNK_DTYPE).tobytes())
+        self._write_header(self.payload_size, index_offset, len(self.chunks))
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+class CaptureStream:
+    """
+    Reader of the live block stream of slogic_cli --stream.
+
+    The stream is a capture container without payload size or index: the
+    padded header, then per block a CHUNK_DTYPE record and the block's raw
+    data. Blocks the CLI dropped because the reader fell behind show up as
+    jumps in stream_offset. Iterating yields (stream_offset, data).
+    """
+
+    def __init__(self, f):
+        self.f = f
+        fields = _parse_header(self._read(CAPTURE_HEADER_SIZE))
+        if fields is None:
+            raise ValueError("Not a capture stream")
+        (_, _, _, num_channels, _, sample_rate, voltage, start_time, _, _, _) = fields
+        self.info = CaptureInfo(num_channels, sample_rate, voltage or None, start_time or None,
+                                0, 0, np.zeros(0, dtype=CHUNK_DTYPE))
+        self.dropped = 0
+        self._stream_end = 0
+
+    def _read(self, size):
+        # Pipes may return short reads; only EOF ends a record early
+        parts = []
+        while size:
+            part = self.f.read(size)
+            if not part:
+                break
+            parts.append(part)
+            size -= len(part)
+        return b''.join(parts)
+
+    def __iter__(self):
+        while True:
+            record = self._read(CHUNK_DTYPE.itemsize)
+            if len(record) < CHUNK_DTYPE.itemsize:
+                return
+            chunk = np.frombuffer(record, dtype=CHUNK_DTYPE)[0]
+            data = self._read(int(chunk['length']))
+            if len(data) < chunk['length']:
+                return
+            stream_offset = int(chunk['stream_offset'])
+            self.dropped += stream_offset - self._stream_end
+            self._stream_end = stream_offset + len(data)
+            yield stream_offset, data
+
+def extract_region(raw, num_channels, start, count):
+    """Decode only samples [start, start + count) of a raw capture."""
+    first = start * num_channels // 8
+    stop = -(-(start + count) * num_channels // 8)
+    channels = extract_channels(raw[first:stop], num_channels)
+    skip = start - num_samples(first, num_channels)
+    return [c[skip:skip + count] for c in channels]
+
+# Sub-byte modes: byte value -> the samples it holds, first sample in the
+# low bits (4ch: two nibbles, 2ch: four 2-bit groups)
+_UNPACK_LUT = {
+    n: np.array([[(b >> (n * k)) & ((1 << n) - 1) for k in range(8 // n)]
+                 for b in range(256)], dtype=np.uint8)
+    for n in (4, 2)
+}
+
+def decode_words(data, num_channels):
+    """Return one integer word per sample, bit i holding channel i."""
+    if num_channels == 16:
+        return np.frombuffer(data, dtype=np.uint16)
     elif num_channels == 8:
-        data = np.frombuffer(data, dtype=np.uint8)
-        channels = [(data >> i) & 1 for i in range(8)]
-    elif num_channels == 4:
-        data = np.frombuffer(data, dtype=np.uint8)
-        n = len(data) * 2
-        unpacked = np.empty(n, dtype=np.uint8)
-        unpacked[0::2] = data & 0x0F
-        unpacked[1::2] = (data >> 4) & 0x0F
-        channels = [(unpacked >> i) & 1 for i in range(4)]
+        return np.frombuffer(data, dtype=np.uint8)
+    elif num_channels in _UNPACK_LUT:
+        return _UNPACK_LUT[num_channels][np.frombuffer(data, dtype=np.uint8)].ravel()
+    elif num_channels == 1:
+        return np.unpackbits(np.frombuffer(data, dtype=np.uint8), bitorder='little')
+    raise ValueError("Unsupported channel count: %d" % num_channels)
+
+def extract_channels(data, num_channels):
+    words = decode_words(data, num_channels)
+    return [(words >> i) & 1 for i in range(num_channels)]
+
+def _iter_chunks(source, chunk_size):
+    if hasattr(source, 'read'):
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
     else:
-        raise ValueError("Unsupported channel count: %d" % num_channels)
-    return channels
+        view = memoryview(source).cast('B')
+        for pos in range(0, len(view), chunk_size):
+            yield view[pos:pos + chunk_size]
 
-def detect_pwm_freq(samples, sample_rate):
-    edges = np.where((samples[:-1] == 0) & (samples[1:] == 1))[0]
-    if len(edges) < 2:
+def iter_words(source, num_channels, chunk_size=CHUNK_SIZE):
+    """
+    Decode a capture block by block into sample words (see decode_words).
+
+    source is a bytes-like object or a binary file object. Each step covers
+    at most block_bytes(chunk_size, num_channels) bytes of raw data, the same
+    number of samples for every channel count, so the peak memory depends
+    neither on the capture length nor on its width. Partial samples left over
+    by short reads are carried into the next block.
+    """
+    width = sample_width(num_channels)
+    pending = b''
+    for chunk in _iter_chunks(source, block_bytes(chunk_size, num_channels)):
+        if pending:
+            chunk = pending + bytes(chunk)
+        usable = len(chunk) - len(chunk) % width
+        pending = bytes(chunk[usable:])
+        if usable:
+            yield decode_words(chunk[:usable], num_channels)
+
+def iter_channel_blocks(source, num_channels, chunk_size=CHUNK_SIZE):
+    """Like iter_words, but yield the per-channel sample arrays of each block."""
+    for words in iter_words(source, num_channels, chunk_size):
+        yield [(words >> i) & 1 for i in range(num_channels)]
+
+def iter_channel(source, num_channels, ch, chunk_size=CHUNK_SIZE):
+    """Yield the sample blocks of a single channel."""
+    for channels in iter_channel_blocks(source, num_channels, chunk_size):
+        yield channels[ch]
+
+def _as_blocks(samples):
+    if isinstance(samples, np.ndarray):
+        return (samples,)
+    return samples
+
+class RisingEdgeScanner:
+    """
+    Push-style rising edge scanner for a stream of sample blocks.
+
+    feed() returns (edges, highs) for a block: edges holds the absolute index
+    of the last low sample before each 0->1 transition, highs the number of
+    high samples preceding that index. The last sample of each block is
+    carried over so edges straddling a block boundary are not lost.
+    """
+
+    def __init__(self):
+        self.offset = 0
+        self.high_total = 0
+        self.prev = None
+
+    def feed(self, block):
+        n = len(block)
+        if n == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        found = np.flatnonzero((block[:-1] == 0) & (block[1:] == 1))
+        # High samples between consecutive edges, without an n-sized cumsum
+        bounds = np.concatenate(([0], found))
+        segments = np.add.reduceat(block, bounds, dtype=np.int64)
+        segments[:-1][found == bounds[:-1]] = 0
+        counts = self.high_total + np.cumsum(segments)
+        highs = counts[:-1]
+        edges = self.offset + found
+        if self.prev == 0 and block[0] == 1:
+            edges = np.concatenate(([self.offset - 1], edges))
+            highs = np.concatenate(([self.high_total], highs))
+        self.offset += n
+        self.high_total = int(counts[-1])
+        self.prev = block[-1]
+        return edges, highs
+
+def iter_rising_edges(blocks):
+    """Yield (edges, highs) per block, see RisingEdgeScanner."""
+    scanner = RisingEdgeScanner()
+    for block in _as_blocks(blocks):
+        if len(block):
+            yield scanner.feed(block)
+
+PwmStats = namedtuple('PwmStats', [
+    'periods', 'freq',
+    'period_mean', 'period_min', 'period_max', 'period_std',
+    'duty_mean', 'duty_min', 'duty_max', 'duty_std',
+])
+PwmStats.__doc__ = """PWM statistics over all complete periods; periods are in samples."""
+
+class RunningStats:
+    """
+    Count, mean, standard deviation and extrema of a stream of values.
+
+    Values are merged (Chan et al.) in fixed groups of GROUP values, whatever
+    the sizes passed to add(), so the result depends only on the sequence of
+    values: streaming them block by block gives bit-identical statistics to
+    adding them all at once. At most one partial group is held in memory.
+    """
+    GROUP = 4096
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self._pending = np.zeros(0, dtype=np.float64)
+
+    @staticmethod
+    def _merge(state, group):
+        count, mean, m2 = state
+        n = len(group)
+        group_mean = float(np.mean(group))
+        d = group - group_mean
+        delta = group_mean - mean
+        total = count + n
+        return total, mean + delta * n / total, m2 + float(np.dot(d, d)) + delta * delta * count * n / total
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        if len(self._pending):
+            values = np.concatenate((self._pending, values))
+        full = len(values) - len(values) % self.GROUP
+        state = (self.count, self.mean, self.m2)
+        for pos in range(0, full, self.GROUP):
+            state = self._merge(state, values[pos:pos + self.GROUP])
+        self.count, self.mean, self.m2 = state
+        self._pending = values[full:].copy()
+
+    def __len__(self):
+        return self.count + len(self._pending)
+
+    def result(self):
+        """(mean, min, max, std), or None if no value was added."""
+        state = (self.count, self.mean, self.m2)
+        if len(self._pending):
+            state = self._merge(state, self._pending)
+        count, mean, m2 = state
+        if count == 0:
+            return None
+        return mean, self.min, self.max, float(np.sqrt(m2 / count))
+
+def _pwm_stats(sample_rate, period, duty):
+    # Shared by PwmAccumulator and TransitionIndex so both give identical results
+    if len(period) == 0:
         return None
-    periods = np.diff(edges)
-    avg_period = np.mean(periods)
-    if avg_period == 0:
+    period_stats = period.result()
+    freq = sample_rate / period_stats[0] if sample_rate else None
+    return PwmStats(len(period), freq, *period_stats, *duty.result())
+
+class PwmAccumulator:
+    """
+    Running per-period PWM statistics, fed one block at a time.
+
+    A period spans two consecutive rising edges. Only RunningStats are kept,
+    so memory does not grow with the capture length.
+    """
+
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+        self.scanner = RisingEdgeScanner()
+        self.last_edge = self.last_high = None
+        self.period = RunningStats()
+        self.duty = RunningStats()
+
+    @property
+    def count(self):
+        return len(self.period)
+
+    def restart(self, offset):
+        """Forget the signal history (e.g. after dropped data) but keep the statistics."""
+        self.scanner = RisingEdgeScanner()
+        self.scanner.offset = offset
+        self.last_edge = self.last_high = None
+
+    def feed(self, block):
+        edges, highs = self.scanner.feed(block)
+        if len(edges) == 0:
+            return
+        if self.last_edge is not None:
+            edges = np.concatenate(([self.last_edge], edges))
+            highs = np.concatenate(([self.last_high], highs))
+        if len(edges) > 1:
+            periods = np.diff(edges).astype(np.float64)
+            self.period.add(periods)
+            self.duty.add(np.diff(highs) / periods)
+        self.last_edge, self.last_high = edges[-1], highs[-1]
+
+    def result(self):
+        """Return PwmStats, or None if fewer than two rising edges were seen."""
+        return _pwm_stats(self.sample_rate, self.period, self.duty)
+
+def measure_pwm(samples, sample_rate):
+    """PWM statistics of one channel given as an array or iterable of blocks."""
+    acc = PwmAccumulator(sample_rate)
+    for block in _as_blocks(samples):
+        acc.feed(block)
+    return acc.result()
+
+def measure_channels(source, num_channels, sample_rate, chunk_size=CHUNK_SIZE, gaps=None):
+    """
+    PWM statistics of every channel of a raw capture in a single pass.
+
+    gaps (see gap_samples) restart the edge and period state of every channel,
+    like the stream jumps seen by LiveMeasurement.
+    """
+    accs = [PwmAccumulator(sample_rate) for _ in range(num_channels)]
+    gaps = np.zeros(0, dtype=np.int64) if gaps is None else np.asarray(gaps, dtype=np.int64)
+    for start, words, restart in _split_at_gaps(iter_words(source, num_channels, chunk_size), gaps):
+        for ch, acc in enumerate(accs):
+            if restart:
+                acc.restart(start)
+            acc.feed((words >> ch) & 1)
+    return [acc.result() for acc in accs]
+
+class LiveMeasurement:
+    """
+    PWM statistics of every channel, updated block by block as a capture
+    streams in (see CaptureStream).
+
+    Blocks may skip ahead in the stream; periods never span such a gap.
+    """
+
+    def __init__(self, num_channels, sample_rate):
+        self.num_channels = num_channels
+        self.accs = [PwmAccumulator(sample_rate) for _ in range(num_channels)]
+        self.samples = 0
+        self._stream_end = None
+
+    def feed(self, data, stream_offset=None):
+        width = sample_width(self.num_channels)
+        if stream_offset is not None and stream_offset != self._stream_end:
+            for acc in self.accs:
+                acc.restart(self.samples)
+        self._stream_end = None if stream_offset is None else stream_offset + len(data)
+        words = decode_words(data[:len(data) - len(data) % width], self.num_channels)
+        for ch, acc in enumerate(self.accs):
+            acc.feed((words >> ch) & 1)
+        self.samples += len(words)
+
+    def periods(self, channels=None):
+        """Complete periods measured so far on the least active of channels (default: all)."""
+        accs = self.accs if channels is None else [self.accs[ch] for ch in channels]
+        return min((acc.count for acc in accs), default=0)
+
+    def results(self):
+        return [acc.result() for acc in self.accs]
+
+# Production pass window: relative for the frequency, percentage points for the duty
+FREQ_TOLERANCE = 0.05
+DUTY_TOLERANCE = 5.0
+
+def check_pwm(stats, expected_freq, expected_duty, freq_tolerance=FREQ_TOLERANCE,
+              duty_tolerance=DUTY_TOLERANCE):
+    """Whether PwmStats (or None) match the expected frequency (Hz) and duty (%)."""
+    if stats is None or stats.freq is None:
+        return False
+    return (abs(stats.freq - expected_freq) < expected_freq * freq_tolerance
+            and abs(stats.duty_mean * 100 - expected_duty) < duty_tolerance)
+
+def detect_pwm_freq(samples, sample_rate):
+    stats = measure_pwm(samples, sample_rate)
+    if stats is None:
         return None
-    freq = sample_rate / avg_period
-    return freq
+    return stats.freq
 
 def check_pwm_duty(samples):
-    edges = np.where((samples[:-1] == 0) & (samples[1:] == 1))[0]
-    if len(edges) < 2:
+    stats = measure_pwm(samples, None)
+    if stats is None:
         return None
-    duty_cycles = []
-    for i in range(len(edges) - 1):
-        period = samples[edges[i]:edges[i+1]]
-        if len(period) == 0:
-            continue
-        high = np.count_nonzero(period)
-        duty = high / len(period)
-        duty_cycles.append(duty)
-    if not duty_cycles:
-        return None
-    avg_duty = np.mean(duty_cycles)
-    return avg_duty
\ No newline at end of file
+    return stats.duty_mean
+
+class TransitionIndex:
+    """
+    Sorted rising and falling edge positions of every channel.
+
+    Built in one pass over the raw sample words: only words that differ from
+    their predecessor are looked at, so the per-channel work is proportional
+    to the number of transitions. Edge positions follow the convention of
+    iter_rising_edges (index of the last sample before the transition), and
+    all queries below run in O(edges) without touching the samples again.
+
+    gaps (see gap_samples) mark where data was dropped. The edges keep
+    describing the stored samples, but pwm_stats ignores edges and periods
+    that span a gap.
+    """
+
+    def __init__(self, rising, falling, initial, num_samples, sample_rate=None, gaps=None):
+        self.rising = rising
+        self.falling = falling
+        self.initial = initial
+        self.num_samples = num_samples
+        self.sample_rate = sample_rate
+        self.gaps = np.zeros(0, dtype=np.int64) if gaps is None else np.asarray(gaps, dtype=np.int64)
+
+    @property
+    def num_channels(self):
+        return len(self.rising)
+
+    @classmethod
+    def build(cls, source, num_channels, sample_rate=None, chunk_size=CHUNK_SIZE, gaps=None):
+        rising = [[] for _ in range(num_channels)]
+        falling = [[] for _ in range(num_channels)]
+        initial = None
+        offset = 0
+        prev = None
+        for words in iter_words(source, num_channels, chunk_size):
+            if initial is None:
+                initial = [int(words[0] >> ch) & 1 for ch in range(num_channels)]
+            pos = np.flatnonzero(words[1:] != words[:-1])
+            changed = words[pos] ^ words[pos + 1]
+            after = words[pos + 1]
+            if prev is not None and prev != words[0]:
+                pos = np.concatenate(([-1], pos))
+                changed = np.concatenate(([prev ^ words[0]], changed))
+                after = np.concatenate(([words[0]], after))
+            pos = pos + offset
+            for ch in range(num_channels):
+                hit = ((changed >> ch) & 1).astype(bool)
+                high = ((after[hit] >> ch) & 1).astype(bool)
+                rising[ch].append(pos[hit][high])
+                falling[ch].append(pos[hit][~high])
+            offset += len(words)
+            prev = words[-1]
+        empty = np.zeros(0, dtype=np.int64)
+        return cls([np.concatenate([empty] + r) for r in rising],
+                   [np.concatenate([empty] + f) for f in falling],
+                   initial or [0] * num_channels, offset, sample_rate, gaps)
+
+    @classmethod
+    def build_parallel(cls, path, num_channels, sample_rate=None, workers=None,
+                       chunk_size=CHUNK_SIZE, executor=None, progress=None):
+        """
+        Build the index of a capture file on a process pool.
+
+        The file is split into time segments that every worker maps on its
+        own, so the capture is shared through the page cache instead of being
+        pickled. Edges on the segment boundaries are stitched afterwards; the
+        result is identical to build() given the gaps of the file.
+
+        executor reuses a long-lived pool instead of starting one per call.
+        progress(done, total) is called as segments complete; an exception
+        raised from it cancels the segments still pending.
+        """
+        workers = workers or os.cpu_count() or 1
+        width = sample_width(num_channels)
+        gaps = gap_samples(read_capture_info(path))
+        base, size = payload_range(path)
+        size -= size % width
+        segment = -(-size // (workers * 4))
+        segment = max(chunk_size, segment + (-segment) % width)
+        if workers == 1 or size <= segment:
+            index = cls.build(load_capture(path), num_channels, sample_rate, chunk_size, gaps)
+            if progress:
+                progress(1, 1)
+            return index
+        offsets = range(0, size, segment)
+        pool = executor or ProcessPoolExecutor(max_workers=workers)
+        try:
+            futures = [pool.submit(_index_segment, path, base + o, min(segment, size - o),
+                                   num_channels, chunk_size) for o in offsets]
+            try:
+                for done, _ in enumerate(as_completed(futures), 1):
+                    if progress:
+                        progress(done, len(futures))
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+            parts = [future.result() for future in futures]
+        finally:
+            if executor is None:
+                pool.shutdown()
+        rising = [[] for _ in range(num_channels)]
+        falling = [[] for _ in range(num_channels)]
+        start = 0
+        prev = None
+        for index, first, last in parts:
+            if prev is not None and prev != first:
+                changed = prev ^ first
+                for ch in range(num_channels):
+                    if (changed >> ch) & 1:
+                        edges = rising if (first >> ch) & 1 else falling
+                        edges[ch].append(np.array([start - 1]))
+            for ch in range(num_channels):
+                rising[ch].append(index.rising[ch] + start)
+                falling[ch].append(index.falling[ch] + start)
+            start += index.num_samples
+            prev = last
+        return cls([np.concatenate(r) for r in rising],
+                   [np.concatenate(f) for f in falling],
+                   parts[0][0].initial, start, sample_rate, gaps)
+
+    @classmethod
+    def from_capture(cls, capture):
+        """Build the index from a bit-packed Capture."""
+        return cls([capture.rising_edges(ch) for ch in range(capture.num_channels)],
+                   [capture.falling_edges(ch) for ch in range(capture.num_channels)],
+                   [int(capture.planes[ch, 0] & 1) if capture.num_samples else 0
+                    for ch in range(capture.num_channels)],
+                   capture.num_samples, capture.sample_rate)
+
+    def edges(self, ch):
+        """All transitions of a channel, sorted."""
+        return np.sort(np.concatenate((self.rising[ch], self.falling[ch])))
+
+    def level_at(self, ch, positions):
+        """Logic level of a channel at the given sample positions."""
+        flips = np.searchsorted(self.edges(ch), positions, side='left')
+        return (self.initial[ch] ^ (flips & 1)).astype(np.uint8)
+
+    def pwm_stats(self, ch):
+        """Same result as measure_channels on the capture samples and gaps, as PwmStats."""
+        rising = self.rising[ch]
+        gaps = self.gaps
+        if len(gaps):
+            # An edge at gap - 1 joins samples that were not adjacent
+            rising = rising[~np.isin(rising, gaps - 1)]
+        if len(rising) < 2:
+            return None
+        start, stop = rising[:-1], rising[1:]
+        if len(gaps):
+            # Periods holding a gap are not measured
+            kept = np.searchsorted(gaps, start, side='right') == np.searchsorted(gaps, stop, side='right')
+            start, stop = start[kept], stop[kept]
+        # Exactly one falling edge lies within a period
+        falling = self.falling[ch]
+        periods = (stop - start).astype(np.float64)
+        period, duty = RunningStats(), RunningStats()
+        period.add(periods)
+        if len(periods):
+            duty.add((falling[np.searchsorted(falling, start)] - start) / periods)
+        return _pwm_stats(self.sample_rate, period, duty)
+
+    def pwm_freq(self, ch):
+        stats = self.pwm_stats(ch)
+        return stats.freq if stats else None
+
+    def pwm_duty(self, ch):
+        stats = self.pwm_stats(ch)
+        return stats.duty_mean if stats else None
+
+    def pulse_widths(self, ch, level=1):
+        """Widths in samples of every complete high (level=1) or low pulse."""
+        start, stop = (self.rising[ch], self.falling[ch]) if level else (self.falling[ch], self.rising[ch])
+        if len(start) == 0 or len(stop) == 0:
+            return np.zeros(0, dtype=np.int64)
+        first = np.searchsorted(stop, start[0], side='right')
+        stop = stop[first:]
+        count = min(len(start), len(stop))
+        return stop[:count] - start[:count]
+
+    def glitches(self, ch, max_width):
+        """Start positions of pulses of either level shorter than max_width samples."""
+        edges = self.edges(ch)
+        short = np.flatnonzero(np.diff(edges) < max_width)
+        return edges[short] + 1
+
+def _index_segment(path, offset, length, num_channels, chunk_size):
+    # Worker side of TransitionIndex.build_parallel
+    raw = np.memmap(path, dtype=np.uint8, mode='r', offset=offset, shape=(length,))
+    width = sample_width(num_channels)
+    index = TransitionIndex.build(raw, num_channels, None, chunk_size)
+    first = int(decode_words(raw[:width], num_channels)[0])
+    last = int(decode_words(raw[-width:], num_channels)[-1])
+    return index, first, last
+
+def measure_channels_parallel(path, num_channels, sample_rate, workers=None):
+    """PWM statistics of every channel, analysed on all cores."""
+    index = TransitionIndex.build_parallel(path, num_channels, sample_rate, workers)
+    return [index.pwm_stats(ch) for ch in range(num_channels)]
+
+# Number of set bits for every byte value
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+class Capture:
+    """
+    Bit-packed store of a multi-channel capture.
+
+    Each channel is kept as one bit plane (np.packbits, little bit order), so
+    sample i of a channel is bit i % 8 of byte i // 8 of its plane. A plane
+    costs one bit per sample instead of one or two bytes, and edge and
+    popcount queries run directly on the packed bytes.
+    """
+
+    def __init__(self, planes, num_samples, sample_rate=None):
+        self.planes = planes
+        self.num_samples = num_samples
+        self.sample_rate = sample_rate
+
+    @property
+    def num_channels(self):
+        return len(self.planes)
+
+    def __len__(self):
+        return self.num_samples
+
+    @classmethod
+    def from_raw(cls, raw, num_channels, sample_rate=None, chunk_size=CHUNK_SIZE):
+        """Pack a raw capture (bytes-like or memmap) block by block."""
+        n = num_samples(len(raw), num_channels)
+        if num_channels == 1:
+            # 1ch raw data already is a little bit order plane
+            return cls(np.frombuffer(raw, dtype=np.uint8).reshape(1, -1), n, sample_rate)
+        planes = np.empty((num_channels, -(-n // 8)), dtype=np.uint8)
+        # Keep every block a whole number of plane bytes (8 samples): a multiple
+        # of 16 makes block_bytes a multiple of num_channels
+        chunk_size = max(16, chunk_size - chunk_size % 16)
+        pos = 0
+        for channels in iter_channel_blocks(raw, num_channels, chunk_size):
+            count = len(channels[0])
+            end = pos + -(-count // 8)
+            for ch, samples in enumerate(channels):
+                planes[ch, pos:end] = np.packbits(samples, bitorder='little')
+            pos = end
+        return cls(planes, n, sample_rate)
+
+    @classmethod
+    def load(cls, path, num_channels, sample_rate=None):
+        return cls.from_raw(load_capture(path), num_channels, sample_rate)
+
+    def channel(self, ch, start=0, stop=None):
+        """Unpack samples [start, stop) of one channel into a uint8 array."""
+        if stop is None or stop > self.num_samples:
+            stop = self.num_samples
+        if start >= stop:
+            return np.empty(0, dtype=np.uint8)
+        first = start // 8
+        bits = np.unpackbits(self.planes[ch, first:-(-stop // 8)], bitorder='little')
+        return bits[start - first * 8:stop - first * 8]
+
+    def _transitions(self, ch):
+        # Bit i of `nxt` holds sample i + 1; the bit past the end never matches
+        plane = self.planes[ch]
+        nxt = plane >> 1
+        nxt[:-1] |= (plane[1:] & 1) << 7
+        valid = np.full(len(plane), 0xFF, dtype=np.uint8)
+        if len(valid):
+            valid[-1] = (1 << ((self.num_samples - 1) % 8)) - 1
+        return plane, nxt, valid
+
+    @staticmethod
+    def _bit_positions(mask):
+        idx = np.flatnonzero(mask)
+        bits = np.unpackbits(mask[idx][:, None], axis=1, bitorder='little')
+        rows, cols = np.nonzero(bits)
+        return idx[rows].astype(np.int64) * 8 + cols
+
+    def rising_edges(self, ch):
+        """Index of the last low sample before every 0->1 transition."""
+        plane, nxt, valid = self._transitions(ch)
+        return self._bit_positions(~plane & nxt & valid)
+
+    def falling_edges(self, ch):
+        """Index of the last high sample before every 1->0 transition."""
+        plane, nxt, valid = self._transitions(ch)
+        return self._bit_positions(plane & ~nxt & valid)
+
+    def edge_count(self, ch):
+        """Number of transitions in either direction."""
+        plane, nxt, valid = self._transitions(ch)
+        return int(_POPCOUNT[(plane ^ nxt) & valid].sum(dtype=np.int64))
+
+    def count_high(self, ch, start=0, stop=None):
+        """Number of high samples in [start, stop)."""
+        if stop is None or stop > self.num_samples:
+            stop = self.num_samples
+        if start >= stop:
+            return 0
+        return int(np.diff(self.high_before(ch, np.array([start, stop]))).item())
+
+    def high_before(self, ch, positions):
+        """For sorted sample positions, the number of high samples before each."""
+        positions = np.asarray(positions, dtype=np.int64)
+        if len(positions) == 0:
+            return np.zeros(0, dtype=np.int64)
+        plane = np.append(self.planes[ch], np.uint8(0))
+        pc = _POPCOUNT[plane]
+        byte = positions >> 3
+        idx = np.concatenate(([0], byte))
+        sums = np.add.reduceat(pc, idx, dtype=np.int64)[:-1]
+        sums[idx[1:] == idx[:-1]] = 0
+        partial = plane[byte] & ((1 << (positions & 7)) - 1).astype(np.uint8)
+        return np.cumsum(sums) + _POPCOUNT[partial]
+
+    def pwm_freq(self, ch):
+        edges = self.rising_edges(ch)
+        if len(edges) < 2 or edges[-1] == edges[0]:
+            return None
+        return self.sample_rate * (len(edges) - 1) / (edges[-1] - edges[0])
+
+    def pwm_duty(self, ch):
+        edges = self.rising_edges(ch)
+        if len(edges) < 2:
+            return None
+        highs = self.high_before(ch, edges)
+        return float(np.mean(np.diff(highs) / np.diff(edges)))
@@ -0,0 +1,184 @@
+"""
+Headless production test of every connected SLogic16U3.
+
+Analyzers are enumerated by bus/port location (slogic_cli --list) and
+captured concurrently, one slogic_cli --device per unit. Every channel is
+checked against the expected PWM frequency/duty of a JSON station config
+and the verdicts are written as JSON for the station software; the exit
+status is 0 only if every unit passed.
+
+    python production.py station.json -o results.json
+
+Config keys (all but "expected" optional):
+
+    {
+      "cli": "../cli/build/slogic_cli",
+      "sample_rate_mhz": 400, "channels": 8, "voltage": 1600, "timeout": 5,
+      "live": true, "min_periods": 1000,
+      "freq_tolerance": 0.05, "duty_tolerance": 5,
+      "expected": [{"freq": 10000000, "duty": 50}, null, ...]
+    }
+
+"expected" lists one {"freq": Hz, "duty": %} per channel; null or missing
+trailing entries leave a channel unchecked. In live mode the capture is
+streamed and stopped as soon as every checked channel has min_periods periods,
+otherwise the whole capture file is written and analysed.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from logic_analyzer import (TransitionIndex, check_pwm, dropped_ranges, read_capture_info,
+                            load_capture, num_samples, FREQ_TOLERANCE, DUTY_TOLERANCE)
+from live_test import run_live
+
+DEFAULT_CONFIG = {
+    'cli': os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../cli/build/slogic_cli'),
+    'sample_rate_mhz': 400,
+    'channels': 16,
+    'voltage': 3300,
+    'timeout': 5,
+    'live': True,
+    'min_periods': 1000,
+    'freq_tolerance': FREQ_TOLERANCE,
+    'duty_tolerance': DUTY_TOLERANCE,
+}
+
+def load_config(path):
+    with open(path) as f:
+        config = dict(DEFAULT_CONFIG, **json.load(f))
+    if 'expected' not in config:
+        raise ValueError(f"{path}: missing 'expected'")
+    if len(config['expected']) > config['channels']:
+        raise ValueError(f"{path}: {len(config['expected'])} expectations for {config['channels']} channels")
+    # Relative CLI paths are relative to the config file
+    config['cli'] = os.path.join(os.path.dirname(os.path.abspath(path)), config['cli'])
+    return config
+
+def list_devices(cli):
+    """Bus/port locations of the connected analyzers, e.g. ['1-2', '1-3.1']."""
+    out = subprocess.run([cli, '--list'], capture_output=True, text=True, check=True).stdout
+    return [line.strip() for line in out.splitlines() if line.strip()]
+
+def _cli_command(config, location):
+    return [config['cli'], '--device', location,
+            '--sr', str(config['sample_rate_mhz']), '--ch', str(config['channels']),
+            '--volt', str(config['voltage']), '--timeout', str(config['timeout'])]
+
+def _capture_live(config, location, log, workdir):
+    cmd = _cli_command(config, location) + ['--stream', '-']
+    # Unchecked channels may be idle and must not hold back the early stop
+    checked = [ch for ch, expected in enumerate(config['expected']) if expected]
+    return run_live(cmd, config['min_periods'], checked, stderr=log, cwd=workdir)
+
+def _capture_file(config, location, log, workdir, pool):
+    subprocess.run(_cli_command(config, location), stdout=log, stderr=subprocess.STDOUT,
+                   cwd=workdir, check=True)
+    bin_files = [f for f in os.listdir(workdir) if f.endswith('_wave.bin')]
+    if not bin_files:
+        raise RuntimeError("slogic_cli wrote no capture file")
+    path = os.path.join(workdir, max(bin_files, key=lambda f: os.path.getmtime(os.path.join(workdir, f))))
+    info = read_capture_info(path)
+    num_channels, sample_rate, dropped = config['channels'], config['sample_rate_mhz'] * 1e6, 0
+    if info is not None:
+        # Container header is authoritative over the requested settings
+        num_channels, sample_rate = info.num_channels, info.sample_rate
+        dropped = sum(b - a for a, b in dropped_ranges(info))
+    index = TransitionIndex.build_parallel(path, num_channels, sample_rate, executor=pool)
+    results = [index.pwm_stats(ch) for ch in range(num_channels)]
+    return results, num_samples(len(load_capture(path)), num_channels), dropped
+
+def check_device(config, location, workdir, pool=None):
+    """Capture one analyzer and evaluate it; returns a JSON-serializable dict."""
+    os.makedirs(workdir, exist_ok=True)
+    for f in os.listdir(workdir):
+        if f.endswith('_wave.bin'):
+            os.remove(os.path.join(workdir, f))
+    report = {'device': location, 'pass': False, 'error': None, 'seconds': None,
+              'samples': 0, 'dropped_bytes': 0, 'channels': []}
+    start = time.time()
+    try:
+        with open(os.path.join(workdir, 'slogic_cli.log'), 'wb') as log:
+            if config['live']:
+                results, samples, dropped = _capture_live(config, location, log, workdir)
+            else:
+                results, samples, dropped = _capture_file(config, location, log, workdir, pool)
+    except Exception as e:
+        report['error'] = f"{type(e).__name__}: {e}"
+        report['seconds'] = time.time() - start
+        return report
+    report.update(seconds=time.time() - start, samples=samples, dropped_bytes=dropped)
+    all_pass = True
+    for ch, stats in enumerate(results):
+        expected = config['expected'][ch] if ch < len(config['expected']) else None
+        entry = {'channel': ch,
+                 'freq': stats.freq if stats else None,
+                 'duty': stats.duty_mean * 100 if stats else None,
+                 'periods': stats.periods if stats else 0,
+                 'expected_freq': expected['freq'] if expected else None,
+                 'expected_duty': expected['duty'] if expected else None,
+                 'pass': None}
+        if expected:
+            entry['pass'] = check_pwm(stats, expected['freq'], expected['duty'],
+                                      config['freq_tolerance'], config['duty_tolerance'])
+            all_pass &= entry['pass']
+        report['channels'].append(entry)
+    report['pass'] = all_pass
+    return report
+
+def run_station(config, locations, workdir):
+    """Test all locations concurrently; returns the per-device reports in location order."""
+    pool = None
+    if not config['live']:
+        pool = ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn'))
+    try:
+        with ThreadPoolExecutor(max_workers=max(len(locations), 1)) as threads:
+            futures = [threads.submit(check_device, config, location,
+                                      os.path.join(workdir, location), pool)
+                       for location in locations]
+            return [future.result() for future in futures]
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description="Test every connected SLogic16U3 in parallel")
+    parser.add_argument('config', help="JSON station config")
+    parser.add_argument('--devices', help="comma-separated bus/port locations (default: all)")
+    parser.add_argument('--workdir', default='production_runs', help="per-device logs and captures")
+    parser.add_argument('-o', '--output', help="JSON results file (default: stdout)")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    locations = args.devices.split(',') if args.devices else list_devices(config['cli'])
+    if not locations:
+        print("No SLogic16U3 device found", file=sys.stderr)
+        sys.exit(2)
+    print(f"Testing {len(locations)} devices: {', '.join(locations)}", file=sys.stderr)
+    start = time.time()
+    devices = run_station(config, locations, args.workdir)
+    report = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': os.path.abspath(args.config),
+        'seconds': time.time() - start,
+        'pass': all(d['pass'] for d in devices),
+        'devices': devices,
+    }
+    for d in devices:
+        verdict = 'PASS' if d['pass'] else 'FAIL'
+        detail = d['error'] or ", ".join(f"CH{c['channel']}" for c in d['channels'] if c['pass'] is False)
+        print(f"{d['device']}: {verdict}{' (' + detail + ')' if detail else ''}", file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    sys.exit(0 if report['pass'] else 1)
+
+if __name__ == "__main__":
+    main()
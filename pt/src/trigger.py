@@ -0,0 +1,151 @@
+"""
+Trigger search over raw capture words.
+
+A Trigger combines level and edge conditions across channels, e.g. CH0
+rising while CH3 is high, or a multi-bit pattern with don't-care channels.
+Matches are found with vectorized operations on the packed sample words
+(see logic_analyzer.decode_words), block by block, so captures larger than
+RAM are searched with bounded memory.
+
+    python trigger.py 8ch_400M_wave.bin "0=r,3=1"
+"""
+import os
+import sys
+import numpy as np
+from logic_analyzer import CHUNK_SIZE, iter_words, open_capture
+
+# Condition characters accepted by Trigger.parse
+LEVEL_LOW, LEVEL_HIGH = '0', '1'
+EDGE_RISING, EDGE_FALLING, EDGE_ANY = 'r', 'f', 'e'
+DONT_CARE = 'x'
+
+class Trigger:
+    """
+    A condition on consecutive sample words.
+
+    Every argument is a channel bit mask. Sample i matches when
+    (word[i] & mask) == value and every channel in rising, falling and edge
+    changed accordingly between samples i - 1 and i. The reported offset is
+    the first sample at which the condition holds, so an edge matches at
+    its TransitionIndex position + 1. Sample 0 never matches an edge
+    condition.
+    """
+
+    def __init__(self, mask=0, value=0, rising=0, falling=0, edge=0):
+        if value & ~mask:
+            raise ValueError("Trigger value has bits outside its mask")
+        self.mask = mask
+        self.value = value
+        self.rising = rising
+        self.falling = falling
+        self.edge = edge
+
+    @classmethod
+    def parse(cls, text):
+        """
+        Build a trigger from "ch=cond,..." (e.g. "0=r,3=1") or a pattern
+        string with the highest channel first (e.g. "1xx0" or "xxr1").
+
+        cond is 0/1 for a level, r/f for a rising/falling edge, e for any
+        edge and x for don't care.
+        """
+        text = text.strip().lower()
+        if '=' in text:
+            conditions = {}
+            for item in text.split(','):
+                ch, cond = item.split('=')
+                conditions[int(ch.strip().lstrip('ch'))] = cond.strip()
+        else:
+            conditions = dict(enumerate(reversed(text)))
+        masks = {LEVEL_LOW: 0, LEVEL_HIGH: 0, EDGE_RISING: 0, EDGE_FALLING: 0,
+                 EDGE_ANY: 0, DONT_CARE: 0}
+        for ch, cond in conditions.items():
+            if cond not in masks:
+                raise ValueError(f"Unknown trigger condition '{cond}' for CH{ch}")
+            masks[cond] |= 1 << ch
+        return cls(masks[LEVEL_LOW] | masks[LEVEL_HIGH], masks[LEVEL_HIGH],
+                   masks[EDGE_RISING], masks[EDGE_FALLING], masks[EDGE_ANY])
+
+    @property
+    def channels(self):
+        """Bit mask of every channel the trigger looks at."""
+        return self.mask | self.rising | self.falling | self.edge
+
+    @property
+    def has_edge(self):
+        return bool(self.rising | self.falling | self.edge)
+
+    def _terms(self, dtype):
+        # Reduce all conditions to: (after & after_mask) == after_value,
+        # (before & before_mask) == before_value, ((before ^ after) & edge) == edge
+        t = np.dtype(dtype).type
+        return (t(self.mask | self.rising | self.falling), t(self.value | self.rising),
+                t(self.rising | self.falling), t(self.falling), t(self.edge))
+
+    def match(self, words, prev=None):
+        """
+        Indices into words of the matching samples.
+
+        prev is the word preceding words[0] (None at the start of a capture).
+        """
+        after_mask, after_value, before_mask, before_value, edge = self._terms(words.dtype)
+        if not self.has_edge:
+            return np.flatnonzero((words & after_mask) == after_value)
+        # An edge condition needs a change, so only changed words are candidates
+        pos = np.flatnonzero(words[1:] != words[:-1]) + 1
+        if prev is not None and prev != words[0]:
+            pos = np.concatenate(([0], pos))
+            before = np.concatenate(([prev], words[pos[1:] - 1])).astype(words.dtype)
+        else:
+            before = words[pos - 1]
+        after = words[pos]
+        hit = (((after & after_mask) == after_value)
+               & ((before & before_mask) == before_value)
+               & (((before ^ after) & edge) == edge))
+        return pos[hit]
+
+def iter_triggers(source, num_channels, trigger, chunk_size=CHUNK_SIZE):
+    """Yield the absolute sample offsets of the matches, one array per block."""
+    if trigger.channels >> num_channels:
+        raise ValueError(f"Trigger uses channels beyond CH{num_channels - 1}")
+    offset = 0
+    prev = None
+    for words in iter_words(source, num_channels, chunk_size):
+        yield trigger.match(words, prev) + offset
+        offset += len(words)
+        prev = words[-1]
+
+def find_triggers(source, num_channels, trigger, limit=None, chunk_size=CHUNK_SIZE):
+    """
+    Sorted sample offsets of all matches (at most limit of them).
+
+    With a limit the search stops at the block holding the last wanted
+    match, so looking for the first trigger only reads up to it.
+    """
+    found = []
+    count = 0
+    for offsets in iter_triggers(source, num_channels, trigger, chunk_size):
+        found.append(offsets)
+        count += len(offsets)
+        if limit is not None and count >= limit:
+            break
+    result = np.concatenate([np.zeros(0, dtype=np.int64)] + found)
+    return result if limit is None else result[:limit]
+
+def main():
+    if len(sys.argv) not in (3, 4):
+        print("Usage: python trigger.py <capture file> <trigger> [limit]")
+        print('  trigger: "0=r,3=1" (CH0 rising while CH3 high) or a pattern like "1xx0"')
+        sys.exit(1)
+    path, spec = sys.argv[1], sys.argv[2]
+    limit = int(sys.argv[3]) if len(sys.argv) == 4 else None
+    raw, info = open_capture(path)
+    offsets = find_triggers(raw, info.num_channels, Trigger.parse(spec), limit)
+    print(f"{os.path.basename(path)}: {len(offsets)} matches")
+    for pos in offsets[:20]:
+        print(f"  sample {pos}  t = {pos / info.sample_rate * 1e6:.3f} us")
+    if len(offsets) > 20:
+        print("  ...")
+
+if __name__ == "__main__":
+    main()
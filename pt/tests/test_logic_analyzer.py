@@ -0,0 +1,90 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import logic_analyzer as la
+
+SAMPLE_RATE = 400e6
+
+def write_pwm_capture(path, num_channels, count, seed=0):
+    """8-bit capture of jittered PWM, a different period and duty per channel."""
+    rng = np.random.default_rng(seed)
+    words = np.zeros(count, dtype=np.uint8)
+    for ch in range(num_channels):
+        pos, bits = 0, []
+        while pos < count:
+            period = 40 + 7 * ch + int(rng.integers(0, 3))
+            high = period * (ch + 2) // (num_channels + 3)
+            bits.append(np.r_[np.ones(high, np.uint8), np.zeros(period - high, np.uint8)])
+            pos += period
+        words |= np.concatenate(bits)[:count] << ch
+    words.tofile(path)
+
+@pytest.fixture(scope='module')
+def capture(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('capture') / '8ch_400M_wave.bin')
+    write_pwm_capture(path, 8, 1 << 20)
+    return path
+
+def test_running_stats_independent_of_blocks():
+    values = np.random.default_rng(1).random(10000) * 1e-9 + 0.5
+    whole = la.RunningStats()
+    whole.add(values)
+    blocks = la.RunningStats()
+    for part in np.array_split(values, 37):
+        blocks.add(part)
+    assert whole.result() == blocks.result()
+    assert whole.result()[3] == pytest.approx(np.std(values), rel=1e-9)
+
+def test_constant_duty_has_zero_std():
+    stats = la.RunningStats()
+    stats.add(np.full(10000, 0.5))
+    assert stats.result() == (0.5, 0.5, 0.5, 0.0)
+
+def test_serial_and_parallel_measurements_are_identical(capture):
+    serial = la.measure_channels(la.load_capture(capture), 8, SAMPLE_RATE, chunk_size=65536)
+    parallel = la.measure_channels_parallel(capture, 8, SAMPLE_RATE, workers=2)
+    index = la.TransitionIndex.build_parallel(capture, 8, SAMPLE_RATE, workers=2, chunk_size=65536)
+    assert all(stats is not None and stats.periods > la.RunningStats.GROUP for stats in serial)
+    assert serial == parallel
+    assert serial == [index.pwm_stats(ch) for ch in range(8)]
+
+def test_measurements_restart_at_dropped_data(tmp_path):
+    # Exact 40-sample PWM per channel; blocks of the stream are dropped so that
+    # the samples on both sides of each gap are out of phase
+    period = 40
+    phase = np.arange(1 << 20) % period
+    stream = np.zeros(len(phase), dtype=np.uint8)
+    for ch in range(8):
+        stream |= (phase < 8 + 3 * ch).astype(np.uint8) << ch
+    path = str(tmp_path / '8ch_400M_wave.bin')
+    rng = np.random.default_rng(2)
+    blocks = []
+    with la.CaptureWriter(path, 8, SAMPLE_RATE) as writer:
+        pos = 0
+        while pos < len(stream) - 20000:
+            length = int(rng.integers(5000, 20000))
+            writer.append(stream[pos:pos + length], pos)
+            blocks.append((pos, stream[pos:pos + length]))
+            pos += length + int(rng.integers(1, period))
+    info = la.read_capture_info(path)
+    gaps = la.gap_samples(info)
+    assert len(gaps) == len(blocks) - 1
+
+    serial = la.measure_channels(la.load_capture(path), 8, SAMPLE_RATE, chunk_size=65536, gaps=gaps)
+    for ch, stats in enumerate(serial):
+        assert (stats.period_min, stats.period_max, stats.period_std) == (period, period, 0.0)
+        assert stats.duty_min == stats.duty_max == pytest.approx((8 + 3 * ch) / period)
+    index = la.TransitionIndex.build(la.load_capture(path), 8, SAMPLE_RATE, 65536, gaps)
+    parallel = la.TransitionIndex.build_parallel(path, 8, SAMPLE_RATE, workers=2, chunk_size=65536)
+    live = la.LiveMeasurement(8, SAMPLE_RATE)
+    for stream_offset, data in blocks:
+        live.feed(data.tobytes(), stream_offset)
+    assert serial == [index.pwm_stats(ch) for ch in range(8)]
+    assert serial == [parallel.pwm_stats(ch) for ch in range(8)]
+    assert serial == live.results()
+    # Without the gaps every one of them adds a wrong period
+    joined = la.measure_channels(la.load_capture(path), 8, SAMPLE_RATE, chunk_size=65536)
+    assert max(stats.period_max for stats in joined) > period